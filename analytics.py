@@ -0,0 +1,173 @@
+import os
+import pickle
+import time
+from collections import Counter
+from heapq import heapify, heappush, heappop
+from urllib.parse import urlparse
+
+from utils import metrics
+
+# Subdomains of this domain are listed in the report with their page counts
+report_domain = "ics.uci.edu"
+
+
+class SpaceSaving(object):
+    ''' Approximate word counts in bounded memory, the Space-Saving algorithm
+    (Metwally et al.). At most `capacity` words are tracked. A new word takes
+    the place of the word with the smallest count and starts from that count,
+    so a count is too high by at most errors[word]. Any word that makes up more
+    than 1 / capacity of all the words seen is guaranteed to be tracked. '''
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counts = dict()
+        self.errors = dict()
+        # (count, word) for every tracked word. Counts only grow, so an entry
+        # can be lower than the real count, it is fixed when it reaches the top
+        self.heap = []
+
+    def add(self, word, count: int = 1):
+        if word in self.counts:
+            self.counts[word] += count
+            return
+        error = 0
+        if len(self.counts) >= self.capacity:
+            while True:
+                smallest, evicted = heappop(self.heap)
+                if self.counts[evicted] == smallest:
+                    break
+                heappush(self.heap, (self.counts[evicted], evicted))
+            del self.counts[evicted]
+            del self.errors[evicted]
+            error = smallest
+        self.counts[word] = error + count
+        self.errors[word] = error
+        heappush(self.heap, (error + count, word))
+
+    def update(self, word_counts):
+        # Same as Counter.update, for a dict of counts or another SpaceSaving
+        if isinstance(word_counts, SpaceSaving):
+            word_counts = word_counts.counts
+        for word, count in word_counts.items():
+            self.add(word, count)
+
+    def items(self):
+        return self.counts.items()
+
+    def most_common(self, n: int = None):
+        return sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:n]
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # The saved heap may be stale, rebuild it from the counts
+        self.heap = [(count, word) for word, count in self.counts.items()]
+        heapify(self.heap)
+
+
+class CrawlAnalytics(object):
+    ''' Statistics for the report, updated one page at a time. Every page
+    gets its own, which the frontier merges into the scraper's totals once the
+    page's url is flushed to the save file, and the totals are checkpointed next
+    to it so a report can be written during the crawl or after a crash (see
+    report.py).
+
+    top_words -> 0 counts every word exactly, otherwise only about the top_words
+                 most frequent words are kept, see SpaceSaving
+    '''
+
+    def __init__(self, top_words: int = 0):
+        self.top_words = top_words
+        self.clear()
+
+    def clear(self):
+        self.pages = 0
+        # host -> number of unique pages, for the hosts under report_domain
+        self.subdomain_pages = Counter()
+        self.longest_page = ""
+        self.longest_page_words = 0
+        self.word_frequency = SpaceSaving(self.top_words) if self.top_words else Counter()
+        # reason -> number of responses the scraper did not use, see pagegate.py and scraper.py
+        self.rejections = Counter()
+
+    def add_page(self, url: str):
+        # A unique page was crawled, counted once per canonical url
+        self.pages += 1
+        host = urlparse(url).hostname or ""
+        if host.endswith("." + report_domain):
+            self.subdomain_pages[host] += 1
+
+    def reject(self, reason: str):
+        self.rejections[reason] += 1
+        metrics.count("rejected", reason=reason)
+
+    def add_words(self, url: str, word_freq: dict, num_words: int):
+        self.word_frequency.update(word_freq)
+        if num_words > self.longest_page_words:
+            self.longest_page = url
+            self.longest_page_words = num_words
+
+    def merge(self, other):
+        self.pages += other.pages
+        self.subdomain_pages.update(other.subdomain_pages)
+        if other.longest_page_words > self.longest_page_words:
+            self.longest_page = other.longest_page
+            self.longest_page_words = other.longest_page_words
+        self.word_frequency.update(other.word_frequency)
+        self.rejections.update(other.rejections)
+
+    def save(self, path: str):
+        # Written to a temporary file and moved over the checkpoint, so a reader never sees half of it
+        with open(path + ".tmp", "wb") as file:
+            pickle.dump(self, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path, "rb") as file:
+            return pickle.load(file)
+
+    def write_report(self, path: str = "report.txt"):
+        with open(path, "w") as file:
+            file.write(f"1. {self.pages} unique pages found.\n")
+            file.write(f"2. The longest page is {self.longest_page} with {self.longest_page_words} words.\n")
+            file.write("3. The 50 most common words are: \n")
+            for word, count in self.word_frequency.most_common(50):
+                file.write(f"{word} -> {count}\n")
+            file.write(f"4. {len(self.subdomain_pages)}\n")
+            for host in sorted(self.subdomain_pages):
+                file.write(f"https://{host}, {self.subdomain_pages[host]}\n")
+
+
+def open_analytics(path: str, restart: bool, top_words: int = 0):
+    # Totals for a crawl: resumed from the checkpoint at path, or new when restarting or if there is none
+    if restart and os.path.exists(path):
+        os.remove(path)
+    if not restart and os.path.exists(path):
+        return CrawlAnalytics.load(path)
+    return CrawlAnalytics(top_words)
+
+
+if __name__ == "__main__":
+    # Accuracy and memory of SpaceSaving against exact counts on a Zipf-like stream of words
+    import random
+    import sys
+
+    random.seed(0)
+    words = [f"word{i}" for i in range(200000)]
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    stream = Counter(random.choices(words, weights, k=2000000))
+    pages = list(stream.items())
+    for capacity in (500, 2000, 10000):
+        top = SpaceSaving(capacity)
+        start = time.perf_counter()
+        for i in range(0, len(pages), 300):
+            top.update(dict(pages[i:i + 300]))
+        elapsed = time.perf_counter() - start
+        exact = [word for word, count in stream.most_common(50)]
+        found = [word for word, count in top.most_common(50)]
+        print(f"capacity {capacity:>6}: {len(set(exact) & set(found))}/50 of the top 50, "
+              f"{sys.getsizeof(top.counts) / 1024:8.1f} KiB of counts vs {sys.getsizeof(dict(stream)) / 1024:8.1f} KiB exact, "
+              f"{elapsed / len(pages) * 1e6:.2f} us/word")
@@ -0,0 +1,449 @@
+import itertools
+import json
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+from argparse import ArgumentParser
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from configparser import ConfigParser
+
+from utils.config import Config
+from utils.replay import ReplayServer, build_synthetic_corpus
+
+# Stages of a worker's loop that are timed
+stages = ("frontier", "download", "scrape", "add_urls", "complete")
+
+
+def timed_worker_factory():
+    # Built here so the crawler is only imported in the benchmark process
+    from crawler.worker import Worker
+
+    class TimedFrontier(object):
+        # The frontier as a worker sees it, with the time it waits for its next url and takes to complete one
+        def __init__(self, frontier, timings):
+            self.frontier = frontier
+            self.timings = timings
+
+        def get_tbd_url(self):
+            start = time.perf_counter()
+            try:
+                return self.frontier.get_tbd_url()
+            finally:
+                self.timings["frontier"].append(time.perf_counter() - start)
+
+        def mark_url_complete(self, url):
+            start = time.perf_counter()
+            try:
+                self.frontier.mark_url_complete(url)
+            finally:
+                self.timings["complete"].append(time.perf_counter() - start)
+
+        def __getattr__(self, name):
+            return getattr(self.frontier, name)
+
+    class TimedWorker(Worker):
+        # Worker with the time spent in every stage of its loop kept in self.timings
+        def __init__(self, worker_id, config, frontier):
+            self.timings = defaultdict(list)
+            super().__init__(worker_id, config, TimedFrontier(frontier, self.timings))
+
+        def _timed(self, stage, method, *args):
+            start = time.perf_counter()
+            try:
+                return method(*args)
+            finally:
+                self.timings[stage].append(time.perf_counter() - start)
+
+        def _download(self, url):
+            return self._timed("download", super()._download, url)
+
+        def _scrape(self, url, resp):
+            return self._timed("scrape", super()._scrape, url, resp)
+
+        def _add_urls(self, urls):
+            return self._timed("add_urls", super()._add_urls, urls)
+
+    return TimedWorker
+
+
+def benchmark_config(config_file, cache_server, threads, workdir, politeness, name):
+    import logging
+
+    # The per-url INFO lines would dominate the timings
+    logging.disable(logging.INFO)
+    cparser = ConfigParser()
+    cparser.read(config_file)
+    config = Config(cparser)
+    config.cache_server = tuple(cache_server)
+    config.threads_count = threads
+    config.time_delay = politeness
+    config.save_file = os.path.join(workdir, f"{name}.shelve")
+    config.record_file = None
+    # Stage timings need the threaded workers
+    config.fetch_mode = "threads"
+    return config
+
+
+def run_crawl(config_file, cache_server, threads, workdir, politeness):
+    # One crawl against the replay server, in a process of its own so the scraper's
+    # module state starts empty and the peak memory is this crawl's alone
+    from crawler import Crawler
+    import scraper
+
+    config = benchmark_config(config_file, cache_server, threads, workdir, politeness, f"frontier-{threads}")
+
+    start = time.perf_counter()
+    crawler = Crawler(config, True, worker_factory=timed_worker_factory())
+    crawler.start()
+    elapsed = time.perf_counter() - start
+
+    timings = defaultdict(list)
+    for worker in crawler.workers:
+        for stage, values in worker.timings.items():
+            timings[stage].extend(values)
+    latencies = dict()
+    for stage in stages:
+        values = sorted(timings[stage])
+        if values:
+            latencies[stage] = {
+                "mean": sum(values) / len(values) * 1000,
+                "p50": values[len(values) // 2] * 1000,
+                "p95": values[int(len(values) * 0.95)] * 1000}
+    return {
+        "threads": threads,
+        "fetched": len(timings["download"]),
+        "pages": scraper.totals.pages,
+        "seconds": elapsed,
+        "latencies": latencies,
+        # kilobytes on Linux
+        "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def run_sharded(config_file, cache_server, shards, threads, workdir, politeness, results):
+    # A crawl with SHARDS processes, started from a process of its own like run_crawl, but not
+    # from a process pool since its processes can not start processes themselves
+    from crawler.shard import crawl_sharded
+
+    config = benchmark_config(config_file, cache_server, threads, workdir, politeness, f"sharded-{shards}")
+    config.shards = shards
+    start = time.perf_counter()
+    totals = crawl_sharded(config, True)
+    results.put({"shards": shards, "threads": threads, "pages": totals.pages, "seconds": time.perf_counter() - start})
+
+
+def main_sharded(config_file, corpus, shards, threads, latency, error_rate, politeness, synthetic):
+    # pages/s of a sharded crawl for every number of shards, THREADCOUNT threads in each shard
+    cparser = ConfigParser()
+    cparser.read(config_file)
+    config = Config(cparser)
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as workdir:
+        if not corpus:
+            corpus = os.path.join(workdir, "synthetic.corpus")
+            # Over more hosts than the seeds have, so they can be spread evenly over the shards
+            build_synthetic_corpus(corpus, config.seed_urls, pages=synthetic, subdomains=8)
+            print(f"Generated a corpus of {synthetic} pages.")
+        results = []
+        for count in shards:
+            server = ReplayServer(corpus, latency=latency, error_rate=error_rate, seed=count)
+            cache_server = server.start()
+            queue = context.Queue()
+            try:
+                process = context.Process(
+                    target=run_sharded, args=(config_file, cache_server, count, threads, workdir, politeness, queue))
+                process.start()
+                result = queue.get()
+                process.join()
+            finally:
+                server.close()
+            result["fetched"] = server.requests - server.errors
+            results.append(result)
+            print(json.dumps(result))
+
+    print(f"\n{'shards':>6} {'threads':>7} {'fetched':>8} {'pages':>6} {'pages/s':>8} {'speedup':>8}")
+    for result in results:
+        rate = result["fetched"] / result["seconds"]
+        print(f"{result['shards']:>6} {result['threads']:>7} {result['fetched']:>8} {result['pages']:>6} "
+              f"{rate:>8.1f} {rate / (results[0]['fetched'] / results[0]['seconds']):>7.2f}x")
+
+
+def order_scorer(order, config):
+    # The url priorities compared by --orders
+    from urlscore import UrlScorer
+
+    if order == "lifo":
+        # Newest url first, the order of the frontier before it had priorities
+        sequence = itertools.count()
+        return lambda url, novelty, host_fetches: -next(sequence)
+    if order == "fifo":
+        return UrlScorer(0, 0, 0, 0, 0)
+    return UrlScorer.from_config(config)
+
+
+def run_budget(config_file, cache_server, order, budget, threads, workdir, politeness):
+    # A crawl that stops after `budget` downloads, with the urls prioritized by `order`
+    from crawler import Crawler
+    from crawler.frontier import Frontier
+    import scraper
+
+    config = benchmark_config(config_file, cache_server, threads, workdir, politeness, f"budget-{order}")
+    order, _, traps = order.partition("+")
+    if not traps:
+        config.trap_min_yield = 0
+
+    class BudgetFrontier(Frontier):
+        def __init__(self, config, restart):
+            super().__init__(config, restart, scorer=order_scorer(order, config))
+            self.handed_out = 0
+
+        def get_tbd_url(self):
+            with self.lock:
+                if self.handed_out >= budget:
+                    return None
+                self.handed_out += 1
+            return super().get_tbd_url()
+
+    start = time.perf_counter()
+    Crawler(config, True, frontier_factory=BudgetFrontier).start()
+    return {
+        "order": order + ("+traps" if traps else ""),
+        "seconds": time.perf_counter() - start,
+        "pages": scraper.totals.pages,
+        # Pages that made it past the near-duplicate check
+        "unique": len(scraper.fingerprints),
+        "rejections": dict(scraper.totals.rejections)}
+
+
+def main_orders(config_file, corpus, orders, budget, threads, latency, politeness, synthetic):
+    # Unique, non-duplicate pages reached within `budget` downloads for every url order
+    cparser = ConfigParser()
+    cparser.read(config_file)
+    config = Config(cparser)
+    with tempfile.TemporaryDirectory() as workdir:
+        if not corpus:
+            corpus = os.path.join(workdir, "synthetic.corpus")
+            # As many revision views of wiki pages as there are pages, for the orders to steer around
+            build_synthetic_corpus(corpus, config.seed_urls, pages=synthetic, subdomains=8, revisions=synthetic)
+            print(f"Generated a corpus of {synthetic} pages and {synthetic} wiki revisions.")
+        results = []
+        for order in orders:
+            server = ReplayServer(corpus, latency=latency)
+            cache_server = server.start()
+            try:
+                with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                    result = pool.submit(
+                        run_budget, config_file, cache_server, order, budget, threads, workdir, politeness).result()
+            finally:
+                server.close()
+            results.append(result)
+            print(json.dumps(result))
+
+    print(f"\n{'order':>11} {'budget':>7} {'pages':>6} {'unique':>7} {'duplicates':>11}")
+    for result in results:
+        print(f"{result['order']:>11} {budget:>7} {result['pages']:>6} {result['unique']:>7} "
+              f"{result['rejections'].get('near_duplicate', 0):>11}")
+
+
+def run_adaptive(config_file, cache_server, threads, bounds, workdir, politeness):
+    # A crawl with THREADCOUNT threads, and with the concurrency controller between bounds (min, max) if given,
+    # sampling the controller's limit every half second
+    from crawler import Crawler
+    import scraper
+
+    config = benchmark_config(config_file, cache_server, threads, workdir, politeness, f"adaptive-{threads}")
+    if bounds:
+        config.min_threads, config.max_threads = bounds
+    crawler = Crawler(config, True)
+    limits = []
+    start = time.perf_counter()
+    crawler.start_async()
+    while any(worker.is_alive() for worker in crawler.workers):
+        limits.append(crawler.controller.limit if crawler.controller is not None else threads)
+        time.sleep(0.5)
+    crawler.join()
+    return {"pages": scraper.totals.pages, "seconds": time.perf_counter() - start, "limits": limits}
+
+
+def main_adaptive(config_file, corpus, threads, bounds, latency, capacity, backlog, spikes, politeness, synthetic):
+    # Every --threads value as a fixed THREADCOUNT, and the first one as the start of an adaptive crawl, against
+    # a replay server that serves capacity requests at once and slows down by a factor during each spike
+    cparser = ConfigParser()
+    cparser.read(config_file)
+    config = Config(cparser)
+    runs = [(f"fixed {count}", count, None) for count in threads]
+    runs.append((f"adaptive {bounds[0]}-{bounds[1]}", threads[0], bounds))
+    with tempfile.TemporaryDirectory() as workdir:
+        if not corpus:
+            corpus = os.path.join(workdir, "synthetic.corpus")
+            build_synthetic_corpus(corpus, config.seed_urls, pages=synthetic)
+            print(f"Generated a corpus of {synthetic} pages.")
+        print(f"Cache server: {capacity} requests at once, {backlog} waiting, {latency * 1000:.0f} ms, "
+              + ", ".join(f"x{factor} from {start}s to {end}s" for start, end, factor in spikes))
+        results = []
+        for name, count, run_bounds in runs:
+            server = ReplayServer(corpus, latency=latency, seed=count, capacity=capacity, backlog=backlog, spikes=spikes)
+            cache_server = server.start()
+            try:
+                with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                    result = pool.submit(
+                        run_adaptive, config_file, cache_server, count, run_bounds, workdir, politeness).result()
+            finally:
+                server.close()
+            result["name"] = name
+            result["answers"] = server.answers
+            result["errors"] = server.errors
+            results.append(result)
+            print(json.dumps({key: value for key, value in result.items() if key not in ("answers", "limits")}))
+
+    # Pages served and 503s per second, and the number of downloads allowed at once
+    seconds = int(max(result["seconds"] for result in results)) + 1
+    print(f"\n{'second':>6} " + " ".join(f"{result['name']:>24}" for result in results))
+    print(f"{'':>6} " + " ".join(f"{'200/s 503/s limit':>24}" for result in results))
+    for second in range(seconds):
+        cells = []
+        for result in results:
+            ok = sum(1 for at, status in result["answers"] if second <= at < second + 1 and status == 200)
+            shed = sum(1 for at, status in result["answers"] if second <= at < second + 1 and status == 503)
+            limits = result["limits"][2 * second:2 * second + 2]
+            cells.append(f"{ok:>5} {shed:>5} {max(limits) if limits else '-':>5}" if second < result["seconds"] else "")
+        print(f"{second:>6} " + " ".join(f"{cell:>24}" for cell in cells))
+    print(f"\n{'run':>17} {'pages':>6} {'seconds':>8} {'pages/s':>8} {'503s':>6}")
+    for result in results:
+        print(f"{result['name']:>17} {result['pages']:>6} {result['seconds']:>8.1f} "
+              f"{result['pages'] / result['seconds']:>8.1f} {result['errors']:>6}")
+
+
+def main_pooling(config_file, corpus, threads, latency, synthetic, fetches):
+    # Downloads/s through utils.download's pooled keep-alive session, and with a new connection per request
+    # (requests.get, as utils.download did before it pooled), with every --threads value downloading at once
+    import sqlite3
+    from concurrent.futures import ThreadPoolExecutor
+
+    import cbor
+    import requests
+
+    from utils.download import download, sessions
+    from utils.response import Response
+
+    cparser = ConfigParser()
+    cparser.read(config_file)
+    config = Config(cparser)
+
+    def unpooled(url, config, logger=None):
+        host, port = config.cache_server
+        resp = requests.get(
+            f"http://{host}:{port}/", params=[("q", f"{url}"), ("u", f"{config.user_agent}")],
+            timeout=config.download_timeout)
+        return Response(cbor.loads(resp.content))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if not corpus:
+            corpus = os.path.join(workdir, "synthetic.corpus")
+            build_synthetic_corpus(corpus, config.seed_urls, pages=synthetic)
+            print(f"Generated a corpus of {synthetic} pages.")
+        db = sqlite3.connect(corpus)
+        urls = [url for url, in db.execute("SELECT url FROM responses")]
+        db.close()
+        urls = [urls[i % len(urls)] for i in range(fetches)]
+        results = []
+        for count in threads:
+            for name, fetch in (("pooled", download), ("unpooled", unpooled)):
+                server = ReplayServer(corpus, latency=latency)
+                config.cache_server = server.start()
+                config.threads_count = count
+                # A new session, sized for this many threads
+                sessions.clear()
+                try:
+                    start = time.perf_counter()
+                    with ThreadPoolExecutor(count) as pool:
+                        fetched = sum(1 for resp in pool.map(lambda url: fetch(url, config), urls) if resp.status == 200)
+                    elapsed = time.perf_counter() - start
+                finally:
+                    server.close()
+                results.append((count, name, fetched, elapsed))
+                print(json.dumps({"threads": count, "session": name, "fetched": fetched, "seconds": elapsed}))
+
+    print(f"\n{'threads':>7} {'session':>9} {'fetched':>8} {'fetches/s':>10}")
+    for count, name, fetched, elapsed in results:
+        print(f"{count:>7} {name:>9} {fetched:>8} {fetched / elapsed:>10.1f}")
+
+
+def main(config_file, corpus, threads, latency, error_rate, politeness, synthetic):
+    cparser = ConfigParser()
+    cparser.read(config_file)
+    config = Config(cparser)
+    with tempfile.TemporaryDirectory() as workdir:
+        if not corpus:
+            corpus = os.path.join(workdir, "synthetic.corpus")
+            build_synthetic_corpus(corpus, config.seed_urls, pages=synthetic)
+            print(f"Generated a corpus of {synthetic} pages.")
+        results = []
+        for count in threads:
+            server = ReplayServer(corpus, latency=latency, error_rate=error_rate, seed=count)
+            cache_server = server.start()
+            try:
+                with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                    result = pool.submit(
+                        run_crawl, config_file, cache_server, count, workdir, politeness).result()
+            finally:
+                server.close()
+            result["server_errors"] = server.errors
+            results.append(result)
+            print(json.dumps(result))
+
+    print(f"\n{'threads':>7} {'fetched':>8} {'pages/s':>8} {'peak MiB':>9}  "
+          + "  ".join(f"{stage + ' ms':>17}" for stage in stages))
+    print(f"{'':>36}" + "  ".join(f"{'mean/p50/p95':>17}" for stage in stages))
+    for result in results:
+        cells = []
+        for stage in stages:
+            latency = result["latencies"].get(stage)
+            cells.append(f"{latency['mean']:5.1f}/{latency['p50']:5.1f}/{latency['p95']:5.1f}" if latency else "-")
+        print(f"{result['threads']:>7} {result['fetched']:>8} {result['fetched'] / result['seconds']:>8.1f} "
+              f"{result['peak_rss_mib']:>9.1f}  " + "  ".join(f"{cell:>17}" for cell in cells))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Runs the Crawler end to end against a local replay of the cache server.")
+    parser.add_argument("--config_file", type=str, default="config.ini")
+    parser.add_argument("--corpus", type=str, default=None,
+                        help="corpus recorded with RECORD in config.ini, a synthetic one is generated if not given")
+    parser.add_argument("--synthetic", type=int, default=2000, help="pages in the generated corpus")
+    parser.add_argument("--threads", type=str, default="1,4,16", help="THREADCOUNT values to compare")
+    parser.add_argument("--latency", type=float, default=0.02, help="mean seconds the replay server takes to answer")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="fraction of requests answered with a 503")
+    parser.add_argument("--politeness", type=float, default=0.0, help="POLITENESS for the benchmark crawls")
+    parser.add_argument("--shards", type=str, default=None,
+                        help="SHARDS values to compare instead, with the first --threads value in every shard")
+    parser.add_argument("--orders", type=str, default=None,
+                        help="url orders to compare instead (lifo, fifo, score, each with an optional +traps), "
+                             "by the unique pages within --budget")
+    parser.add_argument("--budget", type=int, default=1000, help="downloads per crawl with --orders")
+    parser.add_argument("--adaptive", type=str, default=None,
+                        help="MINTHREADS,MAXTHREADS of an adaptive crawl to compare with the --threads values instead")
+    parser.add_argument("--capacity", type=int, default=8, help="requests the replay server serves at once with --adaptive")
+    parser.add_argument("--backlog", type=int, default=4, help="requests it lets wait, it answers the rest with a 503")
+    parser.add_argument("--spikes", type=str, default="10:20:4",
+                        help="start:end:factor seconds during which its latency is multiplied, comma separated")
+    parser.add_argument("--pooling", type=int, default=0,
+                        help="downloads through a pooled and an unpooled session to compare instead, no crawl")
+    args = parser.parse_args()
+    threads = [int(count) for count in args.threads.split(",")]
+    if args.pooling:
+        main_pooling(args.config_file, args.corpus, threads, args.latency, args.synthetic, args.pooling)
+    elif args.adaptive:
+        spikes = [tuple(float(part) for part in spike.split(":")) for spike in args.spikes.split(",") if spike]
+        main_adaptive(args.config_file, args.corpus, threads, tuple(int(bound) for bound in args.adaptive.split(",")),
+                      args.latency, args.capacity, args.backlog, spikes, args.politeness, args.synthetic)
+    elif args.orders:
+        main_orders(args.config_file, args.corpus, args.orders.split(","), args.budget, threads[0],
+                    args.latency, args.politeness, args.synthetic)
+    elif args.shards:
+        main_sharded(args.config_file, args.corpus, [int(count) for count in args.shards.split(",")], threads[0],
+                     args.latency, args.error_rate, args.politeness, args.synthetic)
+    else:
+        main(args.config_file, args.corpus, threads, args.latency, args.error_rate, args.politeness, args.synthetic)
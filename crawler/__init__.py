@@ -1,20 +1,58 @@
-from utils import get_logger
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from utils import get_logger, canonical, metrics
+from utils.pagestore import PageStore
+import scraper
 from crawler.frontier import Frontier
 from crawler.worker import Worker
+from crawler.concurrency import ConcurrencyController
 
 class Crawler(object):
     def __init__(self, config, restart, frontier_factory=Frontier, worker_factory=Worker):
         self.config = config
         self.logger = get_logger("CRAWLER")
+        # Stage timers, counters and queue depths, if METRICSINTERVAL or METRICSPORT is set
+        metrics.start(config)
+        # Canonical url rules from the config, before the frontier adds the first url
+        canonical.configure(config)
         self.frontier = frontier_factory(config, restart)
+        # Scraper checks pages against the robots.txt rules the frontier fetches
+        scraper.set_robots_cache(getattr(self.frontier, "robots", None))
+        # Report statistics are checkpointed next to the save file, and resumed with it
+        scraper.set_analytics(config.save_file + ".analytics", restart, config.top_words)
+        # Pages kept on disk for reprocess.py, if PAGESTORE is set
+        if config.page_store:
+            scraper.set_page_store(PageStore(
+                config.page_store, config.page_compression, config.flush_size, config.flush_interval))
         self.workers = list()
         self.worker_factory = worker_factory
+        self.parser_pool = None
+        # Adapts how many workers download at once to the cache server, if MAXTHREADS is set
+        self.controller = ConcurrencyController.from_config(config) if config.max_threads > 0 else None
 
     def start_async(self):
-        self.workers = [
-            self.worker_factory(worker_id, self.config, self.frontier)
-            for worker_id in range(self.config.threads_count)]
+        if self.config.parser_processes > 0:
+            # Workers only fetch, parsing happens in these processes. Spawned rather than forked
+            # because the parent has threads running by now.
+            self.parser_pool = ProcessPoolExecutor(
+                self.config.parser_processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=canonical.set_canonicalizer, initargs=(canonical.canonicalizer,))
+            scraper.set_parser_pool(self.parser_pool, 2 * self.config.parser_processes)
+        if self.config.fetch_mode == "async":
+            # One event loop thread running threads_count fetch tasks
+            from crawler.async_worker import AsyncWorker
+            self.workers = [AsyncWorker(0, self.config, self.frontier)]
+        else:
+            # With a controller MAXTHREADS workers are started, it lets THREADCOUNT of them download at first
+            count = self.config.max_threads if self.controller is not None else self.config.threads_count
+            self.workers = [
+                self.worker_factory(worker_id, self.config, self.frontier)
+                for worker_id in range(count)]
         for worker in self.workers:
+            if self.controller is not None and hasattr(worker, "controller"):
+                worker.controller = self.controller
             worker.start()
 
     def start(self):
@@ -24,3 +62,16 @@ class Crawler(object):
     def join(self):
         for worker in self.workers:
             worker.join()
+        # The frontier checkpoints the report statistics with its last flush
+        if hasattr(self.frontier, "close"):
+            self.frontier.close()
+        if scraper.page_store is not None:
+            scraper.page_store.close()
+            scraper.set_page_store(None)
+        if self.parser_pool is not None:
+            scraper.set_parser_pool(None, 1)
+            self.parser_pool.shutdown()
+            self.parser_pool = None
+        if metrics.enabled:
+            self.logger.info(f"Metrics: {metrics.summary()}")
+        metrics.stop()
@@ -0,0 +1,87 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread
+
+from utils import get_logger, metrics
+from utils.async_download import create_session, download_async
+import scraper
+from crawler.concurrency import overloaded
+
+
+class AsyncWorker(Thread):
+    ''' Runs config.threads_count fetch tasks on one asyncio event loop
+    instead of one thread per worker. Downloads share a pooled keep-alive
+    session to the cache server, the rest of a url's processing runs in a
+    thread pool. With a controller, see crawler/concurrency.py,
+    it runs MAXTHREADS tasks and the controller decides how many download. '''
+    controller = None
+
+    def __init__(self, worker_id, config, frontier):
+        self.logger = get_logger(f"AsyncWorker-{worker_id}", "Worker")
+        self.config = config
+        self.frontier = frontier
+        super().__init__(daemon=True)
+
+    def run(self):
+        asyncio.run(self._crawl())
+
+    async def _crawl(self):
+        # Everything but the download blocks or takes the CPU (the controller's acquire, the frontier,
+        # the scraper), so it is called from a thread pool to keep the loop running
+        tasks = self.config.max_threads if self.controller is not None else self.config.threads_count
+        with ThreadPoolExecutor(tasks) as executor:
+            async with create_session(self.config) as session:
+                await asyncio.gather(*(
+                    self._fetch_loop(session, executor)
+                    for _ in range(tasks)))
+
+    async def _fetch_loop(self, session, executor):
+        loop = asyncio.get_running_loop()
+        while True:
+            if self.controller is not None:
+                # A download slot before the url, see ConcurrencyController
+                await loop.run_in_executor(executor, self.controller.acquire)
+            tbd_url = await loop.run_in_executor(executor, self.frontier.get_tbd_url)
+            if not tbd_url:
+                if self.controller is not None:
+                    self.controller.release()
+                self.logger.info("Frontier is empty. Stopping fetch task.")
+                break
+            resp = None
+            try:
+                resp = await self._download(tbd_url, session)
+                self.logger.info(
+                    f"Downloaded {tbd_url}, status <{resp.status}>, "
+                    f"using cache {self.config.cache_server}.")
+            except Exception:
+                self.logger.exception(f"Failed to download {tbd_url}.")
+            # One call, the scraper and the frontier keep what came of the page per thread until it is completed
+            await loop.run_in_executor(executor, self._process, tbd_url, resp)
+
+    def _process(self, tbd_url, resp):
+        # Runs in the thread pool
+        try:
+            if resp is not None:
+                with metrics.timer("scrape"):
+                    scraped_urls = scraper.scraper(tbd_url, resp)
+                with metrics.timer("add_urls"):
+                    for scraped_url in scraped_urls:
+                        self.frontier.add_url(scraped_url)
+        except Exception:
+            self.logger.exception(f"Failed to process {tbd_url}.")
+        finally:
+            # Always complete the url, other tasks wait on it before deciding the crawl is over
+            self.frontier.mark_url_complete(tbd_url)
+
+    async def _download(self, url, session):
+        if self.controller is None:
+            return await download_async(url, self.config, session, self.logger)
+        # The slot taken in _fetch_loop is given back as soon as the download is over
+        started = time.time()
+        resp = None
+        try:
+            resp = await download_async(url, self.config, session, self.logger)
+            return resp
+        finally:
+            self.controller.release(started, resp is None or overloaded(resp))
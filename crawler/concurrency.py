@@ -0,0 +1,125 @@
+import time
+from threading import Condition
+
+from utils import get_logger, metrics
+
+# Downloads per round at the least, the limit is adjusted once a round is over
+min_round = 4
+# The baseline latency creeps up by this much every round it is not beaten, so a cache server that
+# got slower for good stops counting as congested after a while
+baseline_drift = 0.01
+
+
+def overloaded(resp) -> bool:
+    # The cache server could not be reached, or failed with a 5xx after every retry (utils.download)
+    return resp.error is not None and (resp.status == 0 or 500 <= resp.status < 600)
+
+
+class ConcurrencyController(object):
+    '''Limits how many workers download from the cache server at once, and the delay between the
+    starts of two downloads, from the latency and errors of the downloads (AIMD).
+
+    Workers call acquire before they ask the frontier for a url, and release once its download is over.
+    The frontier starts a host's politeness delay when it hands out the url, so a url must not wait for
+    a slot afterwards. Every round of `limit` downloads:
+
+    congested -> the round's error rate is above error_tolerance, or its mean latency is above
+                 latency_tolerance times the baseline: the limit is multiplied by decrease,
+                 and on errors the delay doubles (at least delay_step, at most max_delay)
+    otherwise -> the limit goes up by one and the delay down by delay_step
+
+    The baseline is the best round's latency. After a decrease for latency alone it is raised to
+    that latency: if the cache server is slower whatever the load, fewer downloads at once would
+    only lower the throughput, so the limit is cut once per slowdown.
+    Downloads started before a decrease are not counted, they were started under the old limit.
+    The limit stays within minimum and maximum. POLITENESS, the delay per host, is unaffected.
+    '''
+
+    def __init__(self, initial, minimum, maximum, max_delay=2.0, latency_tolerance=2.0, error_tolerance=0.05,
+                 decrease=0.5, delay_step=0.05):
+        self.logger = get_logger("CONCURRENCY")
+        self.minimum = max(minimum, 1)
+        self.maximum = max(maximum, self.minimum)
+        self.limit = min(max(initial, self.minimum), self.maximum)
+        self.max_delay = max_delay
+        self.latency_tolerance = latency_tolerance
+        self.error_tolerance = error_tolerance
+        self.decrease = decrease
+        self.delay_step = delay_step
+        self.delay = 0.0
+        # Downloads open now, the earliest time the next one may start, and the time of the last decrease
+        self.active = 0
+        self.next_start = 0.0
+        self.decreased = 0.0
+        # Mean latency of the best round so far, drifting up (see baseline_drift), raised by a decrease for latency
+        self.baseline = None
+        self.round_downloads = 0
+        self.round_errors = 0
+        self.round_latency = 0.0
+        self.condition = Condition()
+        metrics.register_gauge("concurrency_limit", lambda: [(None, self.limit)])
+        metrics.register_gauge("request_delay", lambda: [(None, self.delay)])
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.threads_count, config.min_threads, config.max_threads, config.max_delay,
+                   config.latency_tolerance, config.error_tolerance)
+
+    def acquire(self):
+        # Blocks until fewer than limit downloads are open and the delay since the last start is over
+        with self.condition:
+            while True:
+                now = time.time()
+                if self.active < self.limit and now >= self.next_start:
+                    self.active += 1
+                    self.next_start = now + self.delay
+                    return
+                # Woken up by release, or once the delay is over
+                self.condition.wait(self.next_start - now if self.active < self.limit else None)
+
+    def release(self, started=None, error=False):
+        # started: when the download began, it took until now, retries included. error: see overloaded.
+        # Without started nothing was downloaded (the frontier had no url), the slot is only given back
+        with self.condition:
+            self.active -= 1
+            if started is not None and started >= self.decreased:
+                self.round_downloads += 1
+                if error:
+                    # Failed downloads can be quick, only the others tell how long a page takes
+                    self.round_errors += 1
+                else:
+                    self.round_latency += time.time() - started
+                if self.round_downloads >= max(self.limit, min_round):
+                    self._adjust()
+            self.condition.notify_all()
+
+    def _adjust(self):
+        # Called with the lock held, at the end of a round
+        error_rate = self.round_errors / self.round_downloads
+        # Mean latency of the round's successful downloads, 0 if none succeeded
+        latency = 0.0
+        if self.round_downloads > self.round_errors:
+            latency = self.round_latency / (self.round_downloads - self.round_errors)
+            if self.baseline is None or latency < self.baseline:
+                self.baseline = latency
+            else:
+                self.baseline *= 1 + baseline_drift
+        slow = self.baseline is not None and latency > self.baseline * self.latency_tolerance
+        if error_rate > self.error_tolerance or slow:
+            limit = max(self.minimum, int(self.limit * self.decrease))
+            if error_rate > self.error_tolerance:
+                self.delay = min(self.max_delay, max(self.delay * 2, self.delay_step))
+            self.logger.info(
+                f"Cache server congested, {error_rate:.0%} errors and {latency * 1000:.0f} ms per download "
+                f"({(self.baseline or 0.0) * 1000:.0f} ms at best): {self.limit} -> {limit} downloads at once, "
+                f"{self.delay:.2f}s between them.")
+            if not error_rate > self.error_tolerance:
+                self.baseline = latency
+            self.limit = limit
+            self.decreased = time.time()
+        else:
+            self.limit = min(self.maximum, self.limit + 1)
+            self.delay = max(0.0, self.delay - self.delay_step)
+        self.round_downloads = 0
+        self.round_errors = 0
+        self.round_latency = 0.0
@@ -1,30 +1,90 @@
 import os
-import shelve
+import time
 
-from threading import Thread, RLock
+from collections import defaultdict, Counter
+from heapq import heappush, heappop
+from threading import Thread, RLock, Condition, Event, local
 from queue import Queue, Empty
+from urllib.parse import urlparse
 
-from utils import get_logger, get_urlhash, normalize
-from scraper import is_valid
+from utils import get_logger, get_urlhash, normalize, metrics
+from utils.bloom import BloomFilter
+from scraper import is_valid, parent_novelty, page_outcome, page_stats, checkpoint_analytics
+from urlscore import UrlScorer
+from hoststats import HostTracker
+from crawler.store import open_store, remove_store, store_exists
+from crawler.robots import RobotsCache
+
+# How long to set a host aside while its robots.txt is being fetched
+robots_wait = 0.05
 
 class Frontier(object):
-    def __init__(self, config, restart):
+    # Seconds between checks of _finished while idle, None waits until a url is added or completed
+    idle_poll = None
+
+    def __init__(self, config, restart, scorer=None):
         self.logger = get_logger("FRONTIER")
         self.config = config
-        self.to_be_downloaded = list()
+        # Priority of a url, lower is fetched sooner, see urlscore.py
+        self.scorer = scorer or UrlScorer.from_config(config)
+        # Urls to be downloaded, partitioned by host (netloc), each a heap of (priority, sequence, url)
+        self.host_queues = defaultdict(list)
+        # Increases with every url queued, urls of the same priority are fetched first in, first out
+        self.sequence = 0
+        # Urls handed out per host, for the host fairness part of the priority
+        self.host_fetches = Counter()
+        # Earliest time each host may be fetched from again
+        self.next_fetch_time = dict()
+        # Heap of (next fetch time, host) for the hosts with urls queued that wait for their politeness delay
+        self.ready_hosts = list()
+        # Heap of (priority of the best url, host) for the hosts that may be fetched from now, and the
+        # priority of each host's entry. A host gets a new entry when a better url is queued for it
+        self.runnable = list()
+        self.runnable_priority = dict()
+        # Urls in the host queues
+        self.queued = 0
+        # Urls handed out by get_tbd_url that have not been marked complete yet
+        self.in_flight = 0
+        # True while saved urls are still being loaded in the background
+        self.loading = False
+        # Guards the save file and all of the queues, waited on by workers when no url is ready
+        self.lock = RLock()
+        self.has_work = Condition(self.lock)
+        # robots.txt rules, fetched in the background as new hosts show up
+        self.robots = RobotsCache(config, restart)
+        # Yield of every host and url pattern, learned from what came of their pages, see hoststats.py
+        self.traps = self._load_traps(restart)
+        # Per thread, the new urls added since it last completed a url: the links its page contributed
+        self.page_links = local()
         
-        if not os.path.exists(self.config.save_file) and not restart:
+        if not store_exists(self.config.save_file) and not restart:
             # Save file does not exist, but request to load save.
             self.logger.info(
                 f"Did not find save file {self.config.save_file}, "
                 f"starting from seed.")
-        elif os.path.exists(self.config.save_file) and restart:
+        elif store_exists(self.config.save_file) and restart:
             # Save file does exists, but request to start from seed.
             self.logger.info(
                 f"Found save file {self.config.save_file}, deleting it.")
-            os.remove(self.config.save_file)
+            remove_store(self.config.save_file)
         # Load existing save file, or create one if it does not exist.
-        self.save = shelve.open(self.config.save_file)
+        # Writes to it are batched, see crawler/store.py.
+        self.save = open_store(self.config)
+        # Statistics of the pages completed since the last flush of the store, and of those flushed since
+        # the last analytics checkpoint, see _store_flushed
+        self.completed_stats = list()
+        self.flushed_stats = list()
+        self.save.on_flush = self._store_flushed
+        # The store only flushes when it is written to, this thread flushes it while the crawl is idle
+        # and checkpoints the analytics after every flush
+        self.closed = Event()
+        self.checkpoint_due = Event()
+        self.flusher = Thread(target=self._flush_loop, daemon=True)
+        self.flusher.start()
+        # Filter over the hashes of every url in the save file, so only possible repeats are looked up there
+        self.seen = self._load_seen(restart)
+        metrics.register_gauge("queue_depth", self._queue_depths)
+        metrics.register_gauge("in_flight", lambda: [(None, self.in_flight)])
         if restart:
             for url in self.config.seed_urls:
                 self.add_url(url)
@@ -35,38 +95,234 @@ class Frontier(object):
                 for url in self.config.seed_urls:
                     self.add_url(url)
 
+    def _load_seen(self, restart):
+        seen_file = self.config.save_file + ".seen"
+        if not restart and os.path.exists(seen_file):
+            seen = BloomFilter.load(seen_file)
+            # Only a clean close writes it back, after a crash it is rebuilt from the save file
+            os.remove(seen_file)
+            return seen
+        seen = BloomFilter(self.config.seen_capacity, self.config.seen_error_rate)
+        for urlhash in self.save.keys():
+            seen.add(urlhash)
+        return seen
+
+    def _load_traps(self, restart):
+        traps = HostTracker.from_config(self.config)
+        traps_file = self.config.save_file + ".traps"
+        if not restart and os.path.exists(traps_file):
+            traps.load(traps_file)
+        return traps
+
     def _parse_save_file(self):
-        ''' This function can be overridden for alternate saving techniques. '''
-        total_count = len(self.save)
-        tbd_count = 0
-        for url, completed in self.save.values():
-            if not completed and is_valid(url):
-                self.to_be_downloaded.append(url)
-                tbd_count += 1
+        ''' This function can be overridden for alternate saving techniques.
+        Only the incomplete urls are read, in chunks, by a background thread
+        so that workers can start fetching before the whole save is loaded. '''
         self.logger.info(
-            f"Found {tbd_count} urls to be downloaded from {total_count} "
+            f"Loading urls to be downloaded from {len(self.save)} "
             f"total urls discovered.")
+        self.loading = True
+        Thread(target=self._load_pending, daemon=True).start()
 
-    def get_tbd_url(self):
+    def _load_pending(self):
+        tbd_count = 0
+        chunks = self.save.iter_pending()
         try:
-            return self.to_be_downloaded.pop()
-        except IndexError:
-            return None
+            while True:
+                with self.has_work:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    for url, priority in chunk:
+                        if is_valid(url):
+                            # Urls saved without a priority are scored as if found on a new page
+                            self._enqueue(url, self._score(url) if priority is None else priority)
+                            tbd_count += 1
+                    self.has_work.notify_all()
+        finally:
+            with self.has_work:
+                self.loading = False
+                self.has_work.notify_all()
+            self.logger.info(f"Found {tbd_count} urls to be downloaded.")
+
+    def _score(self, url, novelty=1.0):
+        return self.scorer(url, novelty, self.host_fetches[urlparse(url).netloc])
+
+    def _enqueue(self, url, priority):
+        host = urlparse(url).netloc
+        queue = self.host_queues[host]
+        if not queue:
+            # Host had nothing queued, so it is not in a heap yet
+            heappush(self.ready_hosts, (self.next_fetch_time.get(host, 0), host))
+        elif host in self.runnable_priority and priority < self.runnable_priority[host]:
+            self._make_runnable(host, priority)
+        heappush(queue, (priority, self.sequence, url))
+        self.sequence += 1
+        self.queued += 1
+        self.robots.prefetch(url)
+
+    def _make_runnable(self, host, priority):
+        # Entries with another priority than runnable_priority are left in the heap and skipped
+        self.runnable_priority[host] = priority
+        heappush(self.runnable, (priority, host))
 
-    def add_url(self, url):
+    def _host_delay(self, host):
+        # Politeness delay for a host, robots.txt crawl-delay wins if it is longer than POLITENESS
+        # Multiplied for hosts whose pages have been mostly duplicates, errors or empty lately
+        crawl_delay = self.robots.crawl_delay(host)
+        return max(self.config.time_delay, crawl_delay or 0) * self.traps.delay_factor(host)
+
+    def get_tbd_url(self):
+        ''' Hands out the best url, by priority, of the hosts whose politeness
+        delay is over, waiting only if no host is allowed to be fetched from yet.
+        Blocks while the frontier is empty but other workers still have urls in
+        flight, and returns None once the crawl is finished. '''
+        with self.has_work:
+            while True:
+                now = time.time()
+                while self.ready_hosts and self.ready_hosts[0][0] <= now:
+                    host = heappop(self.ready_hosts)[1]
+                    self._make_runnable(host, self.host_queues[host][0][0])
+                if self.runnable:
+                    priority, host = heappop(self.runnable)
+                    if self.runnable_priority.get(host) != priority:
+                        # A better url of the host was queued since, it has another entry
+                        continue
+                    del self.runnable_priority[host]
+                    queue = self.host_queues[host]
+                    if not self.robots.is_ready(queue[0][2]):
+                        # robots.txt of the host is still being fetched, look at the other hosts meanwhile
+                        heappush(self.ready_hosts, (now + robots_wait, host))
+                        continue
+                    polite_after = self.robots.last_fetch(host) + self._host_delay(host)
+                    if polite_after > now:
+                        # Its robots.txt was just fetched, that counts as a download from the host
+                        heappush(self.ready_hosts, (polite_after, host))
+                        continue
+                    url = heappop(queue)[2]
+                    self.queued -= 1
+                    if not self.robots.can_fetch(url) or self.traps.skip(url):
+                        # Disallowed by robots.txt, or of a url pattern that has stopped yielding new pages,
+                        # complete it without spending a download on it
+                        self.save[get_urlhash(url)] = (url, True)
+                        if queue:
+                            self._make_runnable(host, queue[0][0])
+                        else:
+                            del self.host_queues[host]
+                        continue
+                    self.next_fetch_time[host] = now + self._host_delay(host)
+                    self.host_fetches[host] += 1
+                    if queue:
+                        heappush(self.ready_hosts, (self.next_fetch_time[host], host))
+                    else:
+                        del self.host_queues[host]
+                    self.in_flight += 1
+                    return url
+                if self.ready_hosts:
+                    # Nothing is ready yet, wake up early if a url for another host is added
+                    with metrics.timer("politeness_wait"):
+                        self.has_work.wait(self.ready_hosts[0][0] - now)
+                    continue
+                if self._finished():
+                    # Frontier is empty and no worker or the loader can add to it anymore
+                    self.has_work.notify_all()
+                    return None
+                # Frontier is empty until another worker or the loader adds to it
+                with metrics.timer("idle_wait"):
+                    self.has_work.wait(self.idle_poll)
+
+    def _finished(self):
+        # Called with the lock held once the queues are empty
+        return not self.in_flight and not self.loading
+
+    def add_url(self, url, novelty=None):
+        # novelty: of the page the url was found on, by default the one this thread scraped last
         url = normalize(url)
         urlhash = get_urlhash(url)
-        if urlhash not in self.save:
-            self.save[urlhash] = (url, False)
-            self.save.sync()
-            self.to_be_downloaded.append(url)
+        if novelty is None:
+            novelty = parent_novelty()
+        with self.has_work:
+            if urlhash in self.seen and urlhash in self.save:
+                return
+            self.seen.add(urlhash)
+            self._count_link()
+            priority = self._score(url, novelty)
+            self.save[urlhash] = (url, False, priority)
+            self._enqueue(url, priority)
+            self.has_work.notify()
     
+    def _count_link(self):
+        self.page_links.count = getattr(self.page_links, "count", 0) + 1
+
     def mark_url_complete(self, url):
         urlhash = get_urlhash(url)
-        if urlhash not in self.save:
-            # This should not happen.
-            self.logger.error(
-                f"Completed url {url}, but have not seen it before.")
+        # What came of the url's page and how many new urls it added, both from this thread
+        stats = page_stats(url)
+        outcome = page_outcome(url)
+        new_links = getattr(self.page_links, "count", 0)
+        self.page_links.count = 0
+        with self.has_work:
+            if urlhash not in self.seen or urlhash not in self.save:
+                # This should not happen.
+                self.logger.error(
+                    f"Completed url {url}, but have not seen it before.")
+                self.seen.add(urlhash)
+
+            self.save[urlhash] = (url, True)
+            if stats is not None:
+                self.completed_stats.append(stats)
+            self.in_flight = max(self.in_flight - 1, 0)
+            self._record_outcome(url, outcome, new_links)
+            # Waiting workers may be able to stop now
+            self.has_work.notify_all()
+
+    def _record_outcome(self, url, outcome, new_links):
+        # Called with the lock held
+        for table, key, stats in self.traps.record(url, outcome, new_links):
+            if stats.low_yield:
+                self.logger.info(f"Low yield, {'throttling host' if table == 'hosts' else 'capping'} {key}: {stats}")
+            else:
+                self.logger.info(f"Yield recovered, no longer limiting {key}: {stats}")
+
+    def _store_flushed(self):
+        # Called by the store with the lock held. The pages completed so far are in the save file now,
+        # their statistics can go into the analytics checkpoint
+        if self.completed_stats:
+            self.flushed_stats += self.completed_stats
+            self.completed_stats = list()
+            self.checkpoint_due.set()
+
+    def _flush_loop(self):
+        # Writes older than FLUSHINTERVAL are flushed even if no other write comes, e.g. while every
+        # worker waits on a slow download or a politeness delay. After a flush, the analytics are
+        # checkpointed with the pages it completed. They and the host and pattern stats are only
+        # taken under the lock and written outside it
+        while not self.closed.is_set():
+            self.checkpoint_due.wait(max(self.config.flush_interval, 0.1))
+            self.checkpoint_due.clear()
+            with self.lock:
+                self.save.maybe_flush()
+                flushed, self.flushed_stats = self.flushed_stats, list()
+                traps = self.traps.snapshot() if self.traps.changed else None
+            if flushed:
+                checkpoint_analytics(self.config.save_file + ".analytics", flushed)
+            if traps is not None:
+                self.traps.save(self.config.save_file + ".traps", traps)
+
+    def _queue_depths(self):
+        # Urls queued per host, for the metrics
+        with self.lock:
+            return [({"host": host}, len(queue)) for host, queue in self.host_queues.items()]
 
-        self.save[urlhash] = (url, True)
-        self.save.sync()
+    def close(self):
+        # Flush any batched writes to the save file, and checkpoint the analytics with them
+        self.closed.set()
+        self.checkpoint_due.set()
+        self.flusher.join()
+        with self.lock:
+            self.save.close()
+            self.seen.save(self.config.save_file + ".seen")
+            self.traps.save(self.config.save_file + ".traps")
+            self.robots.close()
+            flushed, self.flushed_stats = self.flushed_stats, list()
+        checkpoint_analytics(self.config.save_file + ".analytics", flushed)
@@ -0,0 +1,132 @@
+import shelve
+import time
+
+from queue import Queue
+from threading import Thread, RLock
+from urllib import robotparser
+from urllib.parse import urlparse
+
+from utils import get_logger
+from utils.download import download
+from crawler.store import remove_store
+
+
+class RobotsCache(object):
+    ''' robots.txt rules per origin (scheme://netloc), fetched through the
+    cache server by fetch_threads background threads as soon as the first url
+    of an origin reaches the frontier. Lookups never block: an origin whose
+    robots.txt has not arrived yet is allowed, and the frontier holds back its
+    urls until it is ready and the host's politeness delay has passed since the
+    fetch. Successful fetches are kept for ROBOTSTTL seconds, failed ones for
+    ROBOTSFAILTTL, and both are saved to <SAVE>.robots across restarts. '''
+    # A slow origin only holds up one of them
+    fetch_threads = 4
+
+    def __init__(self, config, restart):
+        self.logger = get_logger("ROBOTS")
+        self.config = config
+        self.lock = RLock()
+        # origin -> (RobotFileParser, expiry time)
+        self.parsers = dict()
+        # origin -> crawl delay asked for by its robots.txt
+        self.delays = dict()
+        # netloc -> when a robots.txt was last fetched from it, the frontier counts it as a download from the host
+        self.fetched = dict()
+        self.closed = False
+        # origins queued for fetching
+        self.queued = set()
+        self.to_fetch = Queue()
+
+        save_file = self.config.save_file + ".robots"
+        if restart:
+            remove_store(save_file)
+        self.save = shelve.open(save_file)
+        for origin, (status, lines, fetched_at) in self.save.items():
+            self._store(origin, status, lines, fetched_at)
+        self.logger.info(f"Loaded robots.txt of {len(self.parsers)} origins.")
+
+        for _ in range(self.fetch_threads):
+            Thread(target=self._fetch_loop, daemon=True).start()
+
+    @staticmethod
+    def origin(url):
+        parsed = urlparse(url)
+        return f"{parsed.scheme}://{parsed.netloc}"
+
+    def _store(self, origin, status, lines, fetched_at):
+        # Builds the parser for a fetch result the same way RobotFileParser.read does
+        rp = robotparser.RobotFileParser(origin + "/robots.txt")
+        if status == 200:
+            rp.parse(lines)
+        elif status in (401, 403):
+            rp.disallow_all = True
+        else:
+            # Other client errors mean there is no robots.txt, and failed fetches are not held against the host
+            rp.allow_all = True
+        failed = status != 200 and not 400 <= status < 500
+        ttl = self.config.robots_fail_ttl if failed else self.config.robots_ttl
+        with self.lock:
+            self.parsers[origin] = (rp, fetched_at + ttl)
+            self.delays[origin] = rp.crawl_delay(self.config.user_agent) if status == 200 else None
+
+    def prefetch(self, url):
+        # Queues the robots.txt of the url's origin unless it is known and fresh, or already queued
+        origin = self.origin(url)
+        with self.lock:
+            entry = self.parsers.get(origin)
+            if (entry and entry[1] > time.time()) or origin in self.queued:
+                return
+            self.queued.add(origin)
+        self.to_fetch.put(origin)
+
+    def is_ready(self, url):
+        # Whether the robots.txt of the url's origin has been fetched (or given up on), even if it is stale
+        return self.origin(url) in self.parsers
+
+    def can_fetch(self, url):
+        entry = self.parsers.get(self.origin(url))
+        if entry is None:
+            self.prefetch(url)
+            return True
+        if entry[1] <= time.time():
+            # Stale, keep using it until the refreshed one arrives
+            self.prefetch(url)
+        return entry[0].can_fetch(self.config.user_agent, url)
+
+    def last_fetch(self, netloc):
+        # When a robots.txt was last fetched from the host in this run, 0 if it was not
+        return self.fetched.get(netloc, 0)
+
+    def crawl_delay(self, netloc):
+        # Longest crawl delay asked for by the robots.txt of the host, over http and https
+        delays = [self.delays.get(f"{scheme}://{netloc}") for scheme in ("http", "https")]
+        return max((delay for delay in delays if delay), default=None)
+
+    def _fetch_loop(self):
+        while True:
+            origin = self.to_fetch.get()
+            try:
+                resp = download(origin + "/robots.txt", self.config, self.logger)
+                lines = []
+                if resp.status == 200 and resp.raw_response is not None:
+                    lines = resp.raw_response.content.decode("utf-8", errors="ignore").splitlines()
+                status = resp.status
+            except Exception as e:
+                self.logger.error(f"Failed to fetch robots.txt of {origin}: {e}")
+                status, lines = 0, []
+            fetched_at = time.time()
+            with self.lock:
+                self.fetched[urlparse(origin).netloc] = fetched_at
+            self._store(origin, status, lines, fetched_at)
+            with self.lock:
+                if self.closed:
+                    return
+                self.save[origin] = (status, lines, fetched_at)
+                self.save.sync()
+                self.queued.discard(origin)
+            self.logger.info(f"Fetched robots.txt of {origin}, status <{status}>.")
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.save.close()
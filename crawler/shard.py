@@ -0,0 +1,240 @@
+import logging
+import multiprocessing
+import os
+import pickle
+import zlib
+
+from threading import Thread, Event
+from urllib.parse import urlparse
+
+from utils import get_logger, get_urlhash, normalize
+from crawler import Crawler
+from crawler.frontier import Frontier
+from scraper import parent_novelty
+from analytics import CrawlAnalytics
+import scraper
+
+# Urls for another shard are sent once this many are waiting, or every forward_interval seconds
+forward_batch = 200
+forward_interval = 0.05
+# Urls sent to another shard that are remembered so they are not sent again, the memory is started over once
+# this many are. The receiving shard deduplicates whatever is sent again
+forward_cache = 100000
+
+
+def shard_of(url, shards):
+    # crc32 rather than hash(), which differs between processes. Every url of a host goes to the same
+    # shard, so each host's politeness delay and robots.txt are handled by one process
+    return zlib.crc32(urlparse(url).netloc.encode()) % shards
+
+def shard_save_file(save_file, shard):
+    return f"{save_file}.shard{shard}"
+
+
+class ShardedFrontier(Frontier):
+    ''' Frontier of one process of a sharded crawl, see crawl_sharded. It owns
+    the hosts whose shard_of is its shard and keeps them in its own save file.
+    Urls of other hosts are collected per shard, with the novelty of the page
+    they were found on, and put on that shard's inbox in batches. A thread adds
+    the batches that arrive in this shard's inbox.
+
+    pending is shared by all shards: the urls queued or in flight in any shard,
+    one for every shard still loading its save file, and the urls on their way
+    to another shard. The crawl is over once it is 0. '''
+
+    # Other shards do not wake this one up when they complete urls, so the shared count is polled
+    idle_poll = 0.1
+
+    def __init__(self, config, restart, shard, inboxes, pending):
+        self.shard = shard
+        self.inboxes = inboxes
+        self.pending = pending
+        # This shard's share of pending, queued + in flight + loading, as last added to it
+        self.published = 0
+        # Urls waiting to be sent, per shard
+        self.outboxes = [list() for _ in inboxes]
+        # Hashes of urls recently sent to another shard, which does the rest of the deduplication.
+        # Exact, a url is never kept from its shard, see forward_cache
+        self.forwarded = set()
+        self.stopped = Event()
+        super().__init__(config, restart)
+        with self.lock:
+            self._publish()
+        self.receiver = Thread(target=self._receive, daemon=True)
+        self.receiver.start()
+        self.sender = Thread(target=self._send_loop, daemon=True)
+        self.sender.start()
+
+    def _publish(self):
+        # Called with the lock held. Only needed before this shard's count goes down: urls are added
+        # to it while one of its urls is in flight, a batch is on its way or its save file is loading,
+        # which pending already counts
+        busy = self.queued + self.in_flight + bool(self.loading)
+        if busy != self.published:
+            with self.pending.get_lock():
+                self.pending.value += busy - self.published
+            self.published = busy
+
+    def _finished(self):
+        self._publish()
+        return super()._finished() and self.pending.value == 0
+
+    def _load_pending(self):
+        try:
+            super()._load_pending()
+        finally:
+            with self.lock:
+                self._publish()
+
+    def add_url(self, url, novelty=None):
+        url = normalize(url)
+        shard = shard_of(url, len(self.inboxes))
+        if shard == self.shard:
+            super().add_url(url, novelty)
+            return
+        urlhash = get_urlhash(url)
+        with self.lock:
+            if urlhash in self.forwarded:
+                return
+            if len(self.forwarded) >= forward_cache:
+                self.forwarded.clear()
+            self.forwarded.add(urlhash)
+            self._count_link()
+            self._forward(shard, url, parent_novelty() if novelty is None else novelty)
+
+    def _enqueue(self, url, priority):
+        shard = shard_of(url, len(self.inboxes))
+        if shard != self.shard:
+            # Left in the save file by a crawl with another number of shards, hand it to its owner
+            self.save[get_urlhash(url)] = (url, True)
+            self._forward(shard, url, 1.0)
+            return
+        super()._enqueue(url, priority)
+
+    def _forward(self, shard, url, novelty):
+        # Called with the lock held
+        self.outboxes[shard].append((url, novelty))
+        with self.pending.get_lock():
+            self.pending.value += 1
+        if len(self.outboxes[shard]) >= forward_batch:
+            self._send(shard)
+
+    def _send(self, shard):
+        # Queue.put only hands the batch to the queue's feeder thread, it does not block
+        self.inboxes[shard].put(self.outboxes[shard])
+        self.outboxes[shard] = list()
+
+    def _send_loop(self):
+        while not self.stopped.wait(forward_interval):
+            with self.lock:
+                for shard, outbox in enumerate(self.outboxes):
+                    if outbox:
+                        self._send(shard)
+
+    def _receive(self):
+        inbox = self.inboxes[self.shard]
+        while True:
+            batch = inbox.get()
+            if batch is None:
+                break
+            with self.has_work:
+                for url, novelty in batch:
+                    super().add_url(url, novelty)
+                # Counted as queued before they stop being counted as on their way
+                self._publish()
+                with self.pending.get_lock():
+                    self.pending.value -= len(batch)
+                self.has_work.notify_all()
+
+    def close(self):
+        # Only called once pending is 0, no shard sends anything anymore
+        self.stopped.set()
+        self.sender.join()
+        self.inboxes[self.shard].put(None)
+        self.receiver.join()
+        super().close()
+
+
+def run_shard(config, restart, shard, inboxes, pending, ready, disabled_logging=logging.NOTSET):
+    # Entry point of a shard's process: a Crawler over its own save file, analytics and robots.txt cache
+    # Levels the parent disabled with logging.disable stay disabled here
+    logging.disable(disabled_logging)
+    config.save_file = shard_save_file(config.save_file, shard)
+    if config.page_store:
+        config.page_store = shard_save_file(config.page_store, shard)
+    if config.metrics_port:
+        config.metrics_port += shard
+    crawler = Crawler(
+        config, restart,
+        frontier_factory=lambda config, restart: ShardedFrontier(config, restart, shard, inboxes, pending))
+    # Until every shard has added its seeds or started loading its save file, pending can be 0 too early
+    ready.wait()
+    crawler.start()
+    # Near-duplicates are only found within a shard during the crawl, merge_shards compares across shards
+    with open(config.save_file + ".fingerprints", "wb") as file:
+        pickle.dump(list(scraper.fingerprints), file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def crawl_sharded(config, restart):
+    ''' Crawls with config.shards processes, each owning the hosts that
+    shard_of assigns to it, see ShardedFrontier. Returns the analytics of all
+    shards merged, once every shard is done. '''
+    logger = get_logger("SHARDS")
+    context = multiprocessing.get_context("spawn")
+    inboxes = [context.Queue() for _ in range(config.shards)]
+    pending = context.Value("q", 0)
+    ready = context.Barrier(config.shards)
+    processes = [
+        context.Process(
+            target=run_shard, name=f"Shard-{shard}",
+            args=(config, restart, shard, inboxes, pending, ready, logging.root.manager.disable))
+        for shard in range(config.shards)]
+    for process in processes:
+        process.start()
+    logger.info(f"Started {config.shards} shards.")
+    running = list(processes)
+    while running:
+        running[0].join(1.0)
+        running = [process for process in running if process.is_alive()]
+        failed = [process for process in processes if process.exitcode]
+        if failed:
+            # The other shards would wait for its urls forever
+            for process in running:
+                process.terminate()
+            raise RuntimeError(f"{failed[0].name} exited with code {failed[0].exitcode}.")
+    return merge_shards(config, logger)
+
+
+def merge_shard_analytics(config):
+    # Report statistics of every shard, from their last checkpoints
+    totals = CrawlAnalytics(config.top_words)
+    for shard in range(config.shards):
+        path = shard_save_file(config.save_file, shard) + ".analytics"
+        if os.path.exists(path):
+            totals.merge(CrawlAnalytics.load(path))
+    return totals
+
+
+def merge_shards(config, logger):
+    ''' Merges the analytics of the shards into the scraper's totals, saved to
+    <SAVE>.analytics, and their fingerprints into the scraper's near-duplicate
+    index, counting the pages that were near-duplicates of a page crawled by
+    another shard. '''
+    totals = merge_shard_analytics(config)
+    duplicates = 0
+    for shard in range(config.shards):
+        path = shard_save_file(config.save_file, shard) + ".fingerprints"
+        if not os.path.exists(path):
+            continue
+        with open(path, "rb") as file:
+            fingerprints = pickle.load(file)
+        # No two fingerprints of one shard are near-duplicates, so this only finds them across shards
+        duplicates += sum(1 for fingerprint in fingerprints if scraper.is_too_similar(fingerprint))
+        scraper.fingerprints.update(fingerprints)
+    with scraper.checkpoint_lock:
+        scraper.totals = totals
+        scraper.checkpoint_analytics(config.save_file + ".analytics")
+    logger.info(
+        f"Merged {config.shards} shards: {totals.pages} pages, {len(scraper.fingerprints)} fingerprints, "
+        f"{duplicates} pages were near-duplicates of a page of another shard.")
+    return totals
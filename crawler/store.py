@@ -0,0 +1,271 @@
+import dbm
+import os
+import shelve
+import sqlite3
+import time
+
+from utils import get_urlhash, normalize, metrics
+
+
+class ShelveStore(object):
+    ''' Write-behind wrapper around a shelve file. Writes are kept in memory
+    and flushed to the shelve in one go once flush_size of them have piled
+    up or flush_interval seconds have passed since the last flush. The check
+    runs on every write, and the frontier runs it every flush_interval seconds
+    so an idle store is flushed too. Reads see the pending writes, and
+    everything up to the last flush survives a crash. on_flush, if set, is
+    called after every flush.
+
+    A second shelve (path + ".pending") maps the hash of every incomplete url
+    to the url and its priority in the frontier, so a restart only has to read
+    the urls left to download and keeps their order. Values are written as
+    (url, completed) or (url, completed, priority), and read as (url, completed). '''
+
+    def __init__(self, path, flush_size=500, flush_interval=5.0):
+        self.path = path
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.pending = dict()
+        self.last_flush = time.time()
+        self.on_flush = None
+        has_index = dbm.whichdb(path + ".pending") is not None
+        self.save = shelve.open(path)
+        self.pending_index = shelve.open(path + ".pending")
+        if not has_index and len(self.save):
+            # Save file from before the pending index existed, build it once
+            for urlhash, (url, completed) in self.save.items():
+                if not completed:
+                    self.pending_index[urlhash] = (url, None)
+            self.pending_index.sync()
+
+    def __contains__(self, urlhash):
+        return urlhash in self.pending or urlhash in self.save
+
+    def __getitem__(self, urlhash):
+        if urlhash in self.pending:
+            return self.pending[urlhash][:2]
+        return self.save[urlhash]
+
+    def __setitem__(self, urlhash, value):
+        self.pending[urlhash] = value
+        self.maybe_flush()
+
+    def __len__(self):
+        return len(self.save) + sum(1 for urlhash in self.pending if urlhash not in self.save)
+
+    def values(self):
+        self.flush()
+        return self.save.values()
+
+    def keys(self):
+        self.flush()
+        return self.save.keys()
+
+    def iter_pending(self, chunk_size=1000):
+        # Yields the incomplete urls as (url, priority) in lists of up to chunk_size, reading only the
+        # pending index. Urls completed between two chunks are skipped. The priority is None for urls
+        # saved without one.
+        self.flush()
+        keys = list(self.pending_index.keys())
+        for i in range(0, len(keys), chunk_size):
+            yield [self.pending_index[urlhash] for urlhash in keys[i:i + chunk_size]
+                   if urlhash in self.pending_index]
+
+    def maybe_flush(self):
+        if self.pending and (len(self.pending) >= self.flush_size
+                or time.time() - self.last_flush >= self.flush_interval):
+            # Batched write of the pending urls, the shelve syncs or the SQLite transaction
+            with metrics.timer("store_flush"):
+                self.flush()
+
+    def flush(self):
+        for urlhash, value in self.pending.items():
+            url, completed = value[:2]
+            self.save[urlhash] = (url, completed)
+            if not completed:
+                self.pending_index[urlhash] = (url, value[2] if len(value) > 2 else None)
+            elif urlhash in self.pending_index:
+                del self.pending_index[urlhash]
+        self.pending.clear()
+        self.save.sync()
+        self.pending_index.sync()
+        self.last_flush = time.time()
+        if self.on_flush is not None:
+            self.on_flush()
+
+    def close(self):
+        self.flush()
+        self.save.close()
+        self.pending_index.close()
+
+
+class SqliteStore(ShelveStore):
+    ''' Same write-behind behaviour as ShelveStore, backed by an SQLite
+    database in WAL mode so a flush is one transaction instead of a rewrite
+    of the shelve's dirty pages. '''
+
+    def __init__(self, path, flush_size=500, flush_interval=5.0):
+        self.path = path
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.pending = dict()
+        self.last_flush = time.time()
+        self.on_flush = None
+        # The frontier serializes all access with its own lock
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS urls ("
+            "urlhash TEXT PRIMARY KEY, url TEXT NOT NULL, completed INTEGER NOT NULL, priority REAL)")
+        # Partial index of incomplete urls so a restart does not scan the whole table
+        self.db.execute("CREATE INDEX IF NOT EXISTS pending ON urls (completed) WHERE completed = 0")
+        self.db.commit()
+
+    def _get(self, urlhash):
+        return self.db.execute(
+            "SELECT url, completed FROM urls WHERE urlhash = ?", (urlhash,)).fetchone()
+
+    def __contains__(self, urlhash):
+        return urlhash in self.pending or self._get(urlhash) is not None
+
+    def __getitem__(self, urlhash):
+        if urlhash in self.pending:
+            return self.pending[urlhash][:2]
+        row = self._get(urlhash)
+        if row is None:
+            raise KeyError(urlhash)
+        return row[0], bool(row[1])
+
+    def __len__(self):
+        self.flush()
+        return self.db.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+
+    def values(self):
+        self.flush()
+        for url, completed in self.db.execute("SELECT url, completed FROM urls"):
+            yield url, bool(completed)
+
+    def keys(self):
+        self.flush()
+        for (urlhash,) in self.db.execute("SELECT urlhash FROM urls"):
+            yield urlhash
+
+    def iter_pending(self, chunk_size=1000):
+        # Yields the incomplete urls as (url, priority) in lists of up to chunk_size, paging through the pending
+        # index by rowid. Rows written after the first chunk (new urls, or urls completed since) have a higher
+        # rowid and are not read.
+        self.flush()
+        last_rowid = self.db.execute("SELECT COALESCE(MAX(rowid), 0) FROM urls").fetchone()[0]
+        after = 0
+        while True:
+            rows = self.db.execute(
+                "SELECT rowid, url, priority FROM urls WHERE completed = 0 AND rowid > ? AND rowid <= ? "
+                "ORDER BY rowid LIMIT ?", (after, last_rowid, chunk_size)).fetchall()
+            if not rows:
+                return
+            after = rows[-1][0]
+            yield [(url, priority) for rowid, url, priority in rows]
+
+    def flush(self):
+        if self.pending:
+            with self.db:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO urls (urlhash, url, completed, priority) VALUES (?, ?, ?, ?)",
+                    [(urlhash, value[0], int(value[1]), value[2] if len(value) > 2 else None)
+                     for urlhash, value in self.pending.items()])
+            self.pending.clear()
+        self.last_flush = time.time()
+        if self.on_flush is not None:
+            self.on_flush()
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+
+STORES = {"shelve": ShelveStore, "sqlite": SqliteStore}
+
+
+def open_store(config):
+    return STORES[config.store](
+        config.save_file, flush_size=config.flush_size,
+        flush_interval=config.flush_interval)
+
+
+# Files a store can consist of: dbm backends may add an extension to the path, SQLite keeps journals next to it
+STORE_SUFFIXES = ("", ".db", ".dat", ".dir", ".bak", "-wal", "-shm")
+
+
+def store_exists(path):
+    return any(os.path.exists(path + suffix) for suffix in STORE_SUFFIXES)
+
+
+def remove_store(path):
+    # Deletes a save file along with its pending index and seen-url filter
+    for name in (path, path + ".pending", path + ".seen"):
+        for suffix in STORE_SUFFIXES:
+            if os.path.exists(name + suffix):
+                os.remove(name + suffix)
+
+
+def rehash(config):
+    ''' Rewrites the save file with the canonical url and hash of every entry,
+    for save files written before urls were canonicalized or with other rules.
+    Entries that end up with the same hash are merged, completed if any of them
+    was. The new store is written next to the old one and then moved over it,
+    the seen-url filter is dropped so the frontier rebuilds it, and the frontier
+    scores the pending urls again. Returns the number of entries before and after. '''
+    merged = dict()
+    before = 0
+    store = open_store(config)
+    for url, completed in store.values():
+        before += 1
+        url = normalize(url)
+        urlhash = get_urlhash(url)
+        if urlhash in merged:
+            url, was_completed = merged[urlhash]
+            completed = completed or was_completed
+        merged[urlhash] = (url, completed)
+    store.close()
+
+    new_path = config.save_file + ".rehash"
+    remove_store(new_path)
+    store = STORES[config.store](new_path, flush_size=config.flush_size, flush_interval=config.flush_interval)
+    for urlhash, value in merged.items():
+        store[urlhash] = value
+    store.close()
+    remove_store(config.save_file)
+    for suffix in (".pending", ""):
+        for store_suffix in STORE_SUFFIXES:
+            if os.path.exists(new_path + suffix + store_suffix):
+                os.replace(new_path + suffix + store_suffix, config.save_file + suffix + store_suffix)
+    return before, len(merged)
+
+
+if __name__ == "__main__":
+    # Benchmark: urls/second added with a sync per url (the old frontier) vs the write-behind stores
+    import tempfile
+    from hashlib import sha256
+
+    urls = [f"https://www.ics.uci.edu/page/{i}" for i in range(20000)]
+    hashes = [sha256(url.encode()).hexdigest() for url in urls]
+    with tempfile.TemporaryDirectory() as tmp:
+        save = shelve.open(os.path.join(tmp, "sync.shelve"))
+        start = time.perf_counter()
+        for urlhash, url in zip(hashes[:2000], urls[:2000]):
+            if urlhash not in save:
+                save[urlhash] = (url, False)
+                save.sync()
+        print(f"shelve, sync per url: {2000 / (time.perf_counter() - start):10.0f} urls/s")
+        save.close()
+
+        for name, store_cls in STORES.items():
+            store = store_cls(os.path.join(tmp, f"batched.{name}"))
+            start = time.perf_counter()
+            for urlhash, url in zip(hashes, urls):
+                if urlhash not in store:
+                    store[urlhash] = (url, False)
+            store.flush()
+            print(f"{name}, write-behind: {len(urls) / (time.perf_counter() - start):10.0f} urls/s")
+            store.close()
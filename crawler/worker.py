@@ -1,13 +1,17 @@
+import time
 from threading import Thread
 
 from inspect import getsource
 from utils.download import download
-from utils import get_logger
+from utils import get_logger, metrics
 import scraper
-import time
+from crawler.concurrency import overloaded
 
 
 class Worker(Thread):
+    # crawler.concurrency.ConcurrencyController shared by the workers, set by the Crawler if MAXTHREADS is set
+    controller = None
+
     def __init__(self, worker_id, config, frontier):
         self.logger = get_logger(f"Worker-{worker_id}", "Worker")
         self.config = config
@@ -19,16 +23,45 @@ class Worker(Thread):
         
     def run(self):
         while True:
+            if self.controller is not None:
+                # A download slot before the url, see ConcurrencyController
+                self.controller.acquire()
             tbd_url = self.frontier.get_tbd_url()
             if not tbd_url:
+                if self.controller is not None:
+                    self.controller.release()
                 self.logger.info("Frontier is empty. Stopping Crawler.")
                 break
-            resp = download(tbd_url, self.config, self.logger)
-            self.logger.info(
-                f"Downloaded {tbd_url}, status <{resp.status}>, "
-                f"using cache {self.config.cache_server}.")
-            scraped_urls = scraper.scraper(tbd_url, resp)
-            for scraped_url in scraped_urls:
-                self.frontier.add_url(scraped_url)
-            self.frontier.mark_url_complete(tbd_url)
-            time.sleep(self.config.time_delay)
+            try:
+                resp = self._download(tbd_url)
+                self.logger.info(
+                    f"Downloaded {tbd_url}, status <{resp.status}>, "
+                    f"using cache {self.config.cache_server}.")
+                scraped_urls = self._scrape(tbd_url, resp)
+                self._add_urls(scraped_urls)
+            except Exception:
+                self.logger.exception(f"Failed to process {tbd_url}.")
+            finally:
+                # Always complete the url, other workers wait on it before deciding the crawl is over
+                self.frontier.mark_url_complete(tbd_url)
+
+    def _scrape(self, url, resp):
+        with metrics.timer("scrape"):
+            return scraper.scraper(url, resp)
+
+    def _add_urls(self, urls):
+        with metrics.timer("add_urls"):
+            for url in urls:
+                self.frontier.add_url(url)
+
+    def _download(self, url):
+        if self.controller is None:
+            return download(url, self.config, self.logger)
+        # The slot taken in run is given back as soon as the download is over
+        started = time.time()
+        resp = None
+        try:
+            resp = download(url, self.config, self.logger)
+            return resp
+        finally:
+            self.controller.release(started, resp is None or overloaded(resp))
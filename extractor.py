@@ -0,0 +1,132 @@
+import re
+from urllib.parse import urljoin
+from lxml import etree
+
+# Tags whose content is not visible text
+skipped_tags = {"script", "style", "template"}
+charset_pattern = re.compile(rb"""charset\s*=\s*["']?([a-zA-Z0-9_.:-]+)""", re.IGNORECASE)
+chunk_size = 1 << 16
+
+
+class _ExtractorTarget(object):
+    # lxml parser target, receives parse events instead of building a tree
+
+    def __init__(self, url: str, max_text: int):
+        self.base = url
+        self.max_text = max_text
+        self.text = []
+        self.text_length = 0
+        self.hrefs = []
+        self.seen_base = False
+        self.skip_depth = 0
+
+    def start(self, tag, attrib):
+        if tag in skipped_tags:
+            self.skip_depth += 1
+        elif tag == "a":
+            href = attrib.get("href")
+            if href:
+                self.hrefs.append(href)
+        elif tag == "base" and not self.seen_base and attrib.get("href"):
+            # Only the first <base href> counts, relative to the page url
+            self.seen_base = True
+            self.base = urljoin(self.base, attrib["href"])
+
+    def end(self, tag):
+        if tag in skipped_tags and self.skip_depth:
+            self.skip_depth -= 1
+
+    def data(self, data):
+        if not self.skip_depth:
+            self.text.append(data)
+            self.text_length += len(data)
+
+    def close(self):
+        pass
+
+    @property
+    def over_limit(self):
+        return self.max_text is not None and self.text_length > self.max_text
+
+
+def detect_encoding(content: bytes) -> str:
+    # Declared charset in the first bytes of the page, else utf-8 if it decodes, else windows-1252
+    match = charset_pattern.search(content[:2048])
+    if match:
+        encoding = match.group(1).decode("ascii").lower()
+        try:
+            "".encode(encoding)
+            return encoding
+        except LookupError:
+            pass
+    try:
+        content.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "windows-1252"
+
+
+def extract(url: str, content: bytes, max_text: int = None):
+    '''Single pass over the html of a page without building a tree.
+
+    in  -> page url, raw page bytes, optional text length cap
+    out -> (visible text, absolute hrefs of the anchors, whether parsing stopped at the cap)
+
+    Text inside script/style/template and comments is skipped, hrefs are resolved
+    against the first <base href> if the page has one. Once the text is longer than
+    max_text parsing stops, and the returned text is only what was seen so far.
+    '''
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    target = _ExtractorTarget(url, max_text)
+    parser = etree.HTMLParser(target=target, encoding=detect_encoding(content))
+    truncated = False
+    for i in range(0, len(content), chunk_size):
+        parser.feed(content[i:i + chunk_size])
+        if target.over_limit:
+            truncated = True
+            break
+    if not truncated:
+        try:
+            parser.close()
+        except etree.XMLSyntaxError: # empty or unparsable document
+            pass
+        truncated = target.over_limit
+    return "".join(target.text), [urljoin(target.base, href) for href in target.hrefs], truncated
+
+
+if __name__ == "__main__":
+    # Benchmark against building an lxml tree, and against the BeautifulSoup path the scraper used
+    # before if bs4 is installed (it is no longer a requirement)
+    import sys
+    import time
+    import lxml.html
+
+    def tree_extract(url, content):
+        tree = lxml.html.fromstring(content, base_url=url)
+        tree.make_links_absolute()
+        return tree.text_content(), [href for element, attribute, href, _ in tree.iterlinks() if element.tag == "a"]
+
+    extractors = [("lxml tree", tree_extract), ("extractor", lambda u, c: extract(u, c)[:2])]
+    try:
+        from bs4 import BeautifulSoup as bs
+
+        def soup_extract(url, content):
+            soup = bs(content, 'lxml')
+            return soup.get_text(), [urljoin(url, tag['href']) for tag in soup.find_all('a') if tag.get('href')]
+
+        extractors.insert(0, ("BeautifulSoup", soup_extract))
+    except ImportError:
+        pass
+
+    pages = [open(path, "rb").read() for path in sys.argv[1:]]
+    if not pages:
+        words = " ".join(f"word{i % 5000}" for i in range(3000))
+        pages = [(f"<html><head><title>t</title><style>p {{}}</style></head><body>" + "".join(
+            f"<div><p>{words[j:j + 500]}</p><a href='/x{j}'>l</a></div>" for j in range(0, len(words), 500))
+            + "</body></html>").encode()] * 200
+    for name, fn in extractors:
+        start = time.perf_counter()
+        for content in pages:
+            fn("https://www.ics.uci.edu/", content)
+        print(f"{name:<14}: {len(pages) / (time.perf_counter() - start):8.1f} pages/s")
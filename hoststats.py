@@ -0,0 +1,193 @@
+import os
+import pickle
+import re
+
+from urllib.parse import urlparse
+
+# What a fetched page turned out to be, from the reason scraper.py gives for it
+outcome_kinds = {
+    "ok": "ok",
+    "near_duplicate": "duplicate",
+    "status": "error",
+    "error": "error",
+    "redirect": "redirect",
+}
+# Not the page's fault, not counted
+ignored_outcomes = frozenset(("visited", "robots"))
+# Everything else the scraper rejects (empty, binary, too little text...) counts as a low value page
+low_kind = "low"
+
+kinds = ("ok", "duplicate", "error", "redirect", "low")
+
+hex_run = re.compile(r"[0-9a-f]{8,}", re.IGNORECASE)
+digit_run = re.compile(r"\d+")
+
+
+def url_pattern(url: str) -> str:
+    # Host and path with numbers and long hex ids replaced by *, and the names of the query parameters,
+    # e.g. https://wiki.ics.uci.edu/page12?do=diff&rev=3 -> wiki.ics.uci.edu/page*?do&rev
+    parsed = urlparse(url)
+    path = digit_run.sub("*", hex_run.sub("*", parsed.path))
+    if parsed.query:
+        path += "?" + "&".join(sorted({param.split("=", 1)[0] for param in parsed.query.split("&")}))
+    return parsed.netloc + path
+
+
+class HostStats(object):
+    ''' Outcomes of the pages of a host or url pattern, decayed so they cover
+    about the last `window` pages of it: pages, ok, duplicate, error,
+    redirect, low, and the new links those pages added to the frontier. '''
+    __slots__ = ("pages", "counts", "new_links", "skipped", "low_yield", "last")
+
+    def __init__(self):
+        self.pages = 0.0
+        self.counts = dict.fromkeys(kinds, 0.0)
+        self.new_links = 0.0
+        # Urls skipped while capped, every probe-th one is fetched anyway
+        self.skipped = 0
+        self.low_yield = False
+        # HostTracker.recorded at its last page, for pruning
+        self.last = 0
+
+    def add(self, kind, new_links, decay):
+        self.pages = self.pages * decay + 1
+        for name in self.counts:
+            self.counts[name] *= decay
+        self.counts[kind] += 1
+        self.new_links = self.new_links * decay + new_links
+
+    @property
+    def yield_rate(self) -> float:
+        return self.counts["ok"] / self.pages if self.pages else 1.0
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def copy(self):
+        stats = HostStats.__new__(HostStats)
+        stats.__setstate__(self.__getstate__())
+        stats.counts = dict(self.counts)
+        return stats
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def __str__(self):
+        rates = ", ".join(f"{name} {count / self.pages:.0%}" for name, count in self.counts.items() if count >= 0.5)
+        return f"yield {self.yield_rate:.0%} over {self.pages:.0f} pages ({rates}), {self.new_links / self.pages:.1f} new links/page"
+
+
+class HostTracker(object):
+    '''Learns from crawl outcomes which hosts and url patterns are not worth their downloads.
+
+    Every completed url adds its page's outcome to the stats of its host and of its url_pattern.
+    A host or pattern is low yield once it has at least min_pages pages (decayed) and less than
+    min_yield of them were new pages with content. Then:
+
+    pattern -> capped, its urls are completed without a download, except every probe-th one
+               so that the pattern can recover
+    host    -> throttled, its politeness delay is multiplied by throttle
+
+    Once there are more than max_patterns patterns, the ones that have gone longest without a page
+    are dropped, those with fewer than min_pages pages first. min_yield 0 turns it off.
+    '''
+
+    def __init__(self, min_pages=20, min_yield=0.2, window=200, probe=20, throttle=4.0, max_patterns=100000):
+        self.min_pages = min_pages
+        self.min_yield = min_yield
+        self.decay = 1 - 1 / window
+        self.probe = probe
+        self.throttle = throttle
+        self.max_patterns = max_patterns
+        self.hosts = dict()
+        self.patterns = dict()
+        # Pages recorded so far
+        self.recorded = 0
+        # What save() writes: a copy of both tables, brought up to date by snapshot() with the
+        # (table, key) entries changed since the last one
+        self.copies = {"hosts": dict(), "patterns": dict()}
+        self.changed = set()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.trap_min_pages, config.trap_min_yield, config.trap_window,
+                   config.trap_probe, config.trap_throttle, config.trap_max_patterns)
+
+    def record(self, url: str, outcome: str, new_links: int = 0) -> list:
+        # Adds a completed url, returns [(table, key, stats)] for its host ("hosts") and pattern ("patterns")
+        # if they became low yield or recovered
+        if not self.min_yield or outcome in ignored_outcomes:
+            return []
+        kind = outcome_kinds.get(outcome, low_kind)
+        self.recorded += 1
+        changed = []
+        for name, key in (("hosts", urlparse(url).netloc), ("patterns", url_pattern(url))):
+            table = getattr(self, name)
+            stats = table.get(key)
+            if stats is None:
+                stats = table[key] = HostStats()
+            stats.add(kind, new_links, self.decay)
+            stats.last = self.recorded
+            self.changed.add((name, key))
+            low_yield = stats.pages >= self.min_pages and stats.yield_rate < self.min_yield
+            if low_yield != stats.low_yield:
+                stats.low_yield = low_yield
+                changed.append((name, key, stats))
+        if len(self.patterns) > self.max_patterns:
+            self._prune()
+        return changed
+
+    def _prune(self):
+        # Down to 3/4 of max_patterns so this runs once per max_patterns / 4 new patterns
+        keep = self.max_patterns * 3 // 4
+        ranked = sorted(self.patterns.items(), key=lambda item: (item[1].pages >= self.min_pages, item[1].last))
+        for pattern, stats in ranked[:len(ranked) - keep]:
+            del self.patterns[pattern]
+            self.changed.add(("patterns", pattern))
+
+    def skip(self, url: str) -> bool:
+        # True if the url's pattern is capped and it is not the url's turn to probe it
+        if not self.min_yield:
+            return False
+        pattern = url_pattern(url)
+        stats = self.patterns.get(pattern)
+        if stats is None or not stats.low_yield:
+            return False
+        stats.skipped += 1
+        self.changed.add(("patterns", pattern))
+        return stats.skipped % self.probe != 0
+
+    def delay_factor(self, host: str) -> float:
+        stats = self.hosts.get(host)
+        return self.throttle if stats is not None and stats.low_yield else 1.0
+
+    def low_yield(self):
+        # Throttled hosts and capped patterns
+        return ([(host, stats) for host, stats in self.hosts.items() if stats.low_yield],
+                [(pattern, stats) for pattern, stats in self.patterns.items() if stats.low_yield])
+
+    def snapshot(self):
+        # State for save(), only the stats changed since the last call are copied. Called wherever the
+        # tracker is updated (under the frontier's lock), the state can then be saved outside of it
+        for name, key in self.changed:
+            stats = getattr(self, name).get(key)
+            if stats is None:
+                self.copies[name].pop(key, None)
+            else:
+                self.copies[name][key] = stats.copy()
+        self.changed.clear()
+        return self.copies["hosts"], self.copies["patterns"], self.recorded
+
+    def save(self, path: str, snapshot=None):
+        # Written to a temporary file and moved over the old one, like the analytics checkpoint
+        with open(path + ".tmp", "wb") as file:
+            pickle.dump(snapshot or self.snapshot(), file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+    def load(self, path: str):
+        with open(path, "rb") as file:
+            self.hosts, self.patterns, self.recorded = pickle.load(file)
+        self.copies = {"hosts": {host: stats.copy() for host, stats in self.hosts.items()},
+                       "patterns": {pattern: stats.copy() for pattern, stats in self.patterns.items()}}
+        self.changed.clear()
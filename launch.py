@@ -1,41 +1,46 @@
+import copy
 from configparser import ConfigParser
 from argparse import ArgumentParser
 
 from utils.server_registration import get_cache_server
 from utils.config import Config
 from crawler import Crawler
-from scraper import visited_defrags, longest_info, word_frequency, subdomains
+from crawler.shard import crawl_sharded, shard_save_file
+from crawler.store import rehash
+from utils import canonical
+import scraper
 
 
-def main(config_file, restart):
+def main(config_file, restart, rehash_save=False):
     cparser = ConfigParser()
     cparser.read(config_file)
     config = Config(cparser)
+    if rehash_save and not restart:
+        # Migrate the save file to the current canonical urls before the frontier loads it
+        canonical.configure(config)
+        for shard in range(config.shards):
+            shard_config = config
+            if config.shards > 1:
+                shard_config = copy.copy(config)
+                shard_config.save_file = shard_save_file(config.save_file, shard)
+            before, after = rehash(shard_config)
+            print(f"Rehashed {shard_config.save_file}: {before} urls, {after} after merging duplicates.")
     config.cache_server = get_cache_server(config, restart)
-    crawler = Crawler(config, restart)
-    crawler.start()
+    if config.shards > 1:
+        # The merged statistics of the shards end up in scraper.totals
+        crawl_sharded(config, restart)
+    else:
+        crawler = Crawler(config, restart)
+        crawler.start()
     
-    # gather report after crawler finishes
-    with open("report.txt", "w") as file:
-        file.write("1. " + str(len(visited_defrags)) + " unique pages found.\n")
-        file.write("2. The longest page is " + longest_info["longest_page"] + " with " + str(longest_info["longest_page_num"]) + " words.\n")
-        file.write("3. The 50 most common words are: \n")
-        for counter, (key, value) in enumerate(sorted(word_frequency.items(), key = lambda x: x[1], reverse=True)):
-            file.write(f"{key} -> {value}\n")
-            if counter >= 49:
-                break
-        file.write("4. " + str(len(subdomains)) + "\n")
-        for subdomain in sorted(subdomains):
-            count = 1
-            for defrag in visited_defrags:
-                if (subdomain + ".ics.uci.edu") in defrag:
-                    count += 1
-            file.write("https://" + subdomain + ".ics.uci.edu, " + str(count) + "\n")
+    # gather report after crawler finishes, report.py writes the same from the last checkpoint
+    scraper.totals.write_report("report.txt")
 
 
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("--restart", action="store_true", default=False)
+    parser.add_argument("--rehash", action="store_true", default=False)
     parser.add_argument("--config_file", type=str, default="config.ini")
     args = parser.parse_args()
-    main(args.config_file, args.restart)
+    main(args.config_file, args.restart, args.rehash)
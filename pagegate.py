@@ -0,0 +1,117 @@
+# Response types worth parsing, matched against the start of the Content-Type header
+parsed_content_types = ("text/html", "text/xml", "application/xhtml+xml")
+
+# Statuses whose content is a page, redirects included since the cache server returns the page redirected to
+parsed_statuses = frozenset((200, 301, 302))
+
+# Pages with fewer bytes can not have the 100 characters of text the scraper asks for,
+# and pages with more are data dumps rather than something to read
+min_page_bytes = 100
+max_page_bytes = 5 * 1024 * 1024
+
+# Leading bytes of common binary formats, for responses whose Content-Type is missing or wrong
+binary_signatures = (
+    b"%PDF", b"PK\x03\x04", b"\x89PNG", b"GIF8", b"\xff\xd8\xff", b"\x1f\x8b", b"BZh", b"Rar!",
+    b"7z\xbc\xaf", b"\xd0\xcf\x11\xe0", b"ID3", b"RIFF", b"OggS", b"\x00\x00\x01\xba", b"fLaC",
+    b"\x7fELF", b"MZ", b"%!PS", b"{\\rtf",
+)
+utf16_boms = (b"\xff\xfe", b"\xfe\xff")
+sniff_length = 512
+
+
+class PageGate(object):
+    '''Decides from a response's status, headers, size and first bytes whether it
+    is worth parsing, before any parsing happens. check returns None for a response
+    to parse, or the reason it is rejected:
+
+    status       -> status other than parsed_statuses
+    empty        -> no content
+    content_type -> Content-Type that is not one of content_types
+    too_small    -> fewer than min_bytes of content
+    too_large    -> more than max_bytes of content
+    binary       -> starts like a binary file format, or has NUL bytes near the start
+    '''
+
+    def __init__(self, content_types=parsed_content_types, min_bytes=min_page_bytes, max_bytes=max_page_bytes):
+        self.content_types = tuple(content_type.lower() for content_type in content_types)
+        self.min_bytes = min_bytes
+        self.max_bytes = max_bytes
+
+    def check(self, resp):
+        if resp.status not in parsed_statuses:
+            return "status"
+        raw = resp.raw_response
+        content = getattr(raw, "content", None)
+        if not content:
+            return "empty"
+        content_type = (getattr(raw, "headers", None) or {}).get("Content-Type")
+        if content_type and not content_type.strip().lower().startswith(self.content_types):
+            return "content_type"
+        if len(content) < self.min_bytes:
+            return "too_small"
+        if len(content) > self.max_bytes:
+            return "too_large"
+        if is_binary(content):
+            return "binary"
+        return None
+
+
+def is_binary(content: bytes) -> bool:
+    head = content[:sniff_length]
+    if head.startswith(utf16_boms):
+        return False
+    return head.lstrip().startswith(binary_signatures) or b"\x00" in head
+
+
+if __name__ == "__main__":
+    # Time spent on a mixed corpus: parsing every response (what the scraper did before, the content type
+    # was only looked at after parsing) against gating first and parsing only what passes
+    import os
+    import random
+    import time
+    import scraper
+
+    random.seed(0)
+    words = " ".join(f"word{random.randint(0, 5000)}" for _ in range(1500))
+    html = (f"<html><body>" + "".join(f"<p>{words[i:i + 400]}</p><a href='/p{i}'>l</a>"
+                                     for i in range(0, len(words), 400)) + "</body></html>").encode()
+
+    class Raw(object):
+        def __init__(self, content, content_type):
+            self.content = content
+            self.headers = {"Content-Type": content_type} if content_type else {}
+
+    class Resp(object):
+        def __init__(self, content, content_type, status=200):
+            self.url = "https://www.ics.uci.edu/x"
+            self.status = status
+            self.raw_response = Raw(content, content_type)
+
+    corpus = (
+        [Resp(html, "text/html; charset=utf-8") for _ in range(600)]
+        + [Resp(b"%PDF-1.5\n" + os.urandom(300000), "application/pdf") for _ in range(120)]
+        + [Resp(b"\x89PNG\r\n\x1a\n" + os.urandom(80000), None) for _ in range(80)] # no Content-Type
+        + [Resp(b"PK\x03\x04" + os.urandom(200000), "text/html") for _ in range(40)] # mislabeled archive
+        + [Resp(html * 600, "text/html") for _ in range(10)] # data dump
+        + [Resp(b"<html></html>", "text/html") for _ in range(100)]
+        + [Resp(words.encode(), "text/plain") for _ in range(50)]
+    )
+    random.shuffle(corpus)
+    size = sum(len(resp.raw_response.content) for resp in corpus)
+    print(f"{len(corpus)} responses, {size / 2 ** 20:.1f} MiB")
+
+    gate = PageGate()
+    start = time.perf_counter()
+    for resp in corpus:
+        scraper.parse_page(resp.url, resp.raw_response.content)
+    ungated = time.perf_counter() - start
+    start = time.perf_counter()
+    rejected = dict()
+    for resp in corpus:
+        reason = gate.check(resp)
+        if reason:
+            rejected[reason] = rejected.get(reason, 0) + 1
+        else:
+            scraper.parse_page(resp.url, resp.raw_response.content)
+    gated = time.perf_counter() - start
+    print(f"parse everything: {ungated:.2f}s, gate then parse: {gated:.2f}s, rejected {rejected}")
@@ -0,0 +1,30 @@
+from configparser import ConfigParser
+from argparse import ArgumentParser
+
+from utils.config import Config
+from analytics import CrawlAnalytics
+from crawler.shard import merge_shard_analytics
+
+
+def main(config_file, output):
+    # Writes the report from the last analytics checkpoint, the crawl can still be running
+    cparser = ConfigParser()
+    cparser.read(config_file)
+    config = Config(cparser)
+    if config.shards > 1:
+        # Each shard checkpoints its own statistics
+        analytics = merge_shard_analytics(config)
+    else:
+        analytics = CrawlAnalytics.load(config.save_file + ".analytics")
+    analytics.write_report(output)
+    print(f"Wrote {output} from {analytics.pages} pages.")
+    for reason, count in analytics.rejections.most_common():
+        print(f"  {count} responses rejected: {reason}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--config_file", type=str, default="config.ini")
+    parser.add_argument("--output", type=str, default="report.txt")
+    args = parser.parse_args()
+    main(args.config_file, args.output)
@@ -0,0 +1,112 @@
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from configparser import ConfigParser
+from argparse import ArgumentParser
+
+from utils import canonical
+from utils.config import Config
+from utils.pagestore import PageStore
+from analytics import CrawlAnalytics
+from crawler.shard import shard_save_file
+import scraper
+
+# Pages handed to a parser process at once, and batches kept in the pool per process ahead of the one being merged
+batch_size = 32
+batches_ahead = 2
+
+
+def parse_batch(pages):
+    # Runs in a parser process
+    return [scraper.parse_page(url, content) for url, content in pages]
+
+
+def store_paths(config):
+    # Each shard keeps its own page store, like its own save file
+    if config.shards > 1:
+        return [shard_save_file(config.page_store, shard) for shard in range(config.shards)]
+    return [config.page_store]
+
+
+def read_batches(paths):
+    # Stored pages in the order they were scraped, in batches of (url, resp, whether the page gate lets it through)
+    batch = []
+    for path in paths:
+        store = PageStore(path, readonly=True)
+        try:
+            for url, resp in store:
+                batch.append((url, resp, scraper.page_gate.check(resp) is None))
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+        finally:
+            store.close()
+    if batch:
+        yield batch
+
+
+def reprocess(config, processes):
+    ''' Runs the scraper over the pages in PAGESTORE as if they were being
+    crawled again, and returns the new statistics. The pages are read in the
+    order they were stored, parsed by processes parser processes (none parses
+    in this one) and merged in that same order, so two runs give the same
+    near-duplicates and report. robots.txt is not checked again, the crawl
+    already did. '''
+    stats = CrawlAnalytics(config.top_words)
+    pool = None
+    if processes > 0:
+        pool = ProcessPoolExecutor(
+            processes, mp_context=multiprocessing.get_context("spawn"),
+            initializer=canonical.set_canonicalizer, initargs=(canonical.canonicalizer,))
+    pending = deque()
+
+    def merge(batch, future):
+        # Parsed pages of the batch, in order, for the pages that got through the gate
+        parsed = iter(future.result()) if future is not None else None
+        for url, resp, gated in batch:
+            page = next(parsed) if parsed is not None and gated else None
+            scraper.extract_next_links(url, resp, stats, page)
+
+    try:
+        for batch in read_batches(store_paths(config)):
+            future = None
+            if pool is not None:
+                future = pool.submit(parse_batch, [(resp.url, resp.content) for _, resp, gated in batch if gated])
+            pending.append((batch, future))
+            while len(pending) > max(processes, 1) * batches_ahead:
+                merge(*pending.popleft())
+        while pending:
+            merge(*pending.popleft())
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return stats
+
+
+def main(config_file, output, processes):
+    cparser = ConfigParser()
+    cparser.read(config_file)
+    config = Config(cparser)
+    if not config.page_store:
+        raise SystemExit(f"PAGESTORE is not set in {config_file}, there are no stored pages to reprocess.")
+    # The same canonical urls as the crawl, for the visited pages and the links
+    canonical.configure(config)
+    start = time.perf_counter()
+    stats = reprocess(config, processes)
+    elapsed = time.perf_counter() - start
+    stats.write_report(output)
+    print(f"Wrote {output} from {stats.pages} pages, reprocessed in {elapsed:.1f}s.")
+    for reason, count in stats.rejections.most_common():
+        print(f"  {count} responses rejected: {reason}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--config_file", type=str, default="config.ini")
+    parser.add_argument("--output", type=str, default="report.txt")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(),
+                        help="parser processes, 0 parses in the main process")
+    args = parser.parse_args()
+    main(args.config_file, args.output, args.processes)
@@ -1,26 +1,75 @@
-import re
-from urllib import robotparser
-from urllib.parse import urlparse, urljoin, urldefrag
-from bs4 import BeautifulSoup as bs
-from collections import defaultdict
-from tokenizer import computeWordFrequencies
-from simhash import get_similarity_score, simhash
-import time
-
-visited_urls = set()
-visited_defrags = set()
-longest_info = {"longest_page": "", "longest_page_num": 0}
-stopwords = set(line.strip() for line in open('stopwords.txt'))
-word_frequency = defaultdict(int)
-subdomains = set()
-fingerprints = set()
-robot_parsers = dict()
-
-def scraper(url, resp):
-    links = extract_next_links(url, resp)
-    return [link for link in links if is_valid(link)]
-
-def extract_next_links(url, resp):
+from hashlib import blake2b
+from extractor import extract
+from threading import RLock, BoundedSemaphore, local
+from tokenizer import computeWordFrequencies, tokenize_text, default_stopwords
+from simhash import simhash_int
+from simindex import SimhashIndex
+from urlfilter import URLFilter
+from pagegate import PageGate
+from utils import normalize, metrics
+from analytics import CrawlAnalytics, open_analytics
+
+# Shared crawl state below is only touched while holding state_lock
+state_lock = RLock()
+visited_urls = set() # 16 byte digests of the visited urls, see visited_key
+# Report statistics of the whole crawl, see set_analytics. Only updated through checkpoint_analytics, under
+# checkpoint_lock instead of state_lock so the scraping threads never wait on a checkpoint
+checkpoint_lock = RLock()
+totals = CrawlAnalytics()
+stopwords = default_stopwords # from stopwords.txt
+url_filter = URLFilter() # compiled once, decides which urls get crawled
+page_gate = PageGate() # decides which responses get parsed, from their headers, size and first bytes
+max_text_length = 99999 # longer pages are skipped as traps or data dumps
+fingerprint_bits = 32 # 64 makes accidental near-duplicates much rarer on very large crawls
+fingerprints = SimhashIndex(threshold=.85, bits=fingerprint_bits) # near-duplicate index over integer fingerprints
+novelty_distance = fingerprint_bits // 3 # a page this many bits from the closest crawled page counts as entirely new
+# Per thread, the novelty (0 to 1) of the page whose links the thread adds to the frontier next, see parent_novelty,
+# and the url the thread scraped last with what came of it and its statistics, see page_outcome and page_stats
+link_context = local()
+# robots.txt rules, a crawler.robots.RobotsCache set by the Crawler, see set_robots_cache
+robots = None
+# Optional process pool for parse_page, see set_parser_pool
+parser_pool = None
+parser_slots = None
+# Optional utils.pagestore.PageStore every response is saved to before it is scraped, see set_page_store
+page_store = None
+
+def scraper(url, resp, stats=None):
+    # stats: the CrawlAnalytics to record this page in. By default the page gets its own, which the frontier
+    # takes with page_stats once it completes the url and merges into the totals once that is in its save file
+    # extract_next_links already filters its links through url_filter
+    if stats is None:
+        stats = link_context.stats = CrawlAnalytics()
+    try:
+        if page_store is not None:
+            page_store.add(url, resp)
+        return extract_next_links(url, resp, stats)
+    finally:
+        # The page is not needed past here, do not keep it while the worker adds the links and waits for its next url
+        resp.release()
+
+def page_stats(url):
+    # Statistics of url's page if this thread scraped it, None otherwise. Cleared once read, for the next url
+    stats = getattr(link_context, "stats", None) if getattr(link_context, "url", None) == url else None
+    link_context.stats = None
+    return stats
+
+def checkpoint_analytics(path, pages=()):
+    # Merge the statistics of completed pages into the totals and save them to path (<SAVE>.analytics) for report.py.
+    # The frontier calls this once the pages' urls are flushed to its save file, so after a crash the checkpoint has
+    # no page the crawl fetches again
+    with checkpoint_lock:
+        for stats in pages:
+            totals.merge(stats)
+        totals.save(path)
+
+def set_analytics(path, restart, top_words=0):
+    # Totals resumed from the checkpoint at path unless restarting
+    global totals
+    with checkpoint_lock:
+        totals = open_analytics(path, restart, top_words)
+
+def extract_next_links(url, resp, stats=None, parsed=None):
     # Implementation required.
     # url: the URL that was used to get the page
     # resp.url: the actual url of the page
@@ -30,170 +79,165 @@ def extract_next_links(url, resp):
     #         resp.raw_response.url: the url, again
     #         resp.raw_response.content: the content of the page!
     # Return a list with the hyperlinks (as strings) scrapped from resp.raw_response.content
+    # parsed: parse_page's result for the page if it was already parsed, as reprocess.py does
+
+    if stats is None:
+        stats = link_context.stats = CrawlAnalytics()
+    link_context.url = url
+    link_context.outcome = None
 
     # Already visited this URL, avoiding infinite loops
-    if resp.url in visited_urls:
+    # Canonical form, so the fragment and other spellings of a page count as the same url
+    page_url = normalize(resp.url)
+    page_key = visited_key(page_url)
+    with state_lock:
+        if page_key in visited_urls:
+            link_context.outcome = "visited"
+            return list()
+        # Maintain a set of previously visited URLs
+        visited_urls.add(page_key)
+
+    # Handle page redirects with 301, 302 status codes, and skip responses that are not pages
+    # (PDFs, images, empty or huge responses) before spending any time parsing them
+    rejection = page_gate.check(resp)
+    if rejection:
+        stats.reject(rejection)
+        link_context.outcome = rejection
         return list()
-    # Maintain a set of previously visited URLs
-    visited_urls.add(resp.url)
 
-    # Handle page redirects with 301, 302 status codes
-    if resp.status not in (301, 302, 200):
-        return list()
-    
     # If the page redirects, ensure that the redirected content is within the specified domains/pages
     if resp.status in (301, 302):
         if not is_valid(resp.url):
+            link_context.outcome = "redirect"
             return list()
 
-    # Check if the domain has an already parsed robots.txt
-    domain_info = urlparse(resp.url).netloc
-    robot_parser = None
-    if domain_info not in robot_parsers: # If no, read it and store it in the cache
-        try:
-            robots_file = resp.url + '/robots.txt'
-            rp = robotparser.RobotFileParser(robots_file)
-            rp.read()
-            robot_parsers[domain_info] = rp
-            robot_parser = rp
-        except Exception as e:
-            # If the robots file fails to parse, skip
-            robot_parser = None
-    else: # If yes, pull the robotparser object from a cache
-        robot_parser = robot_parsers[domain_info]
-
-    if robot_parser and not robot_parser.can_fetch("IR US24 23141678,14782048", resp.url):
+    # Check the robots.txt of the page's origin, an in-memory lookup since it is fetched in the background
+    if robots is not None and not robots.can_fetch(resp.url):
+        link_context.outcome = "robots"
         return list()
 
-    if robot_parser:
-        politeness_delay = robot_parser.crawl_delay("IR US24 23141678,14782048")
-        # respect the crawl delay of the robots.txt
-        if politeness_delay:
-            time.sleep(politeness_delay)
+    # Counting all unique URLs, the canonical url has the fragment cut off
+    stats.add_page(page_url)
 
-    # Splitting URL into fragments, we only care about the defragged url
-    defragged_url, throwaway = urldefrag(resp.url)
-    # Counting all unique URLs with the fragment cut off
-    if defragged_url not in visited_defrags:
-        visited_defrags.add(defragged_url)
+    page = parsed if parsed is not None else parse(resp.url, resp.raw_response.content)
 
-
-    # Soup object made out of current URL HTML content
-    if resp.raw_response is None or resp.raw_response.content is None:
+    # Avoid very large files, or traps, and avoid pages with low informational content
+    # Checked before the statistics are updated, since parsing stops early on very large pages
+    if page["text_length"] > max_text_length:
+        stats.reject("too_much_text")
+        link_context.outcome = "too_much_text"
+        return list()
+    if page["text_length"] < 100:
+        stats.reject("too_little_text")
+        link_context.outcome = "too_little_text"
         return list()
-    soup = bs(resp.raw_response.content, 'lxml')
-    text = soup.get_text()
-    words = text.split()
-    words = [word.lower() for word in words if word.isalnum()]
 
-    word_freq = get_word_frequencies(words) # Generate map of tokens and their # of occurrences
-    populate_longest_page_info(resp.url, words) # Update global longest_page_info map with info about longest page so far
-    populate_unique_subdomains(resp.url) # Update global set of unique subdomains
+    # Add the page's tokens and their # of occurrences, and keep track of the longest page so far
+    stats.add_words(resp.url, page["word_freq"], page["num_words"])
 
-    current_fingerprint = simhash(word_freq) # Generate a fingerprint for current URL
+    current_fingerprint = page["fingerprint"]
 
-    # If fingerprint of current page generates similarity score > 0.85
-    if is_too_similar(current_fingerprint):
+    # If fingerprint of current page generates similarity score > 0.85, otherwise because we are crawling
+    # the page, its fingerprint is added to the set of visited fingerprints
+    distance, duplicate = add_fingerprint(current_fingerprint)
+    if duplicate:
+        stats.reject("near_duplicate")
+        link_context.outcome = "near_duplicate"
         return list()
 
+    # The frontier ranks the links of pages unlike anything crawled so far higher
+    link_context.novelty = 1.0 if distance is None else min(distance / novelty_distance, 1.0)
+    link_context.outcome = "ok"
+    return page["links"]
 
-    # Avoid very large files, or traps, and avoid pages with low informational content
-    if len(text) > 99999 or len(text) < 100:
-        return list()
 
-    try:
-        # Gets the content type of current URL
-        content_type = resp.raw_response.headers['Content-Type']
+def parse(url, content):
+    # Parses the page in the parser process pool if there is one, otherwise in the calling thread
+    with metrics.timer("parse"):
+        if parser_pool is None:
+            return parse_page(url, content)
+        with parser_slots: # bounds how many pages wait for or sit in the pool
+            return parser_pool.submit(parse_page, url, content).result()
 
-        # Ignores all pages which are not of type HTML or XML
-        if "text/html" not in content_type and "text/xml" not in content_type:
-            return list()
-    except Exception as e:
-        pass
-    
-    # Because we are crawling the page, add the fingerprint to the set of visited fingerprints
-    fingerprints.add(current_fingerprint)
 
-    # All anchor tags in current URL
-    a_links = soup.find_all('a')
-    links = []
+def set_parser_pool(pool, max_pending: int):
+    # Use a process pool (or None) for parse_page, with at most max_pending pages submitted to it at once
+    global parser_pool, parser_slots
+    parser_pool = pool
+    parser_slots = BoundedSemaphore(max_pending)
+
 
-    for tag in a_links:
-        # Error handling for anchor with no href attribute
-        try:
-            cur_url = tag['href']
-        except:
-            continue # continue to next link
+def parse_page(url, content):
+    # CPU-bound half of the scraper. It does not touch any shared state so it can run in another process.
+    # Returns the valid links, the token frequency map, the number of words, the length of the text and the fingerprint.
 
-        # If href tag is empty string
-        if len(tag['href']) == 0:
-            continue
-        
-        # Join the relative path to the base path to create an absolute path
-        cur_url = urljoin(resp.url, cur_url)
+    # One pass over the html for the visible text and the absolute urls of all non-empty anchor hrefs,
+    # stopping early if the text gets longer than we would accept anyway
+    text, hrefs, truncated = extract(url, content, max_text_length)
+    words = tokenize_text(text) # lowercase alphanumeric tokens, the same ones tokenizer.py finds in files
 
-        if is_valid(cur_url):
-            links.append(cur_url)
+    word_freq = computeWordFrequencies(words, stopwords) # Generate map of tokens and their # of occurrences
 
-    return links
+    # Canonical urls, so links that only differ in a fragment or tracking parameter are one link
+    links = url_filter.filter_links(normalize(href) for href in hrefs)
 
+    return {
+        "links": links,
+        "word_freq": word_freq,
+        "num_words": len(words),
+        "text_length": len(text),
+        "fingerprint": simhash_int(word_freq, fingerprint_bits), # Generate a fingerprint for current URL
+    }
 
 def is_valid(url):
     # Decide whether to crawl this url or not. 
     # If you decide to crawl it, return True; otherwise return False.
-    # There are already some conditions that return False.
-
-    valid_domains = ['.ics.uci.edu', '.cs.uci.edu', '.informatics.uci.edu', '.stat.uci.edu']
-    
+    # The rules (allowed domains, blocked extensions, trap patterns) live in url_filter, see urlfilter.py.
     try:
-        parsed = urlparse(url)
-        if parsed.scheme not in set(["http", "https"]):
-            return False
-        return any(domain in parsed.netloc for domain in valid_domains) and (not '#' in url) and not re.match(
-            r".*\.(css|js|bmp|gif|jpe?g|ico|php|r"
-            + r"|png|tiff?|mid|mp2|mp3|mp4|bib"
-            + r"|wav|avi|mov|mpeg|ram|m4v|mkv|ogg|ogv|pdf"
-            + r"|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names"
-            + r"|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso"
-            + r"|epub|dll|cnf|tgz|sha1|DS_Store"
-            + r"|thmx|mso|arff|rtf|jar|csv"
-            + r"|rm|smil|wmv|swf|wma|zip|rar|gz|svn)$", parsed.path.lower())
-
+        return url_filter.is_valid(url)
     except TypeError:
-        print ("TypeError for ", parsed)
+        print ("TypeError for ", url)
         raise
 
-def populate_unique_subdomains(url: str):
-    # For a given url, check if its subdomain has been seen before
-    # add to set if never seen before
-    try:
-        domains = urlparse(url).netloc.split(".")
-        subdomain = domains[:-3]
-        domain = domains[-3:]
-        if subdomain and "ics.uci.edu" in ".".join(domain):
-            subdomains.add("".join(subdomain))
-    except Exception as e:
-        pass
-
-def populate_longest_page_info(url: str, words: str):
-    num_words = len(words)
-    if num_words > longest_info["longest_page_num"]:
-        longest_info["longest_page"] = url
-        longest_info["longest_page_num"] = num_words
-
-def get_word_frequencies(words: list):
-    word_freq = computeWordFrequencies(words, stopwords)
-    for k, v in word_freq.items():
-        word_frequency[k] += v
-
-    return word_freq
-
-def is_too_similar(current_fingerprint: str):
+def set_page_store(store):
+    # Save every response to a utils.pagestore.PageStore (or None to not save them)
+    global page_store
+    page_store = store
+
+def set_robots_cache(cache):
+    # Use a crawler.robots.RobotsCache (or None to skip robots.txt checks)
+    global robots
+    robots = cache
+
+def add_fingerprint(current_fingerprint: int):
+    # Bits between the current page's fingerprint and the closest one found by the index (None if it found none),
+    # and whether that makes it a near-duplicate. If not, the fingerprint is added under the same lock hold, so two
+    # near-duplicate pages scraped at the same time can not both get through
+    with metrics.timer("similarity"), state_lock:
+        distance = fingerprints.nearest_distance(current_fingerprint)
+        duplicate = distance is not None and distance <= fingerprints.max_distance
+        if not duplicate:
+            fingerprints.add(current_fingerprint)
+        return distance, duplicate
+
+def visited_key(url) -> bytes:
+    # Exact unlike a Bloom filter, a page is never skipped for a url it was not visited under,
+    # in a fraction of the memory of the url strings
+    return blake2b(url.encode("utf-8"), digest_size=16).digest()
+
+def parent_novelty() -> float:
+    # Novelty of the page this thread scraped last, for the priority of the links it adds to the frontier
+    return getattr(link_context, "novelty", 1.0)
+
+def page_outcome(url) -> str:
+    # What came of url when this thread scraped it: "ok" or the reason it was rejected, "error" if the
+    # thread did not get to scrape it (the download failed). Cleared once read, for the next url
+    outcome = getattr(link_context, "outcome", None) if getattr(link_context, "url", None) == url else None
+    link_context.url = link_context.outcome = None
+    return outcome or "error"
+
+def is_too_similar(current_fingerprint: int):
     # Compare the current page's fingerprint to the fingerprints of previous pages using simhashing to check for similarity/duplicates
-    # Using a similarity percentage of 85% as the cutoff point
-    for fingerprint in fingerprints:
-        sim_score = get_similarity_score(current_fingerprint, fingerprint) # Comparing current URL fingerprint against all others discovered so far
-        if sim_score > .85: # we choose .85 as our threshold here
-            return True
-
-    return False
+    # Using a similarity percentage of 85% as the cutoff point, the index only compares against fingerprints that can be that close
+    with metrics.timer("similarity"), state_lock:
+        return fingerprints.has_near_duplicate(current_fingerprint)
@@ -1,44 +1,74 @@
-from hashlib import md5
+from hashlib import blake2b
+from zlib import crc32
 bits = 32
 
-def simhash(token_map: dict) -> str:
-    # Generates simhash fingerprint given a map of tokens and their weights (in our case, occurrences in a web page)
+try:
+    import numpy as np
+except ImportError: # NumPy is optional, the pure Python path gives the same fingerprints
+    np = None
 
-    bit_map = dict()
 
-    for word in token_map:
-        bit_map[word] = bin(0xFFFFFFFF & int(md5(word.encode()).hexdigest(), bits))[2:].zfill(bits) # 32 least significant bits
-    
-    vector = [0] * bits # Vector with 32 zeroes
+def hash_token(word: str, bits: int = bits) -> int:
+    # Cheap hash of a token, crc32 for 32-bit fingerprints and an 8 byte blake2b digest for 64-bit ones
+    data = word.encode()
+    if bits == 32:
+        return crc32(data)
+    return int.from_bytes(blake2b(data, digest_size=bits // 8).digest(), "big")
 
-    # Looping through every word in the map {word -> binary}
-    for k, v in bit_map.items():
-        # Looping through every bit in the binary representation of a word
-        for i in range(bits):
-            if(v[i] == "1"):
-                vector[i] += token_map[k]
-            else:
-                vector[i] -= token_map[k]
 
-    for i in range(bits):
-        # Creating final binary string for both vectors
-        if vector[i] > 0:
-            vector[i] = "1"
-        else:
-            vector[i] = "0"
+def simhash_int(token_map: dict, bits: int = bits) -> int:
+    # Generates simhash fingerprint as an integer given a map of tokens and their weights (in our case, occurrences in a web page)
+    assert bits in (32, 64), "Only 32 and 64 bit fingerprints are supported"
+    if not token_map:
+        return 0
 
-    return "".join(vector) # returns 32-bit fingerprint
+    hashes = [hash_token(word, bits) for word in token_map]
+    weights = list(token_map.values())
 
+    if np is not None:
+        # Matrix of token bits (tokens x bits, least significant bit first), turned into +1/-1 and weighted in one product
+        hash_array = np.array(hashes, dtype=np.uint64)
+        bit_matrix = (hash_array[:, None] >> np.arange(bits, dtype=np.uint64)) & np.uint64(1)
+        signs = bit_matrix.astype(np.int64) * 2 - 1
+        vector = np.asarray(weights, dtype=np.int64) @ signs
+        return int(np.packbits(vector[::-1] > 0).view(">u8" if bits == 64 else ">u4")[0])
 
-def get_similarity_score(fpA: str, fpB: str):
-    # Given two fingerprints, generate a similarity score
-    
-    similarity_count = 0
+    fingerprint = 0
     for i in range(bits):
-        if fpA[i] == fpB[i]: # if bit i is the same in both vectors
-            similarity_count += 1
+        mask = 1 << i
+        # Sum of weights of tokens with bit i set minus the weights of the ones without it
+        total = sum(weight if hashed & mask else -weight for hashed, weight in zip(hashes, weights))
+        if total > 0:
+            fingerprint |= mask
+    return fingerprint
+
+
+def popcount(x: int) -> int:
+    # Number of set bits in x
+    return bin(x).count("1")
 
-    return similarity_count / bits # number of same bits in the same place / 32 bits
+
+if hasattr(int, "bit_count"): # Python 3.10+ has a native popcount
+    popcount = int.bit_count
+
+
+def similarity(fpA: int, fpB: int, bits: int = bits) -> float:
+    # Fraction of bits that are the same in both integer fingerprints
+    return (bits - popcount(fpA ^ fpB)) / bits
+
+
+def simhash(token_map: dict) -> str:
+    # Compatibility wrapper, returns the 32-bit fingerprint as a binary string
+    return format(simhash_int(token_map, bits), f"0{bits}b")
+
+
+def get_similarity_score(fpA, fpB):
+    # Given two fingerprints (binary strings or integers), generate a similarity score
+    if isinstance(fpA, str):
+        fpA = int(fpA, 2)
+    if isinstance(fpB, str):
+        fpB = int(fpB, 2)
+    return similarity(fpA, fpB) # number of same bits in the same place / 32 bits
 
 
 if __name__ == "__main__":
@@ -49,4 +79,27 @@ if __name__ == "__main__":
     fingerprintB = simhash(t2)
     print(fingerprintA, fingerprintB)
 
-    print(get_similarity_score(fingerprintA, fingerprintB))
\ No newline at end of file
+    print(get_similarity_score(fingerprintA, fingerprintB))
+
+    # Microbenchmark against the previous md5/string implementation on page-sized token maps
+    import re
+    import time
+    from collections import Counter
+    from hashlib import md5
+
+    def legacy_simhash(token_map: dict) -> str:
+        bit_map = {word: bin(0xFFFFFFFF & int(md5(word.encode()).hexdigest(), 32))[2:].zfill(32) for word in token_map}
+        vector = [0] * 32
+        for k, v in bit_map.items():
+            for i in range(32):
+                vector[i] += token_map[k] if v[i] == "1" else -token_map[k]
+        return "".join("1" if x > 0 else "0" for x in vector)
+
+    words = re.findall(r"[a-z0-9]+", (open("README.md").read() + open("finalreport.txt").read()).lower())
+    for size in (200, 1000, 5000):
+        token_map = Counter(words[:size])
+        for name, fn in (("legacy", legacy_simhash), ("simhash 32", lambda m: simhash_int(m, 32)), ("simhash 64", lambda m: simhash_int(m, 64))):
+            start = time.perf_counter()
+            for _ in range(50):
+                fn(token_map)
+            print(f"{len(token_map):>5} distinct tokens, {name:<10}: {(time.perf_counter() - start) / 50 * 1e3:7.3f} ms/page")
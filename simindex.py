@@ -0,0 +1,123 @@
+from collections import defaultdict
+from itertools import combinations
+from simhash import bits, popcount
+
+
+def max_distance_for(threshold: float, bits: int = bits) -> int:
+    # Largest Hamming distance whose similarity score (same bits / total bits) is still strictly above threshold
+    # With 32 bits and a threshold of .85 this is 4, since 28/32 = .875 > .85 but 27/32 = .84375 is not
+    return bits - int(bits * threshold) - 1
+
+
+class SimhashIndex(object):
+    '''Near-duplicate index over integer simhash fingerprints.
+
+    The fingerprint is split into `blocks` contiguous bit blocks. If two fingerprints differ in at most
+    `max_distance` bits, at least (blocks - max_distance) of those blocks are identical (pigeonhole), so one
+    table is kept per combination of that many blocks, keyed on the bits of those blocks. A query only
+    compares against the fingerprints sharing a key with it in some table instead of the whole set.
+    '''
+
+    def __init__(self, threshold: float = .85, bits: int = bits, blocks: int = None):
+        self.bits = bits
+        self.threshold = threshold
+        self.max_distance = max_distance_for(threshold, bits)
+        if blocks is None:
+            blocks = self.max_distance + 2 # gives 2-block keys, a reasonable memory/speed tradeoff
+        assert blocks > self.max_distance, "Need more blocks than the allowed Hamming distance"
+        assert blocks <= bits, "Cannot have more blocks than bits"
+        self.blocks = blocks
+
+        # Masks for each bit block, most significant block first
+        self.block_masks = []
+        start = bits
+        for i in range(blocks):
+            width = bits // blocks + (1 if i < bits % blocks else 0)
+            start -= width
+            self.block_masks.append(((1 << width) - 1) << start)
+
+        # One table per combination of blocks that must match exactly
+        self.table_masks = [
+            sum(self.block_masks[i] for i in combo)
+            for combo in combinations(range(blocks), blocks - self.max_distance)]
+        self.tables = [defaultdict(list) for _ in self.table_masks]
+        self.fingerprints = set()
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def __contains__(self, fingerprint: int):
+        return fingerprint in self.fingerprints
+
+    def __iter__(self):
+        return iter(self.fingerprints)
+
+    def add(self, fingerprint: int):
+        # Adds a fingerprint to every table, ignoring exact repeats
+        if fingerprint in self.fingerprints:
+            return
+        self.fingerprints.add(fingerprint)
+        for mask, table in zip(self.table_masks, self.tables):
+            table[fingerprint & mask].append(fingerprint)
+
+    def update(self, fingerprints):
+        for fingerprint in fingerprints:
+            self.add(fingerprint)
+
+    def find_near_duplicate(self, fingerprint: int):
+        # Returns a stored fingerprint within max_distance bits of the given one, or None if there is none
+        if fingerprint in self.fingerprints:
+            return fingerprint
+        for mask, table in zip(self.table_masks, self.tables):
+            for candidate in table.get(fingerprint & mask, ()):
+                if popcount(candidate ^ fingerprint) <= self.max_distance:
+                    return candidate
+        return None
+
+    def nearest_distance(self, fingerprint: int):
+        # Hamming distance to the closest fingerprint sharing a table key with this one, None if none does.
+        # Exact up to max_distance (it stops at the first near duplicate), beyond that it is the closest
+        # of the candidates the tables turn up, a cheap measure of how new a page is
+        if fingerprint in self.fingerprints:
+            return 0
+        nearest = None
+        for mask, table in zip(self.table_masks, self.tables):
+            for candidate in table.get(fingerprint & mask, ()):
+                distance = popcount(candidate ^ fingerprint)
+                if nearest is None or distance < nearest:
+                    if distance <= self.max_distance:
+                        return distance
+                    nearest = distance
+        return nearest
+
+    def has_near_duplicate(self, fingerprint: int) -> bool:
+        return self.find_near_duplicate(fingerprint) is not None
+
+    def query_many(self, fingerprints) -> list:
+        # Bulk version of has_near_duplicate, one bool per fingerprint in the same order
+        return [self.has_near_duplicate(fingerprint) for fingerprint in fingerprints]
+
+
+if __name__ == "__main__":
+    # Benchmark: per-lookup cost of the index vs the linear scan as the number of stored fingerprints grows
+    import random
+    import time
+
+    random.seed(0)
+    queries = [random.getrandbits(bits) for _ in range(1000)]
+    for size in (10000, 100000, 1000000):
+        index = SimhashIndex()
+        index.update(random.getrandbits(bits) for _ in range(size))
+
+        start = time.perf_counter()
+        index.query_many(queries)
+        indexed = (time.perf_counter() - start) / len(queries)
+
+        start = time.perf_counter()
+        for query in queries[:20]:
+            any(popcount(query ^ fp) <= index.max_distance for fp in index.fingerprints)
+        linear = (time.perf_counter() - start) / 20
+
+        hits = sum(index.query_many(queries))
+        print(f"{size:>8} fingerprints: indexed {indexed * 1e6:8.1f} us/lookup, "
+              f"linear scan {linear * 1e6:10.1f} us/lookup, {hits}/{len(queries)} queries had a near duplicate")
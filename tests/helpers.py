@@ -0,0 +1,79 @@
+import logging
+import os
+import random
+import tempfile
+import unittest
+
+from configparser import ConfigParser
+
+import cbor
+
+from utils.config import Config
+from utils.replay import make_payload
+from utils.response import Response
+from simindex import SimhashIndex
+import scraper
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Hosts of the fake site, every page links to 5 pages of them
+hosts = [f"h{i}.ics.uci.edu" for i in range(6)]
+site_pages = 400
+
+
+def make_config(workdir, **options):
+    # config.ini with the save file in workdir, no politeness delay and the given attributes replaced
+    cparser = ConfigParser()
+    cparser.read(os.path.join(repo, "config.ini"))
+    config = Config(cparser)
+    config.save_file = os.path.join(workdir, "frontier.shelve")
+    config.seed_urls = [f"https://{host}/p1" for host in hosts]
+    config.time_delay = 0.0
+    for name, value in options.items():
+        setattr(config, name, value)
+    return config
+
+
+def fake_page(url) -> bytes:
+    # html of a page of the fake site, the same every time it is asked for
+    rnd = random.Random(url)
+    number = int(url.rsplit("/p", 1)[1]) if "/p" in url else 0
+    links = [f"https://{rnd.choice(hosts)}/p{(number * 7 + k) % site_pages}" for k in range(5)]
+    body = " ".join(f"word{rnd.randint(0, 5000)}" for _ in range(300))
+    return (f"<html><body><p>{body}</p>" + "".join(f'<a href="{link}">x</a>' for link in links)
+            + "</body></html>").encode()
+
+
+def fake_payload(url) -> bytes:
+    # What the cache server would answer for url on the fake site, there are no robots.txt files
+    if url.endswith("/robots.txt"):
+        return make_payload(url, 404, error="Not found")
+    return make_payload(url, 200, fake_page(url))
+
+
+def fake_download(url, config, logger=None):
+    return Response(cbor.loads(fake_payload(url)))
+
+
+def reset_scraper():
+    # The scraper's module state of a crawl, the Crawler resets the analytics
+    with scraper.state_lock:
+        scraper.visited_urls.clear()
+        scraper.fingerprints = SimhashIndex(threshold=.85, bits=scraper.fingerprint_bits)
+
+
+class CrawlTestCase(unittest.TestCase):
+    # Runs in a temporary directory, where the crawler's Logs go too, with INFO logging off
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.workdir = self.tempdir.name
+        os.chdir(self.workdir)
+        logging.disable(logging.INFO)
+        reset_scraper()
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        os.chdir(self.cwd)
+        self.tempdir.cleanup()
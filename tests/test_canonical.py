@@ -0,0 +1,63 @@
+import unittest
+
+from utils import get_urlhash
+from utils.canonical import Canonicalizer
+
+# url -> its canonical form with the default rules
+cases = {
+    # Scheme and host lowercased, trailing dot and default port dropped, other ports kept
+    "HTTPS://WWW.ICS.UCI.EDU./a": "https://www.ics.uci.edu/a",
+    "http://www.ics.uci.edu:80/a": "http://www.ics.uci.edu/a",
+    "https://www.ics.uci.edu:8443/a": "https://www.ics.uci.edu:8443/a",
+    # Fragment dropped, empty path is /
+    "https://www.ics.uci.edu#top": "https://www.ics.uci.edu/",
+    # Dot-segments resolved
+    "https://www.ics.uci.edu/a/./b/../c": "https://www.ics.uci.edu/a/c",
+    "https://www.ics.uci.edu/a/b/..": "https://www.ics.uci.edu/a/",
+    # Escapes of unreserved characters decoded, the others uppercased, spaces escaped
+    "https://www.ics.uci.edu/%7euser/%2f%41": "https://www.ics.uci.edu/~user/%2FA",
+    "https://www.ics.uci.edu/a b": "https://www.ics.uci.edu/a%20b",
+    # Index files dropped
+    "https://www.ics.uci.edu/dir/index.html": "https://www.ics.uci.edu/dir/",
+    "https://www.ics.uci.edu/dir/INDEX.HTM": "https://www.ics.uci.edu/dir/",
+    # Tracking and session parameters stripped, the query sorted by name, empty parameters dropped
+    "https://www.ics.uci.edu/a?utm_source=x&b=2&&a=1&fbclid=y": "https://www.ics.uci.edu/a?a=1&b=2",
+    "https://www.ics.uci.edu/a?b=2&a=1&b=1": "https://www.ics.uci.edu/a?a=1&b=2&b=1",
+    # Session ids in ;parameters stripped within their own path segment
+    "https://www.ics.uci.edu/app;JSESSIONID=AB12": "https://www.ics.uci.edu/app",
+    "https://www.ics.uci.edu/app;jsessionid=AB12/docs/page1.html": "https://www.ics.uci.edu/app/docs/page1.html",
+    "https://www.ics.uci.edu/app;v=2;sid=1;sessionid=3/docs": "https://www.ics.uci.edu/app;v=2;sid=1/docs",
+    # Not http(s): only the fragment goes
+    "mailto:Someone@ICS.uci.edu#x": "mailto:Someone@ICS.uci.edu",
+}
+
+
+class CanonicalizerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rules = Canonicalizer()
+
+    def test_rules(self):
+        for url, expected in cases.items():
+            with self.subTest(url=url):
+                self.assertEqual(self.rules.canonicalize(url), expected)
+
+    def test_idempotent(self):
+        for url in cases:
+            with self.subTest(url=url):
+                canonical = self.rules.canonicalize(url)
+                self.assertEqual(self.rules.canonicalize(canonical), canonical)
+
+    def test_pages_after_path_parameters_stay_apart(self):
+        first = self.rules.canonicalize("https://www.ics.uci.edu/app;jsessionid=AB12/docs/page1.html")
+        second = self.rules.canonicalize("https://www.ics.uci.edu/app;jsessionid=AB12/docs/page2.html")
+        self.assertNotEqual(get_urlhash(first), get_urlhash(second))
+
+    def test_configured_rules(self):
+        rules = Canonicalizer(strip_params=("ref", "s?d"), index_files=("default.aspx",), sort_query=False)
+        self.assertEqual(rules.canonicalize("https://www.ics.uci.edu/x/Default.aspx?z=1&REF=2&sid=3&a=4"),
+                         "https://www.ics.uci.edu/x/?z=1&a=4")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+
+from extractor import extract
+from tokenizer import tokenize_text
+
+page_url = "https://www.ics.uci.edu/dir/page.html"
+
+# name -> (html, tokens of the visible text, absolute links). The expected values are what
+# BeautifulSoup's get_text() and find_all("a") gave for the same pages, without script, style and template
+fixtures = {
+    "script_style": (
+        b"<html><head><style>p { color: red }</style><script>var hidden = 1;</script></head>"
+        b"<body><p>Visible text</p><a href='next.html'>next</a></body></html>",
+        ["visible", "textnext"], ["https://www.ics.uci.edu/dir/next.html"]),
+    "comments": (
+        b"<html><body><!-- hidden comment --><p>shown</p><a href='/abs'>a</a><a href=''>empty</a><a>none</a></body></html>",
+        ["shownaemptynone"], ["https://www.ics.uci.edu/abs"]),
+    "entities": (
+        b"<html><body><p>caf&eacute; &amp; cr&#232;me &lt;tag&gt;</p></body></html>",
+        ["caf", "cr", "me", "tag"], []),
+    "unclosed": (
+        b"<html><body><p>one<p>two<div>three<a href=x?q=1#frag>link</body>",
+        ["onetwothreelink"], ["https://www.ics.uci.edu/dir/x?q=1#frag"]),
+    "latin1": (
+        '<html><head><meta charset="iso-8859-1"></head><body><p>naïve résumé</p></body></html>'.encode("latin-1"),
+        ["na", "ve", "r", "sum"], []),
+    "empty": (b"", [], []),
+    "template_pre": (
+        b"<html><body><template><p>templated</p></template><noscript>enable js</noscript>"
+        b"<pre>  pre\n  formatted </pre></body></html>",
+        ["enable", "js", "pre", "formatted"], []),
+    "tables": (
+        b"<table><tr><td>cell1</td><td>cell2</td></tr><tr><td><a href='../up.html'>up</a></td></tr></table>",
+        ["cell1cell2up"], ["https://www.ics.uci.edu/up.html"]),
+    "base": (
+        b"<html><head><base href='https://www.cs.uci.edu/base/'><base href='/ignored/'></head>"
+        b"<body><a href='rel'>r</a><a href='//other.uci.edu/x'>o</a></body></html>",
+        ["ro"], ["https://www.cs.uci.edu/base/rel", "https://other.uci.edu/x"]),
+}
+
+
+class ExtractorTest(unittest.TestCase):
+
+    def test_fixtures(self):
+        for name, (content, tokens, links) in fixtures.items():
+            with self.subTest(name):
+                text, hrefs, truncated = extract(page_url, content)
+                self.assertEqual(tokenize_text(text), tokens)
+                self.assertEqual(hrefs, links)
+                self.assertFalse(truncated)
+
+    def test_decodes_text(self):
+        self.assertIn("café & crème <tag>", extract(page_url, fixtures["entities"][0])[0])
+        self.assertIn("naïve résumé", extract(page_url, fixtures["latin1"][0])[0])
+
+    def test_stops_at_max_text(self):
+        words = " ".join(f"word{i}" for i in range(100000))
+        content = f"<html><body><p>{words}</p><a href='/end'>end</a></body></html>".encode()
+        text, hrefs, truncated = extract(page_url, content, 99999)
+        self.assertTrue(truncated)
+        self.assertGreater(len(text), 99999)
+        self.assertLess(len(text), len(words))
+        self.assertEqual(hrefs, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
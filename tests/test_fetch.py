@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import os
+import unittest
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+from crawler import Crawler
+from utils.download import download
+from utils.async_download import create_session, download_async
+from utils.replay import ReplayServer, build_synthetic_corpus, make_payload
+import scraper
+from tests.helpers import CrawlTestCase, make_config, reset_scraper
+
+seed_urls = ["https://www.ics.uci.edu", "https://www.cs.uci.edu"]
+
+
+class FetchModeTest(CrawlTestCase):
+    # Both fetch modes against a local stand-in for the cache server that answers with cbor payloads
+
+    def setUp(self):
+        super().setUp()
+        self.corpus = os.path.join(self.workdir, "synthetic.corpus")
+        build_synthetic_corpus(self.corpus, seed_urls, pages=300)
+
+    def crawl(self, fetch_mode):
+        reset_scraper()
+        server = ReplayServer(self.corpus, latency=0.002)
+        try:
+            config = make_config(
+                self.workdir, seed_urls=seed_urls, cache_server=server.start(), fetch_mode=fetch_mode,
+                threads_count=4, save_file=os.path.join(self.workdir, f"{fetch_mode}.shelve"))
+            Crawler(config, True).start()
+        finally:
+            server.close()
+        return scraper.totals.pages, sum(scraper.totals.word_frequency.values()), server.requests
+
+    def test_async_crawls_what_threads_crawl(self):
+        threads = self.crawl("threads")
+        self.assertGreater(threads[0], 250)
+        self.assertEqual(self.crawl("async"), threads)
+
+    def test_async_download_times_out(self):
+        server = ReplayServer(self.corpus, latency=2.0)
+        config = make_config(self.workdir, cache_server=server.start(), download_timeout=0.2)
+
+        async def download():
+            async with create_session(config) as session:
+                return await download_async(seed_urls[0], config, session, logging.getLogger(__name__))
+
+        try:
+            resp = asyncio.run(download())
+        finally:
+            server.close()
+        self.assertEqual(resp.status, 0)
+        self.assertIsNotNone(resp.error)
+
+
+class DownloadRetryTest(CrawlTestCase):
+    # A stand-in for the cache server that cuts off the payload of its first answers
+
+    def serve(self, cut_answers):
+        url = seed_urls[0]
+        payload = make_payload(url, 200, b"<html><body><p>page</p></body></html>")
+        answers = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                body = payload[:len(payload) - 3] if len(answers) < cut_answers else payload
+                answers.append(len(body))
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        config = make_config(self.workdir, cache_server=server.server_address, download_retries=2,
+                             download_backoff=0.01)
+        return download(url, config, logging.getLogger(__name__)), answers
+
+    def test_cut_off_payload_is_retried(self):
+        resp, answers = self.serve(2)
+        self.assertEqual(len(answers), 3)
+        self.assertIsNone(resp.error)
+        self.assertEqual(resp.raw_response.content, b"<html><body><p>page</p></body></html>")
+
+    def test_gives_up_after_retries(self):
+        resp, answers = self.serve(5)
+        self.assertEqual(len(answers), 3)
+        self.assertIsNotNone(resp.error)
+
+
+if __name__ == "__main__":
+    unittest.main()
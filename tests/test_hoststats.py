@@ -0,0 +1,42 @@
+import os
+import tempfile
+import unittest
+
+from hoststats import HostTracker, url_pattern
+
+trap_url = "https://wiki.ics.uci.edu/page1?do=diff&rev=1"
+
+
+class PruneTest(unittest.TestCase):
+
+    def test_patterns_stay_bounded(self):
+        tracker = HostTracker(max_patterns=100)
+        for i in range(30):
+            tracker.record(trap_url, "near_duplicate")
+        for i in range(1000):
+            tracker.record(f"https://www.ics.uci.edu/dir{i}/page?param{i}=1", "ok")
+        self.assertLessEqual(len(tracker.patterns), 100)
+        # Capped with enough pages, kept over the patterns seen once
+        self.assertTrue(tracker.patterns[url_pattern(trap_url)].low_yield)
+
+    def test_save_writes_the_current_state(self):
+        tracker = HostTracker(max_patterns=100)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "frontier.traps")
+            for batch in range(3):
+                for i in range(200):
+                    tracker.record(f"https://www.ics.uci.edu/dir{batch}-{i}/page?param{i}=1", "ok")
+                    tracker.skip(trap_url)
+                tracker.save(path)
+                loaded = HostTracker()
+                loaded.load(path)
+                self.assertEqual(loaded.recorded, tracker.recorded)
+                for name in ("hosts", "patterns"):
+                    table, saved = getattr(tracker, name), getattr(loaded, name)
+                    self.assertEqual(saved.keys(), table.keys())
+                    self.assertEqual({key: stats.__getstate__() for key, stats in saved.items()},
+                                     {key: stats.__getstate__() for key, stats in table.items()})
+
+
+if __name__ == "__main__":
+    unittest.main()
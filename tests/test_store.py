@@ -0,0 +1,138 @@
+import os
+import subprocess
+import sys
+import time
+import unittest
+
+from unittest import mock
+
+from crawler import Crawler
+from crawler.frontier import Frontier
+import scraper
+from tests.helpers import CrawlTestCase, make_config, fake_download, reset_scraper, repo
+
+# Child process writing to a store and killed without closing it. The urls are written in batches of
+# flush_size = 100: 0-99, then 0-49 completed with 100-149 new, then 150-179 that are never flushed
+crash_writer = """
+import os, sys
+from crawler.store import open_store
+from tests.helpers import make_config
+from utils import get_urlhash
+
+config = make_config(sys.argv[1], store=sys.argv[2], flush_size=100, flush_interval=3600)
+store = open_store(config)
+url = lambda i: f"https://www.ics.uci.edu/page{i}"
+for i in range(100):
+    store[get_urlhash(url(i))] = (url(i), False, float(i))
+for i in range(50):
+    store[get_urlhash(url(i))] = (url(i), True)
+for i in range(100, 180):
+    store[get_urlhash(url(i))] = (url(i), False, float(i))
+os._exit(0)
+"""
+
+# Child process starting a crawl from the seeds and adding 5 urls, fewer writes than flush_size, killed once it has been idle
+idle_writer = """
+import os, sys, time
+import crawler.robots
+from crawler.frontier import Frontier
+from tests.helpers import make_config, fake_download
+
+crawler.robots.download = fake_download
+config = make_config(sys.argv[1], store=sys.argv[2], flush_size=500, flush_interval=0.2)
+frontier = Frontier(config, True)
+for i in range(5):
+    frontier.add_url(f"https://www.ics.uci.edu/page{i}")
+time.sleep(1.0)
+os._exit(0)
+"""
+
+# Child process crawling the fake site with 4 threads, killed after its 600th download
+crawl_crasher = """
+import os, sys, threading
+import crawler.robots, crawler.worker
+from crawler import Crawler
+from tests.helpers import make_config, fake_download
+
+lock = threading.Lock()
+downloads = [0]
+
+def download(url, config, logger=None):
+    with lock:
+        downloads[0] += 1
+        if downloads[0] > 600:
+            os._exit(0)
+    return fake_download(url, config, logger)
+
+crawler.robots.download = crawler.worker.download = download
+config = make_config(sys.argv[1], store=sys.argv[2], threads_count=4, trap_min_yield=0, flush_size=50)
+Crawler(config, True).start()
+"""
+
+
+class CrashRecoveryTest(CrawlTestCase):
+
+    def run_child(self, script, store):
+        env = dict(os.environ, PYTHONPATH=repo)
+        subprocess.run([sys.executable, "-c", script, self.workdir, store], cwd=self.workdir, env=env,
+                       check=True, capture_output=True)
+
+    def recovered(self, store):
+        # Urls the frontier queues again when it resumes from the save file, without any seeds
+        config = make_config(self.workdir, store=store, seed_urls=[])
+        with mock.patch("crawler.robots.download", fake_download):
+            frontier = Frontier(config, False)
+            deadline = time.time() + 10
+            while frontier.loading and time.time() < deadline:
+                time.sleep(0.01)
+            with frontier.lock:
+                urls = {url for queue in frontier.host_queues.values() for _, _, url in queue}
+            frontier.close()
+        return urls
+
+    def check_crash(self, store):
+        self.run_child(crash_writer, store)
+        expected = {f"https://www.ics.uci.edu/page{i}" for i in range(50, 150)}
+        self.assertEqual(self.recovered(store), expected)
+
+    def check_idle(self, store):
+        self.run_child(idle_writer, store)
+        expected = set(make_config(self.workdir).seed_urls) | {f"https://www.ics.uci.edu/page{i}" for i in range(5)}
+        self.assertEqual(self.recovered(store), expected)
+
+    def test_shelve_recovers_up_to_last_flush(self):
+        self.check_crash("shelve")
+
+    def test_sqlite_recovers_up_to_last_flush(self):
+        self.check_crash("sqlite")
+
+    def test_shelve_flushes_while_idle(self):
+        self.check_idle("shelve")
+
+    def test_sqlite_flushes_while_idle(self):
+        self.check_idle("sqlite")
+
+    def crawl(self, restart, **options):
+        # Report counts once the crawl is over
+        reset_scraper()
+        config = make_config(self.workdir, threads_count=4, trap_min_yield=0, **options)
+        with mock.patch("crawler.worker.download", fake_download), mock.patch("crawler.robots.download", fake_download):
+            Crawler(config, restart).start()
+        return scraper.totals.pages, sum(scraper.totals.word_frequency.values())
+
+    def test_analytics_resume_with_the_save_file(self):
+        # No page is counted twice over the crash and the resumed crawl. The pages of the flushes the crash
+        # came before the checkpoint of are lost, with flush_size 50 that is well under 100 pages
+        for store in ("shelve", "sqlite"):
+            with self.subTest(store=store):
+                self.run_child(crawl_crasher, store)
+                resumed = self.crawl(False, store=store)
+                clean = self.crawl(True, store=store, save_file=f"{self.workdir}/clean.{store}")
+                self.assertGreater(clean[0], 1000)
+                self.assertLessEqual(resumed[0], clean[0])
+                self.assertGreater(resumed[0], clean[0] - 100)
+                self.assertLessEqual(resumed[1], clean[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import threading
+import unittest
+
+from collections import Counter
+from unittest import mock
+
+from crawler import Crawler
+import scraper
+from tests.helpers import CrawlTestCase, make_config, fake_download, reset_scraper
+
+
+class ThreadSafetyTest(CrawlTestCase):
+
+    def crawl(self, threads):
+        # Urls fetched with how often, and the report counts of a crawl of the fake site
+        reset_scraper()
+        fetched = Counter()
+        lock = threading.Lock()
+
+        def download(url, config, logger=None):
+            with lock:
+                fetched[url] += 1
+            return fake_download(url, config, logger)
+
+        # Trap detection depends on the order pages complete in, which differs between runs
+        config = make_config(self.workdir, threads_count=threads, store="sqlite", trap_min_yield=0,
+                             save_file=f"{self.workdir}/frontier-{threads}.sqlite")
+        with mock.patch("crawler.worker.download", download), mock.patch("crawler.robots.download", download):
+            Crawler(config, True).start()
+        totals = scraper.totals
+        return fetched, totals.pages, sum(totals.word_frequency.values()), dict(totals.subdomain_pages)
+
+    def test_threads_fetch_every_url_once(self):
+        single = self.crawl(1)
+        many = self.crawl(16)
+        self.assertGreater(len(single[0]), 1000)
+        self.assertEqual(max(many[0].values()), 1)
+        self.assertEqual(set(single[0]), set(many[0]))
+        self.assertEqual(single[1:], many[1:])
+
+    def test_near_duplicates_scraped_at_once(self):
+        # Only one of 16 threads adding the same fingerprint at the same time gets through
+        barrier = threading.Barrier(16)
+        results = []
+
+        def add():
+            barrier.wait()
+            results.append(scraper.add_fingerprint(0x5a5a5a5a)[1])
+
+        threads = [threading.Thread(target=add) for _ in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results.count(False), 1)
+        self.assertEqual(len(scraper.fingerprints), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,36 @@
+import mmap
+import os
+import re
 import sys
 from builtins import print as python_print
+from collections import Counter
+
+
+# Tokens are runs of ASCII letters and digits, lowercased. This table maps every other byte to a space and uppercase
+# letters to lowercase, so bytes.translate followed by split tokenizes a text in two C-level passes. In utf-8 no byte of
+# a multi-byte character is ASCII, so those become spaces too and the same table works on raw utf-8 bytes.
+token_table = bytes(byte if chr(byte).isascii() and chr(byte).isalnum() else ord(" ") for byte in range(256)).lower()
+# Finds the rest of a token that crosses the end of a chunk
+token_pattern = re.compile(r"[A-Za-z0-9]+")
+bytes_token_pattern = re.compile(rb"[A-Za-z0-9]+")
+chunk_size = 1 << 20
+
+stopwords_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stopwords.txt")
+
+
+def load_stopwords(filePath: str = stopwords_path) -> frozenset:
+    '''Reads a stopword file with one word per line, an empty set if there is no such file.
+
+    in  -> TextFilePath
+    out -> Set of stopwords
+    '''
+    try:
+        with open(filePath, encoding="utf8") as file:
+            return frozenset(line.strip().lower() for line in file if line.strip())
+    except FileNotFoundError:
+        return frozenset()
+
+default_stopwords = load_stopwords()
 
 
 # Time complexity: O(1) or constant time. Comparisons in Python using comparators like '<=' run in constant time and the length of the input will always be 1.
@@ -12,11 +43,56 @@ def isAlphaNum(character: str) -> bool:
     return ('A' <= character <= "Z" or 'a' <= character <= 'z' or '0' <= character <= '9')
 
 
-# Time complexity: O(n*m) where n is the length of the input file and m is the length of the current token string. The function reads one character at a time for every character in the input file, 
-    # which has a length of n. This means it would take O(n) time to iterate through every character. The process of calling .lower() on each character runs in O(1) because the size of the 
-    # character is always 1. Furthermore, checking if variables are empty is also done in constant time in Python in this case. Lastly, functions such as append are also constant. 
-    # However, concatenating to the end of the string must copy the entire string and create a new one which is an O(m) operation where m is the length of the current token string.
-    # Because of all of this, the total runtime complexity would be O(n*m).
+# Time complexity: O(n) where n is the length of the input. Encoding, translating, decoding and splitting each go over
+    # the text once in C, there is no per-character or per-token Python code.
+def tokenize_text(text) -> list:
+    '''Returns the list of tokens in a string or bytes-like object (bytes, bytearray, memoryview, mmap).
+
+    in  -> Text
+    out -> Token List
+    '''
+    if isinstance(text, str):
+        text = text.encode("utf-8", "surrogatepass")
+    return bytes(text).translate(token_table).decode("ascii").split()
+
+
+# Time complexity: O(n) where n is the length of the input, every chunk is tokenized with tokenize_text and the
+    # chunks do not overlap. Only one chunk of tokens is held in memory at a time.
+def iter_tokens(text, chunk_size: int = chunk_size):
+    '''Yields the tokens of a string or bytes-like object (bytes, bytearray, memoryview, mmap) chunk by chunk.
+
+    in  -> Text, size of the chunks in characters or bytes
+    out -> Token Generator
+    '''
+    pattern = token_pattern if isinstance(text, str) else bytes_token_pattern
+    start = 0
+    length = len(text)
+    while start < length:
+        end = min(start + chunk_size, length)
+        # a token that crosses the end of the chunk belongs to this chunk
+        match = pattern.match(text, end)
+        if match:
+            end = match.end()
+        yield from tokenize_text(text[start:end])
+        start = end
+
+
+# Time complexity: O(n) where n is the size of the input file, see iter_tokens. The file is memory mapped, so it is
+    # read by the operating system as the tokens are consumed instead of being loaded up front.
+def iter_file_tokens(filePath: str):
+    '''Yields the tokens of a text file, without reading the whole file into memory.
+
+    in  -> TextFilePath
+    out -> Token Generator
+    '''
+    with open(filePath, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0: # empty files can not be memory mapped
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield from iter_tokens(mapped)
+
+
+# Time complexity: O(n) where n is the length of the input file, see iter_file_tokens.
 def tokenize(filePath: str) -> list:
     '''Reads in a text file and returns a list of the tokens in that file.
     
@@ -25,67 +101,27 @@ def tokenize(filePath: str) -> list:
     '''
     # error-handling for if the file does not exist
     try:
-        # opens the text file in read mode
-        file = open(filePath, 'r', encoding="utf8")
-        tokens = []
-        cur_token = ""
-        # read each character one at a time
-        while True:
-            character = file.read(1)
-            character = character.lower()
-
-            # if we have reached the end of the file, break out of the file loop
-            if not character:
-                # append the last token
-                if cur_token:
-                    tokens.append(cur_token)
-                    cur_token = ""
-                break
-            elif isAlphaNum(character): # if the character is alphanumeric, append to the current token
-                cur_token += character
-            else: # if the character is not alphanumeric, end the previous token and prepare for the next token
-                if cur_token:
-                    tokens.append(cur_token)
-                    cur_token = ""
-
-        # return the accumulated tokens
-        return tokens
+        return list(iter_file_tokens(filePath))
     except FileNotFoundError: # error-handling for if the file does not exist
-        file = None
         python_print('File does not exist')
         return []
-    except IOError: # error-handling for any errors reading the contents of the file
-        file = None
+    except (IOError, ValueError): # error-handling for any errors reading the contents of the file
         python_print('Error reading the contents of the file')
         return []
-    finally:
-        # closes the file
-        if file:
-            file.close()
 
 
-# Time complexity: O(n) where n is the size of the input token list. This function simply iterates over every token in the token list and increments a counter, which happens in constant time.
-    # Because of this, O(n) is the bound for the function.
-def computeWordFrequencies(tokens: list, stopwords: set) -> dict:
-    '''Counts the number of occurrences of each token in the token list.
+# Time complexity: O(n + m) where n is the number of tokens and m the number of distinct tokens. Counter counts the
+    # tokens in C, and the stopwords and numbers are then removed once per distinct token instead of once per token.
+def computeWordFrequencies(tokens, stopwords: set = default_stopwords) -> dict:
+    '''Counts the number of occurrences of each token in the token list (or any iterable of tokens),
+    leaving out stopwords and tokens that are only digits.
     
-    in  -> Tokens
+    in  -> Tokens, Stopwords
     out -> Map of tokens to their respective count
     '''
-    # create a dictionary for the mappings
-    frequencies = {}
-
-    # iterate over every token and increment its counter in the dictionary
-    for token in tokens:
-        if token in stopwords or token.isdigit():
-            continue
-
-        if token not in frequencies:
-            frequencies[token] = 1
-        else:
-            frequencies[token] += 1
-
-    # return the token frequencies dictionary
+    frequencies = Counter(tokens)
+    for token in [token for token in frequencies if token in stopwords or token.isdigit()]:
+        del frequencies[token]
     return frequencies
 
 
@@ -110,5 +146,114 @@ def main():
     if len(sys.argv) != 2:
         python_print("Must provide a text file as an argument")
         return
-    
-    print(computeWordFrequencies(tokenize(sys.argv[1])))
\ No newline at end of file
+
+    # tokens are streamed from the file, only the counts are kept in memory
+    try:
+        frequencies = computeWordFrequencies(iter_file_tokens(sys.argv[1]))
+    except FileNotFoundError:
+        python_print('File does not exist')
+        return
+    except (IOError, ValueError):
+        python_print('Error reading the contents of the file')
+        return
+    print(frequencies)
+
+
+def benchmark(paths: list):
+    # Tokens per second of the previous character-at-a-time tokenizer and of the scraper's old split/isalnum
+    # path against this module, on the given files (or a generated 20 MB one) and on page sized texts
+    import tempfile
+    import time
+
+    def legacy_tokenize(filePath):
+        tokens = []
+        cur_token = ""
+        with open(filePath, 'r', encoding="utf8") as file:
+            while True:
+                character = file.read(1).lower()
+                if not character:
+                    break
+                if isAlphaNum(character):
+                    cur_token += character
+                elif cur_token:
+                    tokens.append(cur_token)
+                    cur_token = ""
+        if cur_token:
+            tokens.append(cur_token)
+        return tokens
+
+    def legacy_frequencies(tokens, stopwords):
+        frequencies = {}
+        for token in tokens:
+            if token in stopwords or token.isdigit():
+                continue
+            frequencies[token] = frequencies.get(token, 0) + 1
+        return frequencies
+
+    def timed(name, size, fn):
+        # fn returns the number of tokens it went through
+        start = time.perf_counter()
+        count = fn()
+        elapsed = time.perf_counter() - start
+        python_print(f"{name:<32}: {count / elapsed / 1e6:6.2f} M tokens/s, {size / elapsed / 2 ** 20:7.1f} MiB/s")
+
+    def legacy_file(path):
+        tokens = legacy_tokenize(path)
+        legacy_frequencies(tokens, default_stopwords)
+        return len(tokens)
+
+    def new_file(path):
+        tokens = tokenize(path)
+        computeWordFrequencies(tokens)
+        return len(tokens)
+
+    def streamed_file(path):
+        # counting without stopwords, so the counts add up to the number of tokens
+        return sum(computeWordFrequencies(iter_file_tokens(path), frozenset()).values())
+
+    def legacy_pages(pages):
+        count = 0
+        for page in pages:
+            words = [word.lower() for word in page.split() if word.isalnum()]
+            legacy_frequencies(words, default_stopwords)
+            count += len(words)
+        return count
+
+    def new_pages(pages):
+        count = 0
+        for page in pages:
+            words = tokenize_text(page)
+            computeWordFrequencies(words)
+            count += len(words)
+        return count
+
+    words = [f"Word{i % 7919}," if i % 11 else f"{i} the" for i in range(400)]
+    line = " ".join(words) + "\n"
+    with tempfile.TemporaryDirectory() as tmp:
+        if not paths:
+            paths = [os.path.join(tmp, "words.txt")]
+            with open(paths[0], "w") as file:
+                file.write(line * (20 * 2 ** 20 // len(line)))
+        head = os.path.join(tmp, "head.txt")
+        for path in paths:
+            size = os.path.getsize(path)
+            python_print(f"{path}, {size / 2 ** 20:.1f} MiB")
+            # the legacy tokenizer is too slow for a whole large file, it only gets the first MiB
+            with open(head, "wb") as head_file, open(path, "rb") as file:
+                head_file.write(file.read(2 ** 20))
+            timed("  legacy tokenize (first MiB)", os.path.getsize(head), lambda: legacy_file(head))
+            timed("  tokenize", size, lambda: new_file(path))
+            timed("  iter_file_tokens (streamed)", size, lambda: streamed_file(path))
+
+    # Page text as the scraper sees it, about 10 KB each
+    pages = [line * 3 for _ in range(2000)]
+    size = sum(len(page) for page in pages)
+    python_print(f"{len(pages)} pages, {size / len(pages) / 1024:.1f} KiB each")
+    timed("  split + isalnum (old scraper)", size, lambda: legacy_pages(pages))
+    timed("  tokenize_text", size, lambda: new_pages(pages))
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--benchmark":
+        benchmark(sys.argv[2:])
+    else:
+        main()
@@ -0,0 +1,143 @@
+import re
+from collections import Counter
+from urllib.parse import SplitResult
+
+# Hosts we crawl, a url is valid if its host is one of these or a subdomain of one
+allowed_domains = ("ics.uci.edu", "cs.uci.edu", "informatics.uci.edu", "stat.uci.edu")
+
+# File extensions that do not point to a web page
+blocked_extensions = frozenset((
+    "css js bmp gif jpg jpeg ico php r png tif tiff mid mp2 mp3 mp4 bib "
+    "wav avi mov mpeg ram m4v mkv ogg ogv pdf "
+    "ps eps tex ppt pptx doc docx xls xlsx names "
+    "data dat exe bz2 tar msi bin 7z psd dmg iso "
+    "epub dll cnf tgz sha1 ds_store "
+    "thmx mso arff rtf jar csv "
+    "rm smil wmv swf wma zip rar gz svn").split())
+
+
+# scheme, netloc, path, query of http(s) urls, one C-level match instead of urlsplit
+url_pattern = re.compile(r"(https?)://([^/?#]*)([^?#]*)(?:\?([^#]*))?", re.IGNORECASE)
+
+# Trap rules: each takes the split url and returns True if the url looks like a crawler trap
+
+date_segment = re.compile(r"/\d{4}-\d{1,2}(?:-\d{1,2})?(?:/|$)")
+calendar_params = frozenset(("ical", "outlook-ical", "tribe-bar-date", "tribe_event_display", "eventdate"))
+
+def calendar_trap(parsed) -> bool:
+    # Calendar views can be paged through forever, one day or month at a time
+    if date_segment.search(parsed.path):
+        return True
+    return bool(parsed.query) and any(
+        param.split("=", 1)[0].lower() in calendar_params for param in parsed.query.split("&"))
+
+def repeated_segments_trap(parsed, max_repeats: int = 3) -> bool:
+    # Relative links resolved against the wrong base keep appending the same segments, e.g. /a/b/a/b/a/b
+    if parsed.path.count("/") < max_repeats:
+        return False
+    segments = [segment for segment in parsed.path.split("/") if segment]
+    if len(segments) == len(set(segments)):
+        return False
+    return max(Counter(segments).values()) >= max_repeats
+
+def query_explosion_trap(parsed, max_params: int = 6) -> bool:
+    # Faceted search and sorting pages combine parameters into endless variations of the same content
+    return parsed.query.count("&") + 1 > max_params if parsed.query else False
+
+default_traps = (calendar_trap, repeated_segments_trap, query_explosion_trap)
+
+
+class URLFilter(object):
+    '''Decides which urls to crawl, built once and reused for every link.
+
+    domains    -> a url's host must be one of these or end with "." + one of them
+    extensions -> blocked file extensions, compared against the suffix of the last path segment
+    traps      -> callables taking the url as a urllib SplitResult, the url is rejected if any returns True
+    '''
+
+    def __init__(self, domains=allowed_domains, extensions=blocked_extensions, traps=default_traps):
+        self.domains = frozenset(domains)
+        self.extensions = frozenset(extension.lower() for extension in extensions)
+        self.traps = tuple(traps)
+
+    def is_allowed_host(self, host: str) -> bool:
+        # Walk the suffixes of the host, "a.b.ics.uci.edu" checks "b.ics.uci.edu", "ics.uci.edu", ...
+        if host in self.domains:
+            return True
+        dot = host.find(".")
+        while dot != -1:
+            if host[dot + 1:] in self.domains:
+                return True
+            dot = host.find(".", dot + 1)
+        return False
+
+    def is_valid(self, url: str) -> bool:
+        if "#" in url:
+            return False
+        match = url_pattern.match(url)
+        if not match:
+            return False
+        parsed = SplitResult(match.group(1).lower(), match.group(2), match.group(3), match.group(4) or "", "")
+        # Host without user info or port
+        host = parsed.netloc.rpartition("@")[2].partition(":")[0].lower()
+        if not host or not self.is_allowed_host(host):
+            return False
+        path = parsed.path.split(";", 1)[0].lower()
+        last_segment = path.rsplit("/", 1)[-1]
+        if "." in last_segment and last_segment.rsplit(".", 1)[1] in self.extensions:
+            return False
+        for trap in self.traps:
+            if trap(parsed):
+                return False
+        return True
+
+    def filter_links(self, urls) -> list:
+        # Valid urls out of a page's links, without duplicates, in the order they appear
+        seen = set()
+        valid = []
+        for url in urls:
+            if url not in seen:
+                seen.add(url)
+                if self.is_valid(url):
+                    valid.append(url)
+        return valid
+
+
+if __name__ == "__main__":
+    # Benchmark against the previous is_valid from scraper.py
+    import time
+    from urllib.parse import urlparse
+
+    def legacy_is_valid(url):
+        valid_domains = ['.ics.uci.edu', '.cs.uci.edu', '.informatics.uci.edu', '.stat.uci.edu']
+        parsed = urlparse(url)
+        if parsed.scheme not in set(["http", "https"]):
+            return False
+        return any(domain in parsed.netloc for domain in valid_domains) and (not '#' in url) and not re.match(
+            r".*\.(css|js|bmp|gif|jpe?g|ico|php|r"
+            + r"|png|tiff?|mid|mp2|mp3|mp4|bib"
+            + r"|wav|avi|mov|mpeg|ram|m4v|mkv|ogg|ogv|pdf"
+            + r"|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names"
+            + r"|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso"
+            + r"|epub|dll|cnf|tgz|sha1|DS_Store"
+            + r"|thmx|mso|arff|rtf|jar|csv"
+            + r"|rm|smil|wmv|swf|wma|zip|rar|gz|svn)$", parsed.path.lower())
+
+    urls = [
+        "https://www.ics.uci.edu/community/news/view_news?id=1473",
+        "https://www.informatics.uci.edu/very/long/path/to/a/research/page/with/many/segments/index.html",
+        "http://www.stat.uci.edu/wp-content/uploads/2019/report-final.pdf",
+        "https://evil.ics.uci.edu.example.com/",
+        "https://gitlab.ics.uci.edu/group/project/-/tree/main/src/crawler/frontier",
+        "https://wics.ics.uci.edu/events/2021-03-04/",
+        "mailto:someone@ics.uci.edu",
+    ]
+    # Distinct urls, so the lru cache inside urlsplit/urlparse does not hide the parsing cost
+    urls = [f"{url}{'&' if '?' in url else '?'}n={i}" if i % 2 else url.replace("//", f"//x{i}.", 1)
+            for i in range(2000) for url in urls]
+    url_filter = URLFilter()
+    for name, fn in (("legacy is_valid", legacy_is_valid), ("URLFilter", url_filter.is_valid)):
+        start = time.perf_counter()
+        for url in urls:
+            fn(url)
+        print(f"{name:<16}: {(time.perf_counter() - start) / len(urls) * 1e6:6.2f} us/url")
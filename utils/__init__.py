@@ -3,6 +3,8 @@ import logging
 from hashlib import sha256
 from urllib.parse import urlparse
 
+from utils import canonical
+
 def get_logger(name, filename=None):
     logger = logging.getLogger(name)
     logger.setLevel(logging.INFO)
@@ -23,13 +25,14 @@ def get_logger(name, filename=None):
 
 
 def get_urlhash(url):
-    parsed = urlparse(url)
+    # Same hash for every spelling of a page, see utils/canonical.py.
+    # A trailing slash does not make a different page either.
+    parsed = urlparse(normalize(url))
     # everything other than scheme.
     return sha256(
-        f"{parsed.netloc}/{parsed.path}/{parsed.params}/"
-        f"{parsed.query}/{parsed.fragment}".encode("utf-8")).hexdigest()
+        f"{parsed.netloc}/{parsed.path.rstrip('/')}/{parsed.params}/"
+        f"{parsed.query}".encode("utf-8")).hexdigest()
 
 def normalize(url):
-    if url.endswith("/"):
-        return url.rstrip("/")
-    return url
+    # Canonical form of the url, the one that is stored and fetched
+    return canonical.canonicalize(url)
@@ -0,0 +1,53 @@
+import asyncio
+import aiohttp
+import cbor
+
+from time import perf_counter
+from urllib.parse import urlparse
+
+from utils.response import Response
+from utils import replay, metrics
+
+def create_session(config):
+    # One pooled keep-alive session to the cache server, with at most
+    # config.max_in_flight requests open at the same time, each given up
+    # after TIMEOUT seconds.
+    connector = aiohttp.TCPConnector(
+        limit=config.max_in_flight, keepalive_timeout=30)
+    return aiohttp.ClientSession(
+        connector=connector, timeout=aiohttp.ClientTimeout(total=config.download_timeout))
+
+async def download_async(url, config, session, logger=None):
+    host, port = config.cache_server
+    start = perf_counter()
+    try:
+        async with session.get(
+                f"http://{host}:{port}/",
+                params=[("q", f"{url}"), ("u", f"{config.user_agent}")]) as resp:
+            status = resp.status
+            content = await resp.read()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error(f"Spacetime connection error {e!r} with url {url}.")
+        return Response({
+            "error": f"Spacetime connection error {e!r} with url {url}.",
+            "status": 0,
+            "url": url})
+    # Round trip to the cache server, per host of the url asked for
+    metrics.observe("cache_request", perf_counter() - start, host=urlparse(url).netloc)
+    try:
+        if content:
+            with metrics.timer("decode"): # cbor, the pickled page is only loaded when read
+                response = Response(cbor.loads(content))
+            metrics.count("downloads", status=response.status)
+            if config.record_file:
+                # Keep the payload for benchmark.py to replay, the SQLite insert and commit run off the event loop
+                await asyncio.get_running_loop().run_in_executor(
+                    None, replay.record, config.record_file, url, content)
+            return response
+    except (EOFError, ValueError) as e:
+        pass
+    logger.error(f"Spacetime Response error {resp} with url {url}.")
+    return Response({
+        "error": f"Spacetime Response error {resp} with url {url}.",
+        "status": status,
+        "url": url})
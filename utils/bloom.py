@@ -0,0 +1,83 @@
+import math
+import struct
+from hashlib import blake2b
+
+header = struct.Struct("<4sQQd")
+magic = b"BLM1"
+
+
+class BloomFilter(object):
+    ''' Compact set membership with false positives but no false negatives.
+    Sized for `capacity` keys at `error_rate`. When more keys are added, another
+    filter twice as large with half the error rate is chained on, so the overall
+    false positive rate stays below 2 x error_rate as the crawl grows. '''
+
+    def __init__(self, capacity: int = 1000000, error_rate: float = 0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.count = 0
+        # (bits, number of bits, number of hashes, capacity) per chained filter
+        self.filters = []
+        self._grow(capacity, error_rate)
+
+    def _grow(self, capacity, error_rate):
+        num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        num_hashes = max(1, int(round(num_bits / capacity * math.log(2))))
+        self.filters.append((bytearray((num_bits + 7) // 8), num_bits, num_hashes, capacity))
+
+    @staticmethod
+    def _hashes(key: str):
+        # Two independent 64-bit hashes, combined as h1 + i * h2 for the i-th bit position
+        digest = blake2b(key.encode("utf-8"), digest_size=16).digest()
+        return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+    def __contains__(self, key: str) -> bool:
+        h1, h2 = self._hashes(key)
+        for bits, num_bits, num_hashes, _ in self.filters:
+            for i in range(num_hashes):
+                position = (h1 + i * h2) % num_bits
+                if not bits[position >> 3] & (1 << (position & 7)):
+                    break
+            else:
+                return True
+        return False
+
+    def add(self, key: str):
+        if self.count >= sum(filter_[3] for filter_ in self.filters):
+            self._grow(self.filters[-1][3] * 2, self.error_rate / 2 ** len(self.filters))
+        bits, num_bits, num_hashes, _ = self.filters[-1]
+        h1, h2 = self._hashes(key)
+        for i in range(num_hashes):
+            position = (h1 + i * h2) % num_bits
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __len__(self):
+        # Number of keys added, including any added more than once
+        return self.count
+
+    @property
+    def size_bytes(self) -> int:
+        return sum(len(filter_[0]) for filter_ in self.filters)
+
+    def save(self, path):
+        with open(path, "wb") as file:
+            file.write(header.pack(magic, self.count, len(self.filters), self.error_rate))
+            for bits, num_bits, num_hashes, capacity in self.filters:
+                file.write(struct.pack("<QQQ", num_bits, num_hashes, capacity))
+                file.write(bits)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as file:
+            file_magic, count, num_filters, error_rate = header.unpack(file.read(header.size))
+            assert file_magic == magic, f"{path} is not a saved BloomFilter"
+            bloom = cls.__new__(cls)
+            bloom.count = count
+            bloom.error_rate = error_rate
+            bloom.filters = []
+            for _ in range(num_filters):
+                num_bits, num_hashes, capacity = struct.unpack("<QQQ", file.read(24))
+                bloom.filters.append((bytearray(file.read((num_bits + 7) // 8)), num_bits, num_hashes, capacity))
+            bloom.capacity = bloom.filters[0][3]
+        return bloom
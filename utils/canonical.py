@@ -0,0 +1,127 @@
+import re
+from fnmatch import fnmatchcase
+from urllib.parse import urlsplit, urlunsplit, quote
+
+default_ports = {"http": "80", "https": "443"}
+
+# Query (and ;path) parameters that only track the visitor or the session, the page is the same without them
+default_strip_params = ("utm_*", "fbclid", "gclid", "jsessionid", "phpsessid", "sessionid", "sessid")
+
+# Directory index pages, /a/index.html is the same page as /a/
+default_index_files = ("index.html", "index.htm")
+
+unreserved = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~")
+percent_escape = re.compile(r"%([0-9A-Fa-f]{2})")
+# Characters left as they are when percent-encoding, everything else (spaces, non-ascii, ...) gets escaped
+path_safe = "/:@!$&'()*+,;=-._~%"
+query_safe = "/?:@!$'()*+,;=-._~%"
+
+
+def _unescape(match):
+    # %41 -> A for unreserved characters, other escapes only get uppercase hex digits
+    char = chr(int(match.group(1), 16))
+    return char if char in unreserved else "%" + match.group(1).upper()
+
+def normalize_escapes(part: str, safe: str) -> str:
+    return percent_escape.sub(_unescape, quote(part, safe=safe))
+
+def remove_dot_segments(path: str) -> str:
+    # RFC 3986 section 5.2.4 for absolute paths, /a/./b/../c -> /a/c
+    if "/." not in path:
+        return path
+    segments = path.split("/")
+    output = []
+    for segment in segments[1:]:
+        if segment == "..":
+            if output:
+                output.pop()
+        elif segment != ".":
+            output.append(segment)
+    if segments[-1] in (".", ".."):
+        output.append("")
+    return "/" + "/".join(output)
+
+
+class Canonicalizer(object):
+    '''Rewrites a url into the one form the frontier stores and fetches, so
+    that different spellings of a page are crawled once.
+
+    strip_params -> query parameter names to drop, case insensitive, * and ? wildcards allowed
+    index_files  -> last path segments that are dropped, leaving the directory
+    sort_query   -> order the query parameters by name (repeated names keep their order)
+
+    Scheme and host are lowercased, default ports, fragments and empty query
+    parameters dropped, dot-segments resolved and percent-encoding normalized.
+    Urls that are not http(s) are returned without their fragment only.
+    '''
+
+    def __init__(self, strip_params=default_strip_params, index_files=default_index_files, sort_query=True):
+        strip_params = [param.lower() for param in strip_params]
+        self.strip_names = frozenset(param for param in strip_params if "*" not in param and "?" not in param)
+        self.strip_patterns = tuple(param for param in strip_params if param not in self.strip_names)
+        self.index_files = frozenset(name.lower() for name in index_files)
+        self.sort_query = sort_query
+
+    def is_stripped(self, name: str) -> bool:
+        name = name.lower()
+        return name in self.strip_names or any(fnmatchcase(name, pattern) for pattern in self.strip_patterns)
+
+    def strip_segment_params(self, segment: str) -> str:
+        # /app;jsessionid=AB12;v=2 -> /app;v=2, only within the one segment
+        segment, semicolon, params = segment.partition(";")
+        return ";".join([segment] + [param for param in params.split(";")
+                                     if param and not self.is_stripped(param.partition("=")[0])])
+
+    def canonicalize(self, url: str) -> str:
+        url = url.strip()
+        scheme, netloc, path, query, fragment = urlsplit(url)
+        scheme = scheme.lower()
+        if scheme not in default_ports:
+            return url.partition("#")[0]
+
+        # Host without a trailing dot or default port, user info is kept as it is
+        userinfo, at, host = netloc.rpartition("@")
+        host, colon, port = host.partition(":")
+        host = host.lower().rstrip(".")
+        if port and port != default_ports[scheme]:
+            host += ":" + port
+        netloc = userinfo + at + host
+
+        # ;name=value parameters of a path segment, used for session ids by some servers
+        if ";" in path:
+            path = "/".join(self.strip_segment_params(segment) for segment in path.split("/"))
+        path = remove_dot_segments(normalize_escapes(path, path_safe) or "/")
+        directory, slash, last_segment = path.rpartition("/")
+        if last_segment.lower() in self.index_files:
+            path = directory + slash
+
+        if query:
+            params = [normalize_escapes(param, query_safe) for param in query.split("&")
+                      if param and not self.is_stripped(param.partition("=")[0])]
+            if self.sort_query:
+                params.sort(key=lambda param: param.partition("=")[0])
+            query = "&".join(params)
+
+        return urlunsplit((scheme, netloc, path, query, ""))
+
+
+# Rules in use, replaced by configure() with the ones from config.ini
+canonicalizer = Canonicalizer()
+
+def configure(config):
+    # Use the STRIPPARAMS and INDEXFILES rules of a utils.config.Config, in this process
+    set_canonicalizer(Canonicalizer(config.strip_params, config.index_files))
+
+def set_canonicalizer(rules):
+    # Use a Canonicalizer, e.g. the parent's one in a parser process
+    global canonicalizer
+    canonicalizer = rules
+
+def canonicalize(url: str) -> str:
+    return canonicalizer.canonicalize(url)
+
+
+if __name__ == "__main__":
+    import sys
+    for url in sys.argv[1:]:
+        print(canonicalize(url))
@@ -1,5 +1,7 @@
 import re
 
+from utils.canonical import default_strip_params, default_index_files
+
 
 class Config(object):
     def __init__(self, config):
@@ -8,12 +10,64 @@ class Config(object):
         assert self.user_agent != "DEFAULT AGENT", "Set useragent in config.ini"
         assert re.match(r"^[a-zA-Z0-9_ ,]+$", self.user_agent), "User agent should not have any special characters outside '_', ',' and 'space'"
         self.threads_count = int(config["LOCAL PROPERTIES"]["THREADCOUNT"])
+        self.parser_processes = config["LOCAL PROPERTIES"].getint("PARSERS", 0)
+        # Bounds of the adaptive number of downloading workers, MAXTHREADS 0 keeps THREADCOUNT, see crawler/concurrency.py
+        self.min_threads = config["LOCAL PROPERTIES"].getint("MINTHREADS", 1)
+        self.max_threads = config["LOCAL PROPERTIES"].getint("MAXTHREADS", 0)
+        self.max_delay = config["LOCAL PROPERTIES"].getfloat("MAXDELAY", 2.0)
+        self.latency_tolerance = config["LOCAL PROPERTIES"].getfloat("LATENCYTOLERANCE", 2.0)
+        self.error_tolerance = config["LOCAL PROPERTIES"].getfloat("ERRORTOLERANCE", 0.05)
+        # Crawler processes, each owning the hosts that hash to it, see crawler/shard.py
+        self.shards = config["LOCAL PROPERTIES"].getint("SHARDS", 1)
         self.save_file = config["LOCAL PROPERTIES"]["SAVE"]
+        self.store = config["LOCAL PROPERTIES"].get("STORE", "shelve").strip().lower()
+        assert self.store in ("shelve", "sqlite"), "STORE should be shelve or sqlite"
+        self.flush_size = config["LOCAL PROPERTIES"].getint("FLUSHSIZE", 500)
+        self.flush_interval = config["LOCAL PROPERTIES"].getfloat("FLUSHINTERVAL", 5.0)
+        self.seen_capacity = config["LOCAL PROPERTIES"].getint("SEENCAPACITY", 1000000)
+        self.seen_error_rate = config["LOCAL PROPERTIES"].getfloat("SEENERRORRATE", 0.001)
+        self.top_words = config["LOCAL PROPERTIES"].getint("TOPWORDS", 0)
+        # Cache server responses are recorded to this file for benchmark.py, if set
+        self.record_file = config["LOCAL PROPERTIES"].get("RECORD", "").strip() or None
+        # Pages are kept in this directory for reprocess.py, if set
+        self.page_store = config["LOCAL PROPERTIES"].get("PAGESTORE", "").strip() or None
+        self.page_compression = config["LOCAL PROPERTIES"].get("PAGECOMPRESSION", "zlib").strip().lower()
+        assert self.page_compression in ("zlib", "zstd"), "PAGECOMPRESSION should be zlib or zstd"
+        self.metrics_interval = config["LOCAL PROPERTIES"].getfloat("METRICSINTERVAL", 0.0)
+        self.metrics_port = config["LOCAL PROPERTIES"].getint("METRICSPORT", 0)
 
         self.host = config["CONNECTION"]["HOST"]
         self.port = int(config["CONNECTION"]["PORT"])
+        self.download_timeout = config["CONNECTION"].getfloat("TIMEOUT", 30.0)
+        self.download_retries = config["CONNECTION"].getint("RETRIES", 2)
+        self.download_backoff = config["CONNECTION"].getfloat("BACKOFF", 0.5)
 
         self.seed_urls = config["CRAWLER"]["SEEDURL"].split(",")
         self.time_delay = float(config["CRAWLER"]["POLITENESS"])
 
+        self.fetch_mode = config["CRAWLER"].get("FETCHMODE", "threads").strip().lower()
+        assert self.fetch_mode in ("threads", "async"), "FETCHMODE should be threads or async"
+        self.max_in_flight = config["CRAWLER"].getint("MAXINFLIGHT", 8)
+        self.robots_ttl = config["CRAWLER"].getfloat("ROBOTSTTL", 86400.0)
+        self.robots_fail_ttl = config["CRAWLER"].getfloat("ROBOTSFAILTTL", 3600.0)
+        self.strip_params = [
+            param.strip() for param in config["CRAWLER"].get("STRIPPARAMS", ",".join(default_strip_params)).split(",")
+            if param.strip()]
+        self.index_files = [
+            name.strip() for name in config["CRAWLER"].get("INDEXFILES", ",".join(default_index_files)).split(",")
+            if name.strip()]
+        # Weights of the frontier's url priority, see urlscore.py
+        self.score_depth = config["CRAWLER"].getfloat("SCOREDEPTH", 1.0)
+        self.score_query = config["CRAWLER"].getfloat("SCOREQUERY", 1.0)
+        self.score_view = config["CRAWLER"].getfloat("SCOREVIEW", 4.0)
+        self.score_host = config["CRAWLER"].getfloat("SCOREHOST", 0.5)
+        self.score_novelty = config["CRAWLER"].getfloat("SCORENOVELTY", 2.0)
+        # When hosts and url patterns count as low yield and what is done about it, see hoststats.py
+        self.trap_min_yield = config["CRAWLER"].getfloat("TRAPMINYIELD", 0.2)
+        self.trap_min_pages = config["CRAWLER"].getint("TRAPMINPAGES", 20)
+        self.trap_window = config["CRAWLER"].getint("TRAPWINDOW", 200)
+        self.trap_probe = config["CRAWLER"].getint("TRAPPROBE", 20)
+        self.trap_throttle = config["CRAWLER"].getfloat("TRAPTHROTTLE", 4.0)
+        self.trap_max_patterns = config["CRAWLER"].getint("TRAPMAXPATTERNS", 100000)
+
         self.cache_server = None
\ No newline at end of file
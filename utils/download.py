@@ -2,18 +2,75 @@ import requests
 import cbor
 import time
 
+from threading import Lock
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+
 from utils.response import Response
+from utils import replay, metrics
+
+# One pooled keep-alive session per cache server, shared by every worker
+sessions = dict()
+sessions_lock = Lock()
+
+def get_session(config):
+    with sessions_lock:
+        session = sessions.get(config.cache_server)
+        if session is None:
+            session = requests.Session()
+            # Enough pooled connections for every worker to keep one open, MAXTHREADS of them with a controller
+            adapter = HTTPAdapter(
+                pool_connections=1, pool_maxsize=max(config.threads_count, config.max_threads, 1))
+            session.mount("http://", adapter)
+            sessions[config.cache_server] = session
+        return session
 
 def download(url, config, logger=None):
     host, port = config.cache_server
-    resp = requests.get(
-        f"http://{host}:{port}/",
-        params=[("q", f"{url}"), ("u", f"{config.user_agent}")])
-    try:
+    session = get_session(config)
+    resp = None
+    error = None
+    # Connection errors, timeouts, 5xx and empty or undecodable payloads are
+    # treated as transient and retried with exponential backoff.
+    for attempt in range(config.download_retries + 1):
+        if attempt:
+            metrics.count("download_retries")
+            time.sleep(config.download_backoff * 2 ** (attempt - 1))
+        try:
+            # Round trip to the cache server, per host of the url asked for
+            with metrics.timer("cache_request", host=urlparse(url).netloc):
+                resp = session.get(
+                    f"http://{host}:{port}/",
+                    params=[("q", f"{url}"), ("u", f"{config.user_agent}")],
+                    timeout=config.download_timeout)
+        except requests.RequestException as e:
+            resp = None
+            error = e
+            continue
         if resp and resp.content:
-            return Response(cbor.loads(resp.content))
-    except (EOFError, ValueError) as e:
-        pass
+            try:
+                with metrics.timer("decode"): # cbor, the pickled page is only loaded when read
+                    response = Response(cbor.loads(resp.content))
+                if not response.complete:
+                    raise ValueError("the pickled page is cut off")
+            except (EOFError, ValueError, KeyError) as e:
+                # A garbled or cut off payload, asking again may give the whole one
+                metrics.count("decode_errors")
+                continue
+            metrics.count("downloads", status=response.status)
+            if config.record_file:
+                # Keep the payload for benchmark.py to replay
+                replay.record(config.record_file, url, resp.content)
+            return response
+        if resp.status_code < 500 and resp.content:
+            # The cache answered with an error, retrying will not change it
+            break
+    if resp is None:
+        logger.error(f"Spacetime connection error {error} with url {url}.")
+        return Response({
+            "error": f"Spacetime connection error {error} with url {url}.",
+            "status": 0,
+            "url": url})
     logger.error(f"Spacetime Response error {resp} with url {url}.")
     return Response({
         "error": f"Spacetime Response error {resp} with url {url}.",
@@ -0,0 +1,194 @@
+import time
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock, Event
+
+from utils import get_logger
+
+# Off unless METRICSINTERVAL or METRICSPORT is set, every call below returns right away then
+enabled = False
+
+lock = Lock()
+# (name, labels) -> value, labels being a sorted tuple of (label, value) pairs
+counters = dict()
+# (name, labels) -> [count per bucket..., sum, count]
+histograms = dict()
+# name -> function returning [(labels, value), ...], called when the metrics are read
+gauges = dict()
+# Upper bounds of the histogram buckets, in seconds
+buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+server = None
+stopped = Event()
+
+
+def count(name, value=1, **labels):
+    if not enabled:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with lock:
+        counters[key] = counters.get(key, 0) + value
+
+def observe(name, seconds, **labels):
+    if not enabled:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with lock:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [0] * (len(buckets) + 2)
+        for i, bound in enumerate(buckets):
+            if seconds <= bound:
+                histogram[i] += 1
+                break
+        histogram[-2] += seconds
+        histogram[-1] += 1
+
+
+class _Timer(object):
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+class _NullTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+null_timer = _NullTimer()
+
+def timer(name, **labels):
+    # with metrics.timer("parse"): ... adds the time spent to the "parse" histogram
+    if not enabled:
+        return null_timer
+    return _Timer(name, labels)
+
+
+def register_gauge(name, read):
+    # read() returns a list of (labels, value) with labels a dict or None, e.g. [({"host": host}, depth), ...]
+    gauges[name] = read
+
+
+def _label_value(value):
+    # Escaped as the Prometheus text format requires, hosts come from crawled urls
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{label}="{_label_value(value)}"' for label, value in labels) + "}"
+
+def render() -> str:
+    # Prometheus text exposition format
+    lines = []
+    with lock:
+        counter_items = sorted(counters.items())
+        histogram_items = sorted((key, list(values)) for key, values in histograms.items())
+    last_name = None
+    for (name, labels), value in counter_items:
+        if name != last_name:
+            lines.append(f"# TYPE crawler_{name}_total counter")
+            last_name = name
+        lines.append(f"crawler_{name}_total{_labels_text(labels)} {value}")
+    for (name, labels), values in histogram_items:
+        if name != last_name:
+            lines.append(f"# TYPE crawler_{name}_seconds histogram")
+            last_name = name
+        cumulative = 0
+        for bound, bucket_count in zip(buckets, values):
+            cumulative += bucket_count
+            lines.append(f"crawler_{name}_seconds_bucket{_labels_text(labels + (('le', bound),))} {cumulative}")
+        lines.append(f"crawler_{name}_seconds_bucket{_labels_text(labels + (('le', '+Inf'),))} {values[-1]}")
+        lines.append(f"crawler_{name}_seconds_sum{_labels_text(labels)} {values[-2]}")
+        lines.append(f"crawler_{name}_seconds_count{_labels_text(labels)} {values[-1]}")
+    for name, read in sorted(gauges.items()):
+        lines.append(f"# TYPE crawler_{name} gauge")
+        for labels, value in read():
+            lines.append(f"crawler_{name}{_labels_text(tuple(sorted((labels or {}).items())))} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def summary() -> str:
+    # One line: calls and mean time of every timed stage over all labels, counter totals and gauge totals
+    stages = dict()
+    totals = dict()
+    with lock:
+        for (name, labels), values in histograms.items():
+            stage = stages.setdefault(name, [0.0, 0])
+            stage[0] += values[-2]
+            stage[1] += values[-1]
+        for (name, labels), value in counters.items():
+            totals[name] = totals.get(name, 0) + value
+    parts = [f"{name} {total / calls * 1000:.1f}ms x{calls}" for name, (total, calls) in sorted(stages.items()) if calls]
+    parts += [f"{name} {value}" for name, value in sorted(totals.items())]
+    for name, read in sorted(gauges.items()):
+        values = [value for labels, value in read()]
+        parts.append(f"{name} {sum(values)}" + (f" over {len(values)}" if len(values) > 1 else ""))
+    return ", ".join(parts)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _log_loop(interval, logger):
+    while not stopped.wait(interval):
+        logger.info(summary())
+
+
+def start(config):
+    ''' Turns the metrics on if METRICSINTERVAL or METRICSPORT is set: a summary
+    line is logged every METRICSINTERVAL seconds, and METRICSPORT serves them
+    on localhost in the Prometheus text format. '''
+    global enabled, server
+    if not config.metrics_interval and not config.metrics_port:
+        return
+    enabled = True
+    stopped.clear()
+    logger = get_logger("METRICS")
+    if config.metrics_interval:
+        Thread(target=_log_loop, args=(config.metrics_interval, logger), daemon=True).start()
+    if config.metrics_port:
+        server = ThreadingHTTPServer(("127.0.0.1", config.metrics_port), _Handler)
+        server.daemon_threads = True
+        Thread(target=server.serve_forever, daemon=True).start()
+        logger.info(f"Serving metrics on http://127.0.0.1:{config.metrics_port}/metrics")
+
+
+def stop():
+    # Turns the metrics off and drops them, a later Crawler in the same process starts over
+    global enabled, server
+    enabled = False
+    stopped.set()
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+        server = None
+    with lock:
+        counters.clear()
+        histograms.clear()
+    gauges.clear()
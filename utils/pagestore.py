@@ -0,0 +1,261 @@
+import hashlib
+import json
+import mmap
+import os
+import sqlite3
+import time
+import zlib
+
+from threading import Lock, local
+
+from requests.structures import CaseInsensitiveDict
+
+from utils import get_logger, get_urlhash
+from utils.response import Page, Response
+
+try:
+    import zstandard
+except ImportError: # zstandard is optional, pages are compressed with zlib without it
+    zstandard = None
+
+# Statuses whose page the scraper reads (pagegate.parsed_statuses), only their content is stored
+stored_statuses = frozenset((200, 301, 302))
+# What is read of a stored page, see PageStore._response
+page_columns = (
+    "pages.url, resp_url, status, error, page_url, headers, segment, offset, length, codec "
+    "FROM pages LEFT JOIN blobs ON pages.digest = blobs.digest")
+# A new segment file is started once the current one is this large
+segment_size = 256 * 1024 * 1024
+zlib_level = 6
+zstd_level = 3
+
+
+class PageStore(object):
+    ''' The pages the scraper was given, kept on disk so the crawl can be analyzed
+    again without the cache server, see reprocess.py. A directory of:
+
+    segment-NNNNN.pages -> append-only files of compressed page contents, each
+                           content stored once however many urls had it
+    index.sqlite        -> pages: the url asked for (keyed by get_urlhash), the
+                           response's url, status, error and headers and the
+                           content's blake2b digest, in the order they were stored.
+                           blobs: the segment, offset and length of every digest
+
+    Segments are read through mmap. Writes are batched like the frontier's save
+    file, segments are flushed before the index rows pointing into them are
+    committed. Opened readonly, nothing is written. '''
+
+    def __init__(self, path, compression="zlib", flush_size=500, flush_interval=5.0, readonly=False):
+        self.path = path
+        self.logger = get_logger("PAGESTORE")
+        if compression == "zstd" and zstandard is None:
+            self.logger.warning("zstandard is not installed, compressing pages with zlib.")
+            compression = "zlib"
+        self.codec = compression
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.readonly = readonly
+        self.lock = Lock()
+        # zstandard compressors can not be shared between threads
+        self.compressors = local()
+        index = os.path.join(path, "index.sqlite")
+        if readonly:
+            self.db = sqlite3.connect(f"file:{index}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.db = sqlite3.connect(index, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS pages (seq INTEGER PRIMARY KEY, urlhash TEXT UNIQUE NOT NULL, "
+                "url TEXT, resp_url TEXT, status INTEGER, error TEXT, page_url TEXT, headers TEXT, digest BLOB)")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS blobs (digest BLOB PRIMARY KEY, segment INTEGER, "
+                "offset INTEGER, length INTEGER, size INTEGER, codec TEXT)")
+            self.db.commit()
+        # Read only mappings of the segments, by number
+        self.maps = dict()
+        # Rows waiting for the next flush
+        self.pending_pages = list()
+        self.pending_blobs = list()
+        self.last_flush = time.time()
+        self.file = None
+        if not readonly:
+            self.digests = {digest for digest, in self.db.execute("SELECT digest FROM blobs")}
+            segments = [int(name[8:13]) for name in os.listdir(path) if name.startswith("segment-")]
+            self._open_segment(max(segments, default=0))
+
+    def _segment_path(self, segment):
+        return os.path.join(self.path, f"segment-{segment:05d}.pages")
+
+    def _open_segment(self, segment):
+        # Called with the lock held, or from __init__
+        if self.file is not None:
+            self.file.close()
+        self.segment = segment
+        self.file = open(self._segment_path(segment), "ab")
+        self.offset = self.file.tell()
+
+    def _compress(self, content):
+        if self.codec == "zstd":
+            compressor = getattr(self.compressors, "zstd", None)
+            if compressor is None:
+                compressor = self.compressors.zstd = zstandard.ZstdCompressor(level=zstd_level)
+            return compressor.compress(content)
+        return zlib.compress(content, zlib_level)
+
+    def add(self, url, resp):
+        # Stores the response the scraper got for url, replacing what was stored for it before
+        page = resp.raw_response if resp.status in stored_statuses else None
+        content = page.content if page is not None else b""
+        digest = hashlib.blake2b(content, digest_size=16).digest() if content else None
+        # Compressed outside the lock, a page already stored under another url is not compressed again
+        blob = self._compress(content) if digest is not None and digest not in self.digests else None
+        row = (
+            get_urlhash(url), url, resp.url, resp.status, None if resp.error is None else str(resp.error),
+            page.url if page is not None else None,
+            json.dumps(dict(page.headers)) if page is not None and page.headers else None,
+            digest)
+        with self.lock:
+            if blob is not None and digest not in self.digests:
+                self.digests.add(digest)
+                self.pending_blobs.append((digest, self.segment, self.offset, len(blob), len(content), self.codec))
+                self.file.write(blob)
+                self.offset += len(blob)
+                if self.offset >= segment_size:
+                    self.file.flush()
+                    self._open_segment(self.segment + 1)
+            self.pending_pages.append(row)
+            if len(self.pending_pages) >= self.flush_size or time.time() - self.last_flush >= self.flush_interval:
+                self._flush()
+
+    def _flush(self):
+        # Called with the lock held
+        self.file.flush()
+        with self.db:
+            self.db.executemany("INSERT OR IGNORE INTO blobs VALUES (?, ?, ?, ?, ?, ?)", self.pending_blobs)
+            self.db.executemany(
+                "INSERT OR REPLACE INTO pages (urlhash, url, resp_url, status, error, page_url, headers, digest) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", self.pending_pages)
+        self.pending_blobs = list()
+        self.pending_pages = list()
+        self.last_flush = time.time()
+
+    def _map(self, segment, end):
+        # Mapping of a segment that reaches at least end, mapped again if the segment grew since
+        mapped = self.maps.get(segment)
+        if mapped is None or len(mapped) < end:
+            if mapped is not None:
+                mapped.close()
+            with open(self._segment_path(segment), "rb") as file:
+                mapped = self.maps[segment] = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return mapped
+
+    def _read(self, segment, offset, length, codec):
+        data = self._map(segment, offset + length)[offset:offset + length]
+        if codec == "zstd":
+            if zstandard is None:
+                raise RuntimeError(f"{self.path} has zstd compressed pages, install zstandard to read them.")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return zlib.decompress(data)
+
+    def _response(self, row):
+        resp_url, status, error, page_url, headers, segment, offset, length, codec = row
+        page = None
+        if status in stored_statuses:
+            page = Page()
+            page.content = self._read(segment, offset, length, codec) if segment is not None else b""
+            page.headers = CaseInsensitiveDict(json.loads(headers) if headers else ())
+            page.url = page_url
+            page.status_code = status
+            page.encoding = None
+        return Response({"url": resp_url, "status": status, "error": error}, page=page)
+
+    def get(self, url):
+        # The stored Response for url, None if there is none
+        with self.lock:
+            if not self.readonly:
+                self._flush()
+            row = self.db.execute(
+                f"SELECT {page_columns} WHERE urlhash = ?", (get_urlhash(url),)).fetchone()
+            return self._response(row[1:]) if row else None
+
+    def __iter__(self):
+        # (url, Response) of every stored page, in the order they were stored
+        if not self.readonly:
+            with self.lock:
+                self._flush()
+        for row in self.db.execute(f"SELECT {page_columns} ORDER BY seq"):
+            yield row[0], self._response(row[1:])
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def sizes(self):
+        # Pages, distinct contents, their bytes and the bytes they take compressed
+        blobs, size, length = self.db.execute("SELECT COUNT(*), SUM(size), SUM(length) FROM blobs").fetchone()
+        return len(self), blobs, size or 0, length or 0
+
+    def close(self):
+        with self.lock:
+            if not self.readonly:
+                self._flush()
+                self.file.close()
+            for mapped in self.maps.values():
+                mapped.close()
+            self.maps.clear()
+            self.db.close()
+
+
+if __name__ == "__main__":
+    # Size on disk, write and read speed of a store holding a recorded or generated corpus,
+    # with every page stored under two urls to show the deduplication
+    import shutil
+    import tempfile
+    from argparse import ArgumentParser
+
+    import cbor
+
+    from utils.replay import build_synthetic_corpus
+
+    parser = ArgumentParser()
+    parser.add_argument("--corpus", type=str, default=None)
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--compression", type=str, default="zlib,zstd")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        corpus = args.corpus
+        if not corpus:
+            corpus = os.path.join(workdir, "synthetic.corpus")
+            build_synthetic_corpus(corpus, ["https://www.ics.uci.edu", "https://www.cs.uci.edu"], pages=args.pages)
+        db = sqlite3.connect(corpus)
+        responses = [(url, Response(cbor.loads(payload))) for url, payload in db.execute("SELECT url, payload FROM responses")]
+        db.close()
+        for url, resp in responses:
+            resp.raw_response
+        print(f"{len(responses)} responses, {sum(len(resp.content) for _, resp in responses) / 1024 ** 2:.1f} MiB of content")
+
+        for compression in args.compression.split(","):
+            path = os.path.join(workdir, compression)
+            store = PageStore(path, compression, flush_size=500)
+            codec = store.codec
+            start = time.perf_counter()
+            for url, resp in responses:
+                store.add(url, resp)
+                store.add(url + "?copy", resp)
+            store.close()
+            written = time.perf_counter() - start
+            on_disk = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+            store = PageStore(path, readonly=True)
+            pages, blobs, size, length = store.sizes()
+            start = time.perf_counter()
+            read = sum(len(resp.content) for _, resp in store)
+            elapsed = time.perf_counter() - start
+            store.close()
+            print(f"{codec:>5}: {pages} pages, {blobs} contents, {size / 1024 ** 2:.1f} MiB -> {length / 1024 ** 2:.1f} MiB "
+                  f"({size / max(length, 1):.1f}x), {on_disk / 1024 ** 2:.1f} MiB on disk with the index, "
+                  f"written at {pages / written:.0f} pages/s, read at {read / elapsed / 1024 ** 2:.0f} MiB/s "
+                  f"({pages / elapsed:.0f} pages/s)")
+            shutil.rmtree(path)
@@ -0,0 +1,232 @@
+import datetime
+import pickle
+import random
+import socket
+import sqlite3
+import time
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock, Semaphore
+from urllib.parse import urlparse, parse_qs
+
+import cbor
+import requests
+
+from utils import normalize
+
+
+class Corpus(object):
+    ''' Cache server responses kept on disk, the cbor payload exactly as the
+    cache server sent it, keyed by the url that was asked for. Written by
+    utils.download when RECORD is set, and served by ReplayServer. '''
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, payload BLOB NOT NULL)")
+        self.db.commit()
+
+    def record(self, url, payload: bytes):
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO responses (url, payload) VALUES (?, ?)", (url, payload))
+
+    def get(self, url):
+        with self.lock:
+            row = self.db.execute("SELECT payload FROM responses WHERE url = ?", (url,)).fetchone()
+        return row[0] if row else None
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+# Open corpora by path, shared by every thread recording into them
+corpora = dict()
+corpora_lock = Lock()
+
+def record(path, url, payload: bytes):
+    with corpora_lock:
+        corpus = corpora.get(path)
+        if corpus is None:
+            corpus = corpora[path] = Corpus(path)
+    corpus.record(url, payload)
+
+
+def make_payload(url, status, content=b"", content_type="text/html", error=None):
+    # cbor payload shaped like the cache server's: the page is a pickled requests.Response
+    payload = {"url": url, "status": status}
+    if error:
+        payload["error"] = error
+    else:
+        response = requests.models.Response()
+        response._content = content
+        response.status_code = status
+        response.reason = "OK" if status == 200 else None
+        response.url = url
+        response.encoding = "utf-8"
+        response.headers.update({
+            "Content-Type": content_type, "Content-Length": str(len(content)),
+            "Server": "Apache/2.4.37", "Date": "Mon, 01 Jan 2024 00:00:00 GMT"})
+        # what requests fills in for the cache server's own fetch
+        response.request = requests.Request("GET", url, headers={"User-Agent": "IR"}).prepare()
+        response.elapsed = datetime.timedelta(milliseconds=50)
+        payload["response"] = pickle.dumps(response)
+    return cbor.dumps(payload)
+
+
+class ReplayServer(object):
+    ''' Local stand-in for the cache server, answering downloads from a Corpus.
+    Every answer waits `latency` seconds on average (uniformly 0.5x to 1.5x),
+    and fails with a 503 with probability `error_rate`, which utils.download
+    retries. Urls that are not in the corpus get a cache error for status 404.
+    Point config.cache_server at the address start() returns.
+
+    To act like an overloaded cache server: with a capacity, only that many
+    requests are served at once, up to backlog more wait for their turn, and
+    the rest are answered with a 503 right away. spikes are (start, end, factor),
+    seconds after start() during which the latency is multiplied by factor.
+    answers has the (seconds after start(), status) of every answer. '''
+
+    def __init__(self, corpus_path, latency=0.0, error_rate=0.0, host="127.0.0.1", port=0, seed=None,
+                 capacity=0, backlog=0, spikes=()):
+        self.corpus = Corpus(corpus_path)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = Lock()
+        self.requests = 0
+        self.errors = 0
+        self.capacity = capacity
+        self.backlog = backlog
+        self.spikes = spikes
+        self.slots = Semaphore(capacity) if capacity else None
+        # Requests being served or waiting for a slot
+        self.admitted = 0
+        self.started = time.time()
+        self.answers = list()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+
+    def _handler(self):
+        replay = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep-alive, like the cache server, so the pooled sessions in utils.download are exercised
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # answers are small single writes, do not let them wait for delayed acks
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                url = parse_qs(urlparse(self.path).query).get("q", [""])[0]
+                with replay.lock:
+                    replay.requests += 1
+                    delay = replay.latency * replay.random.uniform(0.5, 1.5)
+                    for start, end, factor in replay.spikes:
+                        if start <= time.time() - replay.started < end:
+                            delay *= factor
+                    failed = replay.random.random() < replay.error_rate
+                    # Turned away without waiting when the backlog is full
+                    shed = replay.slots is not None and replay.admitted >= replay.capacity + replay.backlog
+                    replay.admitted += not shed
+                    replay.errors += failed or shed
+                if not shed:
+                    try:
+                        if replay.slots is not None:
+                            with replay.slots:
+                                time.sleep(delay)
+                        elif delay:
+                            time.sleep(delay)
+                    finally:
+                        with replay.lock:
+                            replay.admitted -= 1
+                if failed or shed:
+                    self._answer(503, b"")
+                    return
+                payload = replay.corpus.get(url)
+                if payload is None:
+                    payload = make_payload(url, 404, error=f"{url} is not in the replay corpus.")
+                self._answer(200, payload)
+
+            def _answer(self, status, payload):
+                with replay.lock:
+                    replay.answers.append((time.time() - replay.started, status))
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+    def start(self):
+        self.started = time.time()
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server.server_address
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.corpus.close()
+
+
+def build_synthetic_corpus(path, seed_urls, pages=2000, links=8, words=400, seed=0, subdomains=0, revisions=0):
+    ''' Fills a Corpus with a generated crawl for when there is no recorded one:
+    `pages` html pages spread over the hosts of the seed urls and `subdomains`
+    subdomains of each, each page with `words` words and `links` links to other
+    pages, plus a robots.txt per host.
+
+    With `revisions`, that many revision views of a few wiki pages are added,
+    the kind of trap the real crawl runs into: every one is a near-duplicate of
+    its wiki page and links to more of them, and every other page links to two. '''
+    rnd = random.Random(seed)
+    hosts = sorted({urlparse(url).netloc for url in seed_urls})
+    hosts += [f"sub{i}.{host[4:] if host.startswith('www.') else host}" for host in hosts for i in range(subdomains)]
+    urls = [f"https://{hosts[i % len(hosts)]}/page/{i}" for i in range(pages)]
+    vocabulary = [f"word{i}" for i in range(20000)]
+    wikis = [f"https://{hosts[i % len(hosts)]}/wiki/page{i}" for i in range(max(1, revisions // 50))]
+    # Canonical urls have their query parameters sorted
+    revision_urls = [f"{wikis[i % len(wikis)]}?do=diff&rev={i}" for i in range(revisions)]
+    traps = wikis + revision_urls if revisions else []
+    corpus = Corpus(path)
+
+    def page(title, link_count, text=None, trap_links=2):
+        text = text or rnd.choices(vocabulary, k=words)
+        anchors = [urls[rnd.randrange(pages)] for _ in range(link_count)]
+        if traps:
+            anchors += rnd.choices(traps, k=trap_links)
+        anchors = "".join(f'<a href="{url}">link</a>' for url in anchors)
+        return f"<html><head><title>{title}</title></head><body><p>{' '.join(text)}</p>{anchors}</body></html>".encode()
+
+    for url in seed_urls:
+        # the frontier fetches the canonical form of the seeds
+        url = normalize(url)
+        corpus.record(url, make_payload(url, 200, page(url, links * 4)))
+    for host in hosts:
+        for scheme in ("http", "https"):
+            corpus.record(f"{scheme}://{host}/robots.txt", make_payload(
+                f"{scheme}://{host}/robots.txt", 200, b"User-agent: *\nDisallow: /private/\n", "text/plain"))
+    for i, url in enumerate(urls):
+        corpus.record(url, make_payload(url, 200, page(f"Page {i}", links)))
+    if traps:
+        texts = [rnd.choices(vocabulary, k=words) for _ in wikis]
+        for i, url in enumerate(wikis):
+            corpus.record(url, make_payload(url, 200, page(f"Wiki {i}", 1, texts[i], links)))
+        for i, url in enumerate(revision_urls):
+            # A few words changed from the wiki page
+            text = list(texts[i % len(wikis)])
+            for _ in range(words // 100):
+                text[rnd.randrange(words)] = rnd.choice(vocabulary)
+            corpus.record(url, make_payload(url, 200, page(f"Revision {i}", 1, text, links)))
+    corpus.close()
@@ -1,14 +1,202 @@
 import pickle
 
+from requests.structures import CaseInsensitiveDict
+
+from utils import metrics
+
+
+class Page(object):
+    ''' What the crawler reads of the requests.Response the cache server pickles:
+    content, headers, url, status_code and encoding. The request, cookies,
+    history and timings that come with it are never built. '''
+    __slots__ = ("content", "headers", "url", "status_code", "encoding")
+
+    def __setstate__(self, state):
+        # requests.Response pickles a dict of its attributes
+        self.content = state.get("_content") or b""
+        self.headers = state.get("headers") or CaseInsensitiveDict()
+        self.url = state.get("url")
+        self.status_code = state.get("status_code")
+        self.encoding = state.get("encoding")
+
+
+class _Skipped(object):
+    # Stands in for every object of the pickle the crawler does not read
+    __slots__ = ()
+
+    def __new__(cls, *args, **kwargs):
+        return skipped
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __setstate__(self, state):
+        pass
+
+skipped = object.__new__(_Skipped)
+
+# Modules whose objects are skipped, requests.models.Response and the headers excepted
+skipped_modules = ("requests", "urllib3", "http.cookiejar", "datetime")
+
+
+class _PageUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if module == "requests.models" and name == "Response":
+            return Page
+        if module == "requests.structures" and name == "CaseInsensitiveDict":
+            return CaseInsensitiveDict
+        if module in skipped_modules or module.split(".")[0] in skipped_modules:
+            return _Skipped
+        return super().find_class(module, name)
+
+class _PayloadReader(object):
+    # The payload as a file for the unpickler. io.BytesIO hands out copies, these
+    # are slices of the payload, so the page content is copied once, into its bytes
+    __slots__ = ("payload", "view", "position")
+
+    def __init__(self, payload: bytes):
+        self.payload = payload
+        self.view = memoryview(payload)
+        self.position = 0
+
+    def read(self, size=-1):
+        end = len(self.payload) if size < 0 else self.position + size
+        data = self.view[self.position:end]
+        self.position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def readline(self):
+        end = self.payload.find(b"\n", self.position)
+        return bytes(self.read(end + 1 - self.position if end >= 0 else -1))
+
+def load_page(payload: bytes) -> Page:
+    with metrics.timer("unpickle"):
+        return _PageUnpickler(_PayloadReader(payload)).load()
+
+
 class Response(object):
-    def __init__(self, resp_dict):
+    ''' A cache server answer. url, status and error come straight from the cbor
+    payload. The page, raw_response, is only unpickled the first time it is
+    read, so answers that are rejected on their status never pay for it, and
+    release() drops it once the page has been scraped. A page that is already
+    loaded, such as one read back from utils.pagestore, can be passed as page. '''
+    __slots__ = ("url", "status", "error", "_payload", "_page")
+
+    def __init__(self, resp_dict, page=None):
         self.url = resp_dict["url"]
         self.status = resp_dict["status"]
         self.error = resp_dict["error"] if "error" in resp_dict else None
-        try:
-            self.raw_response = (
-                pickle.loads(resp_dict["response"])
-                if "response" in resp_dict else
-                None)
-        except TypeError:
-            self.raw_response = None
+        self._payload = resp_dict["response"] if "response" in resp_dict else None
+        self._page = page
+
+    @property
+    def raw_response(self):
+        if self._payload is not None:
+            payload, self._payload = self._payload, None
+            try:
+                self._page = load_page(payload)
+            except (TypeError, ValueError, EOFError, AttributeError, ImportError, pickle.UnpicklingError):
+                self._page = None
+        return self._page
+
+    @property
+    def complete(self) -> bool:
+        # False if the pickled page is cut off, it would only fail once read. Every pickle ends with STOP
+        return self._payload is None or self._payload.endswith(pickle.STOP)
+
+    @property
+    def content(self) -> bytes:
+        # The page's bytes as unpickled, not copied again
+        page = self.raw_response
+        return page.content if page is not None else b""
+
+    @property
+    def headers(self):
+        page = self.raw_response
+        return page.headers if page is not None else CaseInsensitiveDict()
+
+    def release(self):
+        # Frees the payload and the page, raw_response is None from then on
+        self._payload = None
+        self._page = None
+
+
+if __name__ == "__main__":
+    # Allocations, peak memory and time per page of the eager Response this replaced
+    # and of this one, on a corpus recorded with RECORD or a generated one
+    import os
+    import sqlite3
+    import tempfile
+    import time
+    import tracemalloc
+    from argparse import ArgumentParser
+
+    import cbor
+
+    from utils.replay import build_synthetic_corpus
+
+    class EagerResponse(object):
+        def __init__(self, resp_dict):
+            self.url = resp_dict["url"]
+            self.status = resp_dict["status"]
+            self.error = resp_dict["error"] if "error" in resp_dict else None
+            try:
+                self.raw_response = (
+                    pickle.loads(resp_dict["response"])
+                    if "response" in resp_dict else
+                    None)
+            except TypeError:
+                self.raw_response = None
+
+    parser = ArgumentParser()
+    parser.add_argument("--corpus", type=str, default=None)
+    parser.add_argument("--pages", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        corpus = args.corpus
+        if not corpus:
+            corpus = os.path.join(workdir, "synthetic.corpus")
+            build_synthetic_corpus(corpus, ["https://www.ics.uci.edu", "https://www.cs.uci.edu"], pages=args.pages)
+        db = sqlite3.connect(corpus)
+        payloads = [payload for payload, in db.execute("SELECT payload FROM responses")]
+        db.close()
+    print(f"{len(payloads)} responses, {sum(map(len, payloads)) / len(payloads) / 1024:.1f} KiB cbor on average")
+
+    def scrape(resp):
+        # What the scraper touches: the status, the headers and content for the gate and the parser
+        if resp.status in (200, 301, 302) and resp.raw_response is not None:
+            resp.raw_response.headers.get("Content-Type")
+            len(resp.raw_response.content)
+
+    for name, cls in (("eager", EagerResponse), ("lazy", Response)):
+        allocations = 0
+        peaks = 0
+        scraping = 0
+        held = 0
+        elapsed = 0
+        for payload in payloads:
+            tracemalloc.start()
+            start = time.perf_counter()
+            resp = cls(cbor.loads(payload))
+            scrape(resp)
+            elapsed += time.perf_counter() - start
+            current, peak = tracemalloc.get_traced_memory()
+            allocations += sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+            scraping += current
+            peaks += peak
+            # What the worker holds on to until its next download, the scraper releases the page when done
+            if hasattr(resp, "release"):
+                resp.release()
+            held += tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            del resp
+        count = len(payloads)
+        print(f"{name:>6}: {allocations / count:6.1f} blocks and {scraping / count / 1024:6.1f} KiB live while scraping, "
+              f"{peaks / count / 1024:6.1f} KiB peak, {held / count / 1024:6.1f} KiB held after, "
+              f"{elapsed / count * 1e6:6.1f} us per page")